@@ -3,24 +3,40 @@ Telegram-бот для записи силовых упражнений
 Использует aiogram 3.x для работы с Telegram Bot API
 """
 import os
+import json
 import logging
+import math
 import time
 import asyncio
-from functools import wraps
-from datetime import datetime, date
+import tempfile
+import secrets
+import signal
+from datetime import datetime, date, timedelta, timezone
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-import aiosqlite
-from metrics import (
-    users_total, users_active_today, operations_total, operations_today,
-    programs_total, programs_active, records_total, records_today,
-    request_duration, request_errors, update_system_metrics
-)
+from fsm_storage import SQLiteStorage
+from db_pool import ConnectionPool
+import queries
+from write_behind import WriteBehindQueue
+from user_cache import UserProfileCache
+from program_cache import ProgramCache
+from outbound import OutboundScheduler, bulk_sends
+from card_editor import DebouncedEditor
+from stats_aggregator import StatsAggregator
+from retention import OperationsRetention
+from program_import import parse_program_text, iter_import_rows
+from charts import CHARTS_AVAILABLE, ChartQueueFull, ChartRenderer
+from exercise_catalog import normalize_exercise_name, resolve_exercise
+from record_export import EXPORT_FORMATS, EXPORT_PAGE_QUERY, RecordsExportWriter, export_filename
+from db_init import migrate_database
+from middlewares import setup_middlewares, label_request
+from metrics import SystemMetricsSampler
+from loop_monitor import LoopMonitor
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -35,14 +51,124 @@ logger = logging.getLogger(__name__)
 # Константы
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 DATABASE_PATH = os.getenv('DATABASE', './data/gym.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+WRITE_BEHIND_FLUSH_MS = int(os.getenv('WRITE_BEHIND_FLUSH_MS', '200'))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '200'))
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv('WRITE_BEHIND_MAX_QUEUE', '10000'))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', '5'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '3600'))
+USER_TOUCH_INTERVAL = int(os.getenv('USER_TOUCH_INTERVAL', '60'))
+PROGRAM_CACHE_SIZE = int(os.getenv('PROGRAM_CACHE_SIZE', '1000'))
+PROGRAM_CACHE_TTL = int(os.getenv('PROGRAM_CACHE_TTL', '60'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', '3'))
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+WORKOUT_LIVE_CARD = os.getenv('WORKOUT_LIVE_CARD', 'true').lower() == 'true'
+CARD_EDIT_DELAY_MS = int(os.getenv('CARD_EDIT_DELAY_MS', '300'))
+SYSTEM_METRICS_INTERVAL = int(os.getenv('SYSTEM_METRICS_INTERVAL', '15'))
+LOOP_LAG_INTERVAL_MS = int(os.getenv('LOOP_LAG_INTERVAL_MS', '500'))
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '100'))
+SLOW_CALLBACK_MS = int(os.getenv('SLOW_CALLBACK_MS', '200'))
+STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', '21600'))
+OPERATIONS_RETENTION_DAYS = int(os.getenv('OPERATIONS_RETENTION_DAYS', '90'))
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '3600'))
+RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', '1000'))
+VACUUM_STEP_PAGES = int(os.getenv('VACUUM_STEP_PAGES', '256'))
+REPORT_PAGE_ROWS = int(os.getenv('REPORT_PAGE_ROWS', '300'))
+REPORT_MAX_LENGTH = 4000
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # лимит Bot API на скачивание файлов
+IMPORT_REJECTED_SHOWN = 20
+EXERCISE_MATCH_THRESHOLD = float(os.getenv('EXERCISE_MATCH_THRESHOLD', '0.7'))
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '1000'))
+EXPORT_MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', '2'))
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024  # лимит Bot API на отправку файлов
+CHART_CACHE_DIR = os.getenv('CHART_CACHE_DIR', './data/charts')
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', '500'))
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+CHART_MAX_PENDING = int(os.getenv('CHART_MAX_PENDING', '8'))
+# Упражнений на одной странице выбора графика
+CHART_PAGE_EXERCISES = 30
+# Флаги улучшения личного рекорда (personal_records.last_improvement)
+PR_WEIGHT = 1
+PR_VOLUME = 2
+# Периоды графика (дней); 0 - всё время
+CHART_PERIODS = {30: "30 дней", 90: "90 дней", 365: "Год", 0: "Всё время"}
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+FSM_FLUSH_DELAY_MS = int(os.getenv('FSM_FLUSH_DELAY_MS', '50'))
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONCURRENT = int(os.getenv('WEBHOOK_MAX_CONCURRENT', '64'))
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен в переменных окружения!")
 
+# Общий пул соединений с БД (открывается в main())
+db_pool = ConnectionPool(DATABASE_PATH, size=DB_POOL_SIZE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS)
+
 # Инициализация бота и диспетчера
+# Состояния FSM хранятся в БД, чтобы тренировка продолжалась после перезапуска
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+
+# Исходящие запросы проходят через планировщик с лимитами Telegram
+outbound_scheduler = OutboundScheduler(
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    max_retries=OUTBOUND_MAX_RETRIES
+)
+bot.session.middleware(outbound_scheduler)
+
+# Отложенное редактирование карточек тренировки
+card_editor = DebouncedEditor(bot, delay_ms=CARD_EDIT_DELAY_MS)
+if FSM_STORAGE == 'sqlite':
+    storage = SQLiteStorage(db_pool, cache_size=FSM_CACHE_SIZE, flush_delay_ms=FSM_FLUSH_DELAY_MS)
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+# Ожидающие правки карточек отправляются до закрытия сессии бота
+dp.shutdown.register(card_editor.flush)
+
+# Очередь отложенной записи для регистрации пользователей и журнала операций
+write_queue = WriteBehindQueue(
+    db_pool,
+    flush_interval_ms=WRITE_BEHIND_FLUSH_MS,
+    batch_size=WRITE_BEHIND_BATCH_SIZE,
+    max_queue=WRITE_BEHIND_MAX_QUEUE,
+    max_retries=WRITE_BEHIND_MAX_RETRIES
+)
+
+# Кэш профилей пользователей, уже сохранённых в БД
+user_cache = UserProfileCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# Порог медленных запросов к БД (в журнал пишется план запроса)
+queries.set_slow_query_threshold(SLOW_QUERY_MS)
+
+# Мониторинг задержек и блокировок цикла событий
+loop_monitor = LoopMonitor(interval_ms=LOOP_LAG_INTERVAL_MS, slow_threshold_ms=SLOW_CALLBACK_MS)
+
+# Кэш активных программ и планов упражнений
+program_cache = ProgramCache(max_plans=PROGRAM_CACHE_SIZE, ttl=PROGRAM_CACHE_TTL)
+
+# Ограничение одновременных выгрузок: экспорт не должен занимать пул соединений и CPU целиком
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+# Отрисовка графиков прогресса в пуле процессов и дисковый кэш изображений
+chart_renderer = ChartRenderer(
+    CHART_CACHE_DIR, max_entries=CHART_CACHE_SIZE, workers=CHART_WORKERS, max_pending=CHART_MAX_PENDING
+)
+
+# Инкрементальные счётчики для метрик БД
+stats = StatsAggregator(db_pool)
+
+# Свёртка и удаление старых строк журнала операций
+retention = OperationsRetention(db_pool, OPERATIONS_RETENTION_DAYS, RETENTION_CHUNK_SIZE, VACUUM_STEP_PAGES)
 
 
 # FSM состояния
@@ -50,161 +176,66 @@ class WorkoutStates(StatesGroup):
     waiting_for_program_name = State()
     waiting_for_program_text = State()
     waiting_for_weight = State()
+    waiting_for_import_file = State()
 
 
 # Функции для работы с пользователями
 async def register_user(user_id: int, username: str = None, first_name: str = None, last_name: str = None):
     """Регистрация или обновление информации о пользователе"""
+    profile = (username, first_name, last_name)
+    
+    # Профиль не изменился - достаточно отметить активность
+    if user_cache.matches(user_id, profile):
+        user_cache.touch(user_id)
+        return
+    
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute('''
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, last_activity)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, username, first_name, last_name))
-            await db.commit()
+        await write_queue.put('''
+            INSERT INTO users (user_id, username, first_name, last_name, last_activity)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                last_activity = CURRENT_TIMESTAMP
+        ''', (user_id, username, first_name, last_name))
+        user_cache.remember(user_id, profile)
     except Exception as e:
         logger.error(f"Ошибка при регистрации пользователя: {e}")
 
 
+async def flush_user_touches():
+    """Записать накопленные отметки активности пользователей"""
+    for user_id in user_cache.drain_touches():
+        try:
+            await write_queue.put(
+                'UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?',
+                (user_id,)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении активности пользователя: {e}")
+
+
 async def log_operation(user_id: int, operation_type: str):
     """Логирование операции пользователя"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute('''
-                INSERT INTO operations (user_id, operation_type)
-                VALUES (?, ?)
-            ''', (user_id, operation_type))
-            await db.commit()
+        await write_queue.put('''
+            INSERT INTO operations (user_id, operation_type)
+            VALUES (?, ?)
+        ''', (user_id, operation_type))
     except Exception as e:
         logger.error(f"Ошибка при логировании операции: {e}")
 
 
-# Декоратор для отслеживания операций
-def track_operation(operation_type: str):
-    """Декоратор для отслеживания операций и метрик"""
-    def decorator(func):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            # Получаем user_id из аргументов (args и kwargs)
-            user_id = None
-            
-            # Проверяем args
-            for arg in args:
-                if isinstance(arg, Message):
-                    user_id = arg.from_user.id
-                    # Регистрируем пользователя
-                    await register_user(
-                        user_id=arg.from_user.id,
-                        username=arg.from_user.username,
-                        first_name=arg.from_user.first_name,
-                        last_name=arg.from_user.last_name
-                    )
-                    break
-                elif isinstance(arg, CallbackQuery):
-                    user_id = arg.from_user.id
-                    await register_user(
-                        user_id=arg.from_user.id,
-                        username=arg.from_user.username,
-                        first_name=arg.from_user.first_name,
-                        last_name=arg.from_user.last_name
-                    )
-                    break
-            
-            # Проверяем kwargs (на случай, если aiogram передает через dependency injection)
-            if not user_id:
-                for key, value in kwargs.items():
-                    if isinstance(value, Message):
-                        user_id = value.from_user.id
-                        await register_user(
-                            user_id=value.from_user.id,
-                            username=value.from_user.username,
-                            first_name=value.from_user.first_name,
-                            last_name=value.from_user.last_name
-                        )
-                        break
-                    elif isinstance(value, CallbackQuery):
-                        user_id = value.from_user.id
-                        await register_user(
-                            user_id=value.from_user.id,
-                            username=value.from_user.username,
-                            first_name=value.from_user.first_name,
-                            last_name=value.from_user.last_name
-                        )
-                        break
-            
-            # Логируем операцию
-            if user_id:
-                await log_operation(user_id, operation_type)
-                operations_total.labels(operation_type=operation_type).inc()
-            
-            # Отслеживаем время выполнения
-            start_time = time.time()
-            try:
-                # Передаем все аргументы как есть (включая возможные dependency injection аргументы)
-                result = await func(*args, **kwargs)
-                duration = time.time() - start_time
-                request_duration.labels(handler=operation_type).observe(duration)
-                return result
-            except Exception as e:
-                request_errors.labels(error_type=type(e).__name__).inc()
-                raise
-        
-        # Сохраняем оригинальную сигнатуру функции
-        wrapper.__signature__ = func.__signature__ if hasattr(func, '__signature__') else None
-        return wrapper
-    return decorator
+# Middleware: регистрация пользователей, журнал операций и метрики обработчиков
+setup_middlewares(dp, register_user, log_operation)
 
 
 async def update_metrics():
-    """Обновление метрик из базы данных"""
+    """Обновление метрик из сводных таблиц БД
+    (системные метрики обновляет фоновый поток SystemMetricsSampler)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Пользователи
-            cursor = await db.execute('SELECT COUNT(*) FROM users')
-            total_users = (await cursor.fetchone())[0]
-            users_total.set(total_users)
-            
-            # Активные пользователи за сегодня
-            today = date.today().isoformat()
-            cursor = await db.execute('''
-                SELECT COUNT(DISTINCT user_id) FROM operations 
-                WHERE date(created_at) = ?
-            ''', (today,))
-            active_today = (await cursor.fetchone())[0]
-            users_active_today.set(active_today)
-            
-            # Программы
-            cursor = await db.execute('SELECT COUNT(*) FROM programs')
-            total_programs = (await cursor.fetchone())[0]
-            programs_total.set(total_programs)
-            
-            cursor = await db.execute('SELECT COUNT(*) FROM programs WHERE active = 1')
-            active_programs = (await cursor.fetchone())[0]
-            programs_active.set(active_programs)
-            
-            # Записи
-            cursor = await db.execute('SELECT COUNT(*) FROM records')
-            total_records = (await cursor.fetchone())[0]
-            records_total.set(total_records)
-            
-            cursor = await db.execute('SELECT COUNT(*) FROM records WHERE date = ?', (today,))
-            records_today_count = (await cursor.fetchone())[0]
-            records_today.set(records_today_count)
-            
-            # Операции за сегодня
-            cursor = await db.execute('''
-                SELECT operation_type, COUNT(*) 
-                FROM operations 
-                WHERE date(created_at) = ?
-                GROUP BY operation_type
-            ''', (today,))
-            async for row in cursor:
-                op_type, count = row
-                operations_today.labels(operation_type=op_type).set(count)
-            
-            # Системные метрики
-            update_system_metrics()
-            
+        await stats.refresh()
     except Exception as e:
         logger.error(f"Ошибка при обновлении метрик: {e}")
 
@@ -213,9 +244,10 @@ async def update_metrics():
 async def archive_all_programs():
     """Архивировать все программы (active=0)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute('UPDATE programs SET active = 0')
+        async with db_pool.acquire() as db:
+            await queries.execute(db, 'archive_programs', 'UPDATE programs SET active = 0')
             await db.commit()
+        program_cache.invalidate()
     except Exception as e:
         logger.error(f"Ошибка при архивировании программ: {e}")
         raise
@@ -224,121 +256,301 @@ async def archive_all_programs():
 async def delete_all_programs():
     """Удалить все программы и связанные данные"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Удаляем записи тренировок
-            await db.execute('DELETE FROM records')
+        async with db_pool.acquire() as db:
+            # Удаляем записи тренировок и их агрегаты
+            await queries.execute(db, 'delete_daily_exercise_stats', 'DELETE FROM daily_exercise_stats')
+            await queries.execute(db, 'delete_records', 'DELETE FROM records')
+            await queries.execute(db, 'delete_personal_records', 'DELETE FROM personal_records')
             # Удаляем упражнения
-            await db.execute('DELETE FROM exercises')
+            await queries.execute(db, 'delete_exercises', 'DELETE FROM exercises')
             # Удаляем программы
-            await db.execute('DELETE FROM programs')
+            await queries.execute(db, 'delete_programs', 'DELETE FROM programs')
             await db.commit()
+        program_cache.invalidate()
     except Exception as e:
         logger.error(f"Ошибка при удалении программ: {e}")
         raise
 
 
-async def create_program(name: str) -> int:
-    """Создать новую программу и вернуть её ID"""
+async def resolve_canonical_exercises(db, names, resolved: dict) -> dict:
+    """Дополнить resolved записями каталога для названий: {название: (ID в каталоге, название в каталоге)}.
+    Сопоставление - exercise_catalog.resolve_exercise, запросы выполняются в транзакции db."""
+    for name in names:
+        if name in resolved:
+            continue
+        steps = resolve_exercise(name, EXERCISE_MATCH_THRESHOLD)
+        rows = None
+        while True:
+            try:
+                query_name, sql, params = steps.send(rows)
+            except StopIteration as result:
+                resolved[name] = result.value
+                break
+            rows = await queries.fetchall(db, query_name, sql, params)
+    return resolved
+
+
+async def create_program(name: str, exercises: list = ()) -> tuple:
+    """Создать новую программу с упражнениями одной транзакцией.
+    exercises - список (день, упражнение, подходы, позиция).
+    Возвращает ID программы и упражнения, сопоставленные с другим написанием в каталоге:
+    список (название, название в каталоге)."""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute(
+        async with db_pool.acquire() as db:
+            cursor = await queries.execute(
+                db, 'insert_program',
                 'INSERT INTO programs (name, active) VALUES (?, 1)',
                 (name,)
             )
+            program_id = cursor.lastrowid
+            catalog = await resolve_canonical_exercises(db, [exercise for _, exercise, _, _ in exercises], {})
+            await queries.executemany(
+                db, 'insert_exercises',
+                'INSERT INTO exercises (program_id, day, exercise, sets, position, canonical_exercise_id) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(program_id, day, exercise, sets, position, catalog[exercise][0])
+                 for day, exercise, sets, position in exercises]
+            )
             await db.commit()
-            return cursor.lastrowid
+        program_cache.invalidate()
+        # Регистр, ё/е и пробелы не считаются другим написанием
+        matched = [(exercise, catalog_name) for exercise, (_, catalog_name) in catalog.items()
+                   if normalize_exercise_name(exercise) != normalize_exercise_name(catalog_name)]
+        return program_id, matched
     except Exception as e:
         logger.error(f"Ошибка при создании программы: {e}")
         raise
 
 
-async def add_exercise(program_id: int, day: str, exercise: str, sets: int, position: int):
-    """Добавить упражнение в программу"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
-            'INSERT INTO exercises (program_id, day, exercise, sets, position) VALUES (?, ?, ?, ?, ?)',
-            (program_id, day, exercise, sets, position)
+async def import_programs(rows) -> dict:
+    """Массовый импорт программ из потока строк разборщика program_import.
+    Строки записываются пакетами по IMPORT_BATCH_SIZE упражнений, каждый пакет - одна транзакция.
+    Возвращает статистику импорта: программы, упражнения, отклонённые строки."""
+    program_ids = {}
+    positions = {}
+    # Записи каталога для названий, уже встречавшихся в файле
+    catalog = {}
+    result = {'programs': 0, 'exercises': 0, 'rejected': []}
+    batch = []
+    
+    async def flush():
+        async with db_pool.acquire() as db:
+            for program_name, day, exercise, sets in batch:
+                if program_name not in program_ids:
+                    cursor = await queries.execute(
+                        db, 'insert_program',
+                        'INSERT INTO programs (name, active) VALUES (?, 1)',
+                        (program_name,)
+                    )
+                    program_ids[program_name] = cursor.lastrowid
+                    positions[program_name] = 0
+                    result['programs'] += 1
+            await resolve_canonical_exercises(db, [exercise for _, _, exercise, _ in batch], catalog)
+            exercise_rows = []
+            for program_name, day, exercise, sets in batch:
+                exercise_rows.append((
+                    program_ids[program_name], day, exercise, sets, positions[program_name], catalog[exercise][0]
+                ))
+                positions[program_name] += 1
+            await queries.executemany(
+                db, 'insert_exercises',
+                'INSERT INTO exercises (program_id, day, exercise, sets, position, canonical_exercise_id) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                exercise_rows
+            )
+            await db.commit()
+        program_cache.invalidate()
+        result['exercises'] += len(batch)
+        batch.clear()
+    
+    for line_no, row, error in rows:
+        if error:
+            result['rejected'].append((line_no, error))
+            continue
+        batch.append(row)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+    return result
+
+
+async def load_active_programs():
+    """Загрузить из БД список активных программ"""
+    async with db_pool.acquire() as db:
+        return await queries.fetchall(
+            db, 'active_programs', 'SELECT id, name FROM programs WHERE active = 1 ORDER BY created_at ASC'
         )
-        await db.commit()
 
 
-async def get_active_programs():
-    """Получить список активных программ"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute('SELECT id, name FROM programs WHERE active = 1 ORDER BY created_at ASC') as cursor:
-            return await cursor.fetchall()
+async def get_active_programs() -> dict:
+    """Активные программы {id: название} в порядке создания (из кэша)"""
+    return await program_cache.active_programs(load_active_programs)
 
 
 async def get_all_programs():
     """Получить список всех программ (активных и архивных)"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute('SELECT id, name, active, created_at FROM programs ORDER BY created_at ASC') as cursor:
-            return await cursor.fetchall()
+    async with db_pool.acquire() as db:
+        return await queries.fetchall(
+            db, 'all_programs', 'SELECT id, name, active, created_at FROM programs ORDER BY created_at ASC'
+        )
 
 
-async def get_program_exercises(program_id: int):
-    """Получить упражнения программы, отсортированные по position"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
+async def load_program_exercises(program_id: int):
+    """Загрузить из БД упражнения программы, отсортированные по position"""
+    async with db_pool.acquire() as db:
+        return await queries.fetchall(
+            db, 'program_exercises',
             'SELECT id, day, exercise, sets, position FROM exercises WHERE program_id = ? ORDER BY position',
             (program_id,)
-        ) as cursor:
-            return await cursor.fetchall()
+        )
+
 
+async def get_program_exercises(program_id: int) -> tuple:
+    """Упражнения программы, отсортированные по position (из кэша)"""
+    return await program_cache.plan(program_id, load_program_exercises)
 
-async def save_record(program_id: int, exercise_id: int, set_number: int, weight: float):
-    """Сохранить запись о выполнении подхода"""
+
+async def save_record(program_id: int, exercise_id: int, set_number: int, weight: float) -> tuple:
+    """Сохранить запись о выполнении подхода, обновить агрегаты за день и личный рекорд.
+    Возвращает (флаги улучшения рекорда PR_WEIGHT | PR_VOLUME, рекорд объёма за день)."""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                'INSERT INTO records (program_id, exercise_id, set_number, weight, date) VALUES (?, ?, ?, ?, date("now"))',
+        async with db_pool.acquire() as db:
+            record_date, created_at = await queries.fetchone(
+                db, 'insert_record',
+                'INSERT INTO records (program_id, exercise_id, set_number, weight, date) VALUES (?, ?, ?, ?, date("now")) '
+                'RETURNING date, created_at',
                 (program_id, exercise_id, set_number, weight)
             )
+            # Агрегат обновляется в той же транзакции, что и запись
+            await queries.execute(db, 'upsert_daily_exercise_stats', '''
+                INSERT INTO daily_exercise_stats
+                    (date, program_id, exercise_id, set_count, weights, total_volume, max_weight, first_created_at)
+                VALUES (?, ?, ?, 1, json_array(?), COALESCE(?, 0), ?, ?)
+                ON CONFLICT(date, program_id, exercise_id) DO UPDATE SET
+                    set_count = set_count + 1,
+                    weights = json_insert(weights, '$[#]', excluded.max_weight),
+                    total_volume = total_volume + excluded.total_volume,
+                    max_weight = MAX(COALESCE(max_weight, excluded.max_weight), COALESCE(excluded.max_weight, max_weight))
+            ''', (record_date, program_id, exercise_id, weight, weight, weight, created_at))
+            # Личный рекорд: одна строка на упражнение каталога. Выражения SET видят прежние значения строки,
+            # поэтому флаги улучшения вычисляются тем же запросом.
+            # Объём дня - сумма по всем программам с этим упражнением каталога (индексы по
+            # canonical_exercise_id и (exercise_id, date)). Рекорд объёма отмечается один раз за день -
+            # когда объём дня превысил рекорд другого дня.
+            row = await queries.fetchone(db, 'upsert_personal_record', '''
+                INSERT INTO personal_records
+                    (canonical_exercise_id, max_weight, max_weight_set, max_weight_date, best_volume, best_volume_date)
+                SELECT e.canonical_exercise_id, ?, ?, ?, (
+                    SELECT SUM(s.total_volume)
+                    FROM exercises x
+                    JOIN daily_exercise_stats s ON s.exercise_id = x.id
+                    WHERE x.canonical_exercise_id = e.canonical_exercise_id AND s.date = ?
+                ), ?
+                FROM exercises e
+                WHERE e.id = ? AND e.canonical_exercise_id IS NOT NULL
+                ON CONFLICT(canonical_exercise_id) DO UPDATE SET
+                    max_weight = MAX(max_weight, excluded.max_weight),
+                    max_weight_set = CASE WHEN excluded.max_weight > max_weight
+                        THEN excluded.max_weight_set ELSE max_weight_set END,
+                    max_weight_date = CASE WHEN excluded.max_weight > max_weight
+                        THEN excluded.max_weight_date ELSE max_weight_date END,
+                    best_volume = MAX(best_volume, excluded.best_volume),
+                    best_volume_date = CASE WHEN excluded.best_volume > best_volume
+                        THEN excluded.best_volume_date ELSE best_volume_date END,
+                    last_improvement = (excluded.max_weight > max_weight) * ?
+                        + (excluded.best_volume > best_volume
+                           AND excluded.best_volume_date IS NOT best_volume_date) * ?,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING last_improvement, best_volume
+            ''', (weight, set_number, record_date, record_date, record_date, exercise_id, PR_WEIGHT, PR_VOLUME))
             await db.commit()
+        return (row[0], row[1]) if row else (0, 0.0)
     except Exception as e:
         logger.error(f"Ошибка при сохранении записи в БД: {e}")
         raise
 
 
+def utc_day_range(days: int) -> tuple:
+    """Полуоткрытый диапазон дат [начало, завтра) за последние days дней по UTC,
+    как в date('now') при сохранении записи"""
+    tomorrow = datetime.now(timezone.utc).date() + timedelta(days=1)
+    return (tomorrow - timedelta(days=days)).isoformat(), tomorrow.isoformat()
+
+
 async def get_records_day():
-    """Получить записи за сегодня"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute('''
-            SELECT r.date, p.name, e.exercise, r.set_number, r.weight
-            FROM records r
-            JOIN programs p ON r.program_id = p.id
-            JOIN exercises e ON r.exercise_id = e.id
-            WHERE r.date = date('now')
-            ORDER BY r.created_at
-        ''') as cursor:
-            return await cursor.fetchall()
+    """Получить агрегаты подходов за сегодня"""
+    return await get_report_rows(*utc_day_range(1))
 
 
 async def get_records_week():
-    """Получить записи за неделю"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute('''
-            SELECT r.date, p.name, e.exercise, r.set_number, r.weight
-            FROM records r
-            JOIN programs p ON r.program_id = p.id
-            JOIN exercises e ON r.exercise_id = e.id
-            WHERE r.date >= date('now', '-7 days')
-            ORDER BY r.date, r.created_at
-        ''') as cursor:
-            return await cursor.fetchall()
-
-
-async def get_records_all():
-    """Получить все записи"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute('''
-            SELECT r.date, p.name, e.exercise, r.set_number, r.weight
-            FROM records r
-            JOIN programs p ON r.program_id = p.id
-            JOIN exercises e ON r.exercise_id = e.id
-            ORDER BY r.date DESC, r.created_at
-        ''') as cursor:
-            return await cursor.fetchall()
+    """Получить агрегаты подходов за неделю"""
+    return await get_report_rows(*utc_day_range(8))
+
+
+async def get_report_rows(start_date: str, end_date: str):
+    """Получить строки отчёта (дата, программа, упражнение, веса) за диапазон дат [start_date, end_date)"""
+    async with db_pool.acquire() as db:
+        rows = await queries.fetchall(db, 'report_rows', '''
+            SELECT s.date, p.name, e.exercise, s.weights
+            FROM daily_exercise_stats s
+            JOIN programs p ON s.program_id = p.id
+            JOIN exercises e ON s.exercise_id = e.id
+            WHERE s.date >= ? AND s.date < ?
+            ORDER BY s.date, s.first_created_at, s.id
+        ''', (start_date, end_date))
+    return [
+        (date_str, program_name, exercise, json.loads(weights))
+        for date_str, program_name, exercise, weights in rows
+    ]
+
+
+async def get_records_page(anchor_id: int = None, backward: bool = False, limit: int = None):
+    """Получить страницу строк отчёта за всё время в порядке (date DESC, first_created_at, id).
+    Вперёд - начиная со строки anchor_id включительно, назад - строки перед anchor_id.
+    Возвращает None, если строки anchor_id больше нет."""
+    limit = limit or REPORT_PAGE_ROWS
+    query = '''
+        SELECT s.id, s.date, p.name, e.exercise, s.weights
+        FROM daily_exercise_stats s
+        JOIN programs p ON s.program_id = p.id
+        JOIN exercises e ON s.exercise_id = e.id
+    '''
+    async with db_pool.acquire() as db:
+        if anchor_id is None:
+            query += 'ORDER BY s.date DESC, s.first_created_at, s.id LIMIT ?'
+            params = (limit,)
+        else:
+            anchor = await queries.fetchone(
+                db, 'report_page_anchor',
+                'SELECT date, first_created_at FROM daily_exercise_stats WHERE id = ?', (anchor_id,)
+            )
+            if anchor is None:
+                return None
+            anchor_date, anchor_created_at = anchor
+            # Условие по s.date вынесено отдельно, чтобы поиск шёл по индексу (date, first_created_at)
+            if backward:
+                query += '''
+                    WHERE s.date >= ? AND (s.date > ? OR s.first_created_at < ?
+                        OR (s.first_created_at = ? AND s.id < ?))
+                    ORDER BY s.date, s.first_created_at DESC, s.id DESC LIMIT ?
+                '''
+            else:
+                query += '''
+                    WHERE s.date <= ? AND (s.date < ? OR s.first_created_at > ?
+                        OR (s.first_created_at = ? AND s.id >= ?))
+                    ORDER BY s.date DESC, s.first_created_at, s.id LIMIT ?
+                '''
+            params = (anchor_date, anchor_date, anchor_created_at, anchor_created_at, anchor_id, limit)
+        rows = [
+            (row_id, date_str, program_name, exercise, json.loads(weights))
+            for row_id, date_str, program_name, exercise, weights in await queries.fetchall(
+                db, 'report_page', query, params
+            )
+        ]
+    if backward:
+        rows.reverse()
+    return rows
 
 
 async def init_db():
@@ -349,19 +561,23 @@ async def init_db():
         logger.info("Запустите db_init.py для создания базы данных")
     else:
         logger.info(f"База данных найдена: {DATABASE_PATH}")
+        # Применяем недостающие миграции схемы
+        applied = await asyncio.to_thread(migrate_database, DATABASE_PATH)
+        if applied:
+            logger.info(f"Применены миграции схемы БД: {', '.join(map(str, applied))}")
 
 
 # Обработчики команд
-@dp.message(Command("start"))
-@track_operation("start")
-async def cmd_start(message: Message):
-    """Обработчик команды /start"""
-    welcome_text = """
-🏋️ Добро пожаловать в бот для записи силовых упражнений!
+# Меню команд: ответ на /start и на сообщения вне сценариев
+WELCOME_TEXT = """🏋️ Добро пожаловать в бот для записи силовых упражнений!
 
 Доступные команды:
 /start - Начать работу
 /newprogram - Создать новую программу тренировок
+/import - Импортировать программы из файла CSV/JSON
+/export - Выгрузить записи тренировок в файл CSV/NDJSON
+/chart - График прогресса по упражнению
+/records - Личные рекорды
 /programs - Список всех программ
 /startworkout - Начать тренировку
 /report - Просмотреть отчёты
@@ -374,13 +590,16 @@ async def cmd_start(message: Message):
 Пример:
 Приседания\\3
 Жим лёжа\\3
-Тяга\\3
-    """
-    await message.answer(welcome_text)
+Тяга\\3"""
+
+
+@dp.message(Command("start"), flags={"operation": "start"})
+async def cmd_start(message: Message):
+    """Обработчик команды /start"""
+    await message.answer(WELCOME_TEXT)
 
 
-@dp.message(Command("newprogram"))
-@track_operation("newprogram")
+@dp.message(Command("newprogram"), flags={"operation": "newprogram"})
 async def cmd_newprogram(message: Message, state: FSMContext):
     """Обработчик команды /newprogram"""
     await message.answer(
@@ -418,7 +637,7 @@ async def process_program_name(message: Message, state: FSMContext):
     await state.set_state(WorkoutStates.waiting_for_program_text)
 
 
-@dp.message(WorkoutStates.waiting_for_program_text)
+@dp.message(WorkoutStates.waiting_for_program_text, flags={"operation": "create_program"})
 async def process_program_text(message: Message, state: FSMContext):
     """Обработка текста программы"""
     if not message.text:
@@ -437,36 +656,15 @@ async def process_program_text(message: Message, state: FSMContext):
     program_text = message.text.strip()
     
     try:
-        # Парсинг строк программы
-        lines = [line.strip() for line in program_text.split('\n') if line.strip()]
-        
-        if not lines:
+        if not program_text:
             await message.answer("❌ Программа пуста. Попробуйте снова.")
             await state.clear()
             return
         
-        # Создаём новую программу (старые программы остаются активными)
-        program_id = await create_program(program_name)
-        
-        # Парсим и добавляем упражнения (формат: упражнение\подходы)
-        position = 0
-        for line in lines:
-            parts = line.split('\\')
-            if len(parts) != 2:
-                continue
-            
-            exercise = parts[0].strip()
-            try:
-                sets = int(parts[1].strip())
-            except ValueError:
-                continue
-            
-            # Используем пустое значение для дня, так как формат изменился
-            day = "Общий"
-            await add_exercise(program_id, day, exercise, sets, position)
-            position += 1
+        # Парсим упражнения (формат: упражнение\подходы)
+        exercises = parse_program_text(program_text)
         
-        if position == 0:
+        if not exercises:
             await message.answer(
                 "❌ Не удалось распарсить упражнения. Проверьте формат:\n"
                 "упражнение\\подходы"
@@ -474,10 +672,19 @@ async def process_program_text(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        await message.answer(
+        # Создаём новую программу вместе с упражнениями (старые программы остаются активными)
+        _, matched = await create_program(program_name, exercises)
+        
+        text = (
             f"✅ Программа '{program_name}' создана!\n"
-            f"Добавлено упражнений: {position}"
+            f"Добавлено упражнений: {len(exercises)}"
         )
+        if matched:
+            # Показываем объединённые написания, чтобы ошибочное сопоставление было заметно
+            text += "\n\n🔗 Учитываются вместе с упражнениями:\n" + "\n".join(
+                f"• {exercise} → {catalog_name}" for exercise, catalog_name in matched
+            )
+        await message.answer(text)
         
     except Exception as e:
         logger.error(f"Ошибка при создании программы: {e}")
@@ -486,8 +693,305 @@ async def process_program_text(message: Message, state: FSMContext):
     await state.clear()
 
 
-@dp.message(Command("startworkout"))
-@track_operation("startworkout")
+@dp.message(Command("import"), flags={"operation": "import"})
+async def cmd_import(message: Message, state: FSMContext):
+    """Обработчик команды /import - массовый импорт программ из файла"""
+    await message.answer(
+        "📥 Отправьте файл CSV или JSON с программами.\n\n"
+        "CSV: программа,упражнение,подходы[,день] - по одному упражнению на строку\n"
+        "JSON: [{\"name\": \"Программа\", \"exercises\": [{\"exercise\": \"Жим лёжа\", \"sets\": 3}]}]\n"
+        "или по одной программе на строку (JSON Lines)"
+    )
+    await state.set_state(WorkoutStates.waiting_for_import_file)
+
+
+@dp.message(WorkoutStates.waiting_for_import_file, flags={"operation": "import_file"})
+async def process_import_file(message: Message, state: FSMContext):
+    """Обработка загруженного файла с программами"""
+    document = message.document
+    if not document:
+        await message.answer("❌ Пожалуйста, отправьте файл CSV или JSON.")
+        return
+    
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer(
+            f"❌ Файл слишком большой. Максимальный размер: {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ"
+        )
+        await state.clear()
+        return
+    
+    await state.clear()
+    start_time = time.perf_counter()
+    try:
+        with tempfile.TemporaryFile() as file:
+            await bot.download(document, destination=file)
+            file.seek(0)
+            result = await import_programs(iter_import_rows(file, document.file_name or ''))
+    except UnicodeDecodeError:
+        await message.answer("❌ Файл должен быть в кодировке UTF-8.")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка при импорте программ: {e}")
+        await message.answer("❌ Ошибка при импорте программ. Часть программ могла быть сохранена.")
+        return
+    duration = time.perf_counter() - start_time
+    
+    rows_total = result['exercises'] + len(result['rejected'])
+    report_lines = [
+        "✅ Импорт завершён!",
+        f"Программ создано: {result['programs']}",
+        f"Упражнений добавлено: {result['exercises']}",
+        f"Время: {duration:.2f} с ({rows_total / duration if duration > 0 else rows_total:.0f} строк/с)",
+    ]
+    if result['rejected']:
+        report_lines.append(f"\n⚠️ Отклонено строк: {len(result['rejected'])}")
+        for line_no, error in result['rejected'][:IMPORT_REJECTED_SHOWN]:
+            report_lines.append(f"• {line_no}: {error}")
+        if len(result['rejected']) > IMPORT_REJECTED_SHOWN:
+            report_lines.append(f"… и ещё {len(result['rejected']) - IMPORT_REJECTED_SHOWN}")
+    
+    with bulk_sends():
+        for chunk in pack_report_lines(report_lines):
+            await message.answer(chunk)
+
+
+async def export_records(file, export_format: str) -> int:
+    """Записать все записи тренировок в file (gzip) страницами по EXPORT_CHUNK_ROWS; возвращает число строк.
+    Соединение берётся из пула на одну страницу: выгрузка не занимает пул и не держит
+    долгую транзакцию чтения, которая мешала бы контрольным точкам WAL."""
+    writer = RecordsExportWriter(file, export_format)
+    last_id = 0
+    try:
+        while True:
+            async with db_pool.acquire() as db:
+                rows = await queries.fetchall(db, 'export_records', EXPORT_PAGE_QUERY, (last_id, EXPORT_CHUNK_ROWS))
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            # Сжатие выполняется в потоке, чтобы не задерживать цикл событий
+            await asyncio.to_thread(writer.write, [row[1:] for row in rows])
+            if len(rows) < EXPORT_CHUNK_ROWS:
+                break
+    finally:
+        await asyncio.to_thread(writer.close)
+    return writer.rows
+
+
+@dp.message(Command("export"), flags={"operation": "export"})
+async def cmd_export(message: Message):
+    """Обработчик команды /export - выбор формата выгрузки"""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="CSV", callback_data="export:csv"),
+        InlineKeyboardButton(text="NDJSON", callback_data="export:ndjson"),
+    ]])
+    await message.answer("📦 Выберите формат выгрузки записей тренировок:", reply_markup=keyboard)
+
+
+@dp.callback_query(F.data.startswith("export:"), flags={"operation": "export_file"})
+async def process_export(callback: CallbackQuery):
+    """Выгрузка записей тренировок в сжатый файл выбранного формата"""
+    await callback.answer()
+    export_format = callback.data.split(":", 1)[1]
+    if export_format not in EXPORT_FORMATS:
+        await callback.message.answer("❌ Неизвестный формат выгрузки. Запросите её заново командой /export")
+        return
+    
+    if export_slots.locked():
+        await callback.message.edit_text("⏳ Выгрузка в очереди, файл будет отправлен после завершения текущих.")
+    else:
+        await callback.message.edit_text("⏳ Готовлю файл...")
+    
+    async with export_slots:
+        start_time = time.perf_counter()
+        try:
+            with tempfile.NamedTemporaryFile(suffix='.gz') as file:
+                rows = await export_records(file, export_format)
+                file.flush()
+                size = os.path.getsize(file.name)
+                if not rows:
+                    await callback.message.edit_text("📭 Нет записей для выгрузки.")
+                    return
+                if size > EXPORT_MAX_FILE_SIZE:
+                    await callback.message.edit_text(
+                        f"❌ Файл выгрузки слишком большой ({size // (1024 * 1024)} МБ). "
+                        f"Максимальный размер: {EXPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ"
+                    )
+                    return
+                # Файл отправляется с диска порциями, без чтения в память
+                document = FSInputFile(file.name, filename=export_filename(export_format, date.today().isoformat()))
+                with bulk_sends():
+                    await callback.message.answer_document(
+                        document,
+                        caption=f"✅ Записей: {rows}, время: {time.perf_counter() - start_time:.2f} с"
+                    )
+        except Exception as e:
+            logger.error(f"Ошибка при выгрузке записей: {e}")
+            await callback.message.answer("❌ Ошибка при выгрузке записей. Попробуйте позже.")
+
+
+async def get_chart_exercises(after_id: int = None, limit: int = None):
+    """Упражнения каталога из активных программ для выбора графика: (ID в каталоге, название)
+    в порядке (название, ID), после упражнения after_id (ключ страницы)"""
+    anchor = 'AND (c.name, c.id) > (SELECT name, id FROM exercise_catalog WHERE id = ?)' if after_id else ''
+    params = (after_id,) if after_id else ()
+    async with db_pool.acquire() as db:
+        return await queries.fetchall(db, 'chart_exercises', f'''
+            SELECT c.id, c.name
+            FROM exercise_catalog c
+            WHERE c.id IN (
+                SELECT e.canonical_exercise_id
+                FROM exercises e
+                JOIN programs p ON e.program_id = p.id
+                WHERE p.active = 1
+            ) {anchor}
+            ORDER BY c.name, c.id
+            LIMIT ?
+        ''', (*params, limit or CHART_PAGE_EXERCISES))
+
+
+async def build_chart_exercises_keyboard(after_id: int = None):
+    """Клавиатура выбора упражнения для графика: страница упражнений и кнопки перехода.
+    Возвращает None, если упражнений на странице нет."""
+    exercises = await get_chart_exercises(after_id, limit=CHART_PAGE_EXERCISES + 1)
+    if not exercises:
+        return None
+    has_more = len(exercises) > CHART_PAGE_EXERCISES
+    exercises = exercises[:CHART_PAGE_EXERCISES]
+    buttons = [
+        [InlineKeyboardButton(text=name, callback_data=f"chart:{canonical_id}")]
+        for canonical_id, name in exercises
+    ]
+    navigation = []
+    if after_id:
+        navigation.append(InlineKeyboardButton(text="⏮ В начало", callback_data="chart_page:0"))
+    if has_more:
+        navigation.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"chart_page:{exercises[-1][0]}"))
+    if navigation:
+        buttons.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+async def get_exercise_name(canonical_id: int):
+    async with db_pool.acquire() as db:
+        row = await queries.fetchone(
+            db, 'exercise_catalog_name', 'SELECT name FROM exercise_catalog WHERE id = ?', (canonical_id,)
+        )
+    return row[0] if row else None
+
+
+async def get_exercise_progress(canonical_id: int, start_date: str):
+    """Максимальный вес по дням для упражнения каталога (по всем программам)
+    начиная с даты start_date ('' - всё время)"""
+    async with db_pool.acquire() as db:
+        return await queries.fetchall(db, 'chart_points', '''
+            SELECT s.date, MAX(s.max_weight)
+            FROM exercises e
+            JOIN daily_exercise_stats s ON s.exercise_id = e.id
+            WHERE e.canonical_exercise_id = ? AND s.date >= ? AND s.max_weight IS NOT NULL
+            GROUP BY s.date
+            ORDER BY s.date
+        ''', (canonical_id, start_date))
+
+
+async def get_chart_version(canonical_id: int) -> str:
+    """Версия данных графиков упражнения каталога: меняется с каждым сохранённым подходом
+    в любом процессе. id в daily_exercise_stats (AUTOINCREMENT) растёт с новым днём или программой
+    и не повторяется после очистки данных, число подходов - с подходом в уже начатый день."""
+    async with db_pool.acquire() as db:
+        last_id, set_count = await queries.fetchone(db, 'chart_version', '''
+            SELECT MAX(s.id), SUM(s.set_count)
+            FROM exercises e
+            JOIN daily_exercise_stats s ON s.exercise_id = e.id
+            WHERE e.canonical_exercise_id = ?
+        ''', (canonical_id,))
+    return f"{last_id}.{set_count}"
+
+
+@dp.message(Command("chart"), flags={"operation": "chart"})
+async def cmd_chart(message: Message):
+    """Обработчик команды /chart - выбор упражнения для графика прогресса"""
+    if not CHARTS_AVAILABLE:
+        await message.answer("❌ Графики недоступны: на сервере не установлен matplotlib.")
+        return
+    
+    keyboard = await build_chart_exercises_keyboard()
+    if keyboard is None:
+        await message.answer("❌ Нет упражнений в активных программах.")
+        return
+    await message.answer("📈 Выберите упражнение:", reply_markup=keyboard)
+
+
+@dp.callback_query(F.data.startswith("chart_page:"), flags={"operation": "chart"})
+async def process_chart_page(callback: CallbackQuery):
+    """Переход по страницам списка упражнений для графика"""
+    await callback.answer()
+    try:
+        after_id = int(callback.data.split(":")[1])
+    except (ValueError, IndexError):
+        await callback.message.answer("❌ Ошибка при выборе графика. Запросите его заново командой /chart")
+        return
+    
+    keyboard = await build_chart_exercises_keyboard(after_id or None)
+    if keyboard is None:
+        # Упражнения после ключа страницы удалены - показываем начало списка
+        keyboard = await build_chart_exercises_keyboard()
+    if keyboard is None:
+        await callback.message.edit_text("❌ Нет упражнений в активных программах.")
+        return
+    await callback.message.edit_text("📈 Выберите упражнение:", reply_markup=keyboard)
+
+
+@dp.callback_query(F.data.startswith("chart:"), flags={"operation": "chart_view"})
+async def process_chart(callback: CallbackQuery):
+    """Выбор периода и отправка графика прогресса"""
+    await callback.answer()
+    parts = callback.data.split(":")
+    try:
+        canonical_id = int(parts[1])
+        days = int(parts[2]) if len(parts) > 2 else None
+    except (ValueError, IndexError):
+        await callback.message.answer("❌ Ошибка при выборе графика. Запросите его заново командой /chart")
+        return
+    
+    exercise = await get_exercise_name(canonical_id)
+    if exercise is None:
+        await callback.message.edit_text("❌ Упражнение не найдено. Запросите график заново командой /chart")
+        return
+    
+    if days is None:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text=title, callback_data=f"chart:{canonical_id}:{period}")
+            for period, title in CHART_PERIODS.items()
+        ]])
+        await callback.message.edit_text(f"📈 {exercise}: выберите период", reply_markup=keyboard)
+        return
+    
+    period_title = CHART_PERIODS.get(days, f"{days} дней")
+    try:
+        # Окно периода сдвигается каждый день: дата начала входит в версию графика
+        start_date = utc_day_range(days)[0] if days else ''
+        version = f"{await get_chart_version(canonical_id)}.{start_date}"
+        path = await chart_renderer.chart(
+            canonical_id, days, version, f"{exercise} - {period_title}",
+            lambda: get_exercise_progress(canonical_id, start_date)
+        )
+    except ChartQueueFull:
+        await callback.message.answer("⏳ Сейчас строится много графиков. Попробуйте через минуту.")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка при построении графика: {e}")
+        await callback.message.answer("❌ Ошибка при построении графика. Попробуйте позже.")
+        return
+    
+    if path is None:
+        await callback.message.answer(f"📭 Нет записей по упражнению «{exercise}» за выбранный период.")
+        return
+    await callback.message.answer_photo(
+        FSInputFile(path, filename="chart.png"), caption=f"📈 {exercise}: максимальный вес по дням ({period_title})"
+    )
+
+
+@dp.message(Command("startworkout"), flags={"operation": "startworkout"})
 async def cmd_startworkout(message: Message, state: FSMContext):
     """Обработчик команды /startworkout - выбор активной программы для тренировки"""
     # Очищаем предыдущее состояние, если было
@@ -505,7 +1009,7 @@ async def cmd_startworkout(message: Message, state: FSMContext):
     
     # Создаём инлайн-клавиатуру с активными программами
     buttons = []
-    for program_id, program_name in programs:
+    for program_id, program_name in programs.items():
         buttons.append([InlineKeyboardButton(
             text=program_name,
             callback_data=f"select_program_{program_id}"
@@ -513,29 +1017,18 @@ async def cmd_startworkout(message: Message, state: FSMContext):
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
     
-    programs_list = "\n".join([f"• {p[1]}" for p in programs])
+    programs_list = "\n".join([f"• {name}" for name in programs.values()])
     await message.answer(
         f"🏋️ Выберите активную программу для тренировки:\n\n{programs_list}",
         reply_markup=keyboard
     )
 
 
-@dp.callback_query(F.data.startswith("select_program_"))
+@dp.callback_query(F.data.startswith("select_program_"), flags={"operation": "select_program"})
 async def process_program_selection(callback: CallbackQuery, state: FSMContext):
     """Обработка выбора активной программы через инлайн-кнопку"""
     await callback.answer()
     
-    # Регистрируем пользователя и логируем операцию
-    user_id = callback.from_user.id
-    await register_user(
-        user_id=user_id,
-        username=callback.from_user.username,
-        first_name=callback.from_user.first_name,
-        last_name=callback.from_user.last_name
-    )
-    await log_operation(user_id, "select_program")
-    operations_total.labels(operation_type="select_program").inc()
-    
     # Извлекаем ID программы из callback_data
     try:
         program_id = int(callback.data.split("_")[2])
@@ -545,22 +1038,14 @@ async def process_program_selection(callback: CallbackQuery, state: FSMContext):
     
     # Дополнительная проверка, что программа действительно активна
     active_programs = await get_active_programs()
-    active_ids = [p[0] for p in active_programs]
     
-    if program_id not in active_ids:
+    if program_id not in active_programs:
         await callback.message.answer(
             "❌ Эта программа больше не активна.\n"
             "Используйте команду /startworkout для выбора активной программы."
         )
         return
     
-    # Находим название программы
-    program_name = next((p[1] for p in active_programs if p[0] == program_id), None)
-    
-    if not program_name:
-        await callback.message.answer("❌ Программа не найдена.")
-        return
-    
     # Получаем упражнения программы
     exercises = await get_program_exercises(program_id)
     
@@ -568,15 +1053,6 @@ async def process_program_selection(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer("❌ В программе нет упражнений.")
         return
     
-    # Сохраняем данные для процесса тренировки
-    await state.update_data(
-        program_id=program_id,
-        program_name=program_name,
-        exercises=exercises,
-        current_exercise_index=0,
-        current_set=1
-    )
-    
     # Удаляем инлайн-клавиатуру (если возможно)
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
@@ -585,23 +1061,51 @@ async def process_program_selection(callback: CallbackQuery, state: FSMContext):
         # Продолжаем работу даже если не удалось удалить клавиатуру
     
     # Начинаем с первого упражнения
-    await process_next_exercise(callback.message, state)
+    await state.set_state(WorkoutStates.waiting_for_weight)
+    if WORKOUT_LIVE_CARD:
+        card = await callback.message.answer(
+            render_workout_card(exercises, 0, []),
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.set_data({
+            'program_id': program_id, 'exercise_index': 0, 'set': 1, 'weights': [], 'card': card.message_id
+        })
+    else:
+        await process_next_exercise(callback.message, state, program_id, 0, exercises)
 
 
-async def process_next_exercise(message: Message, state: FSMContext):
-    """Обработка следующего упражнения"""
-    data = await state.get_data()
-    
-    # Проверяем наличие необходимых данных
-    if 'exercises' not in data or 'current_exercise_index' not in data:
-        await message.answer("❌ Ошибка состояния. Начните тренировку заново командой /startworkout")
-        await state.clear()
-        return
-    
-    exercises = data['exercises']
-    current_index = data['current_exercise_index']
+def format_exercise_header(day: str, exercise_name: str) -> str:
+    """Заголовок упражнения с учётом дня"""
+    if day and day != "Общий":
+        return f"📅 День: {day}\n🏋️ Упражнение: {exercise_name}"
+    return f"🏋️ Упражнение: {exercise_name}"
+
+
+def render_workout_card(exercises, index: int, weights: list) -> str:
+    """Текст карточки тренировки: прогресс, текущее упражнение, веса выполненных подходов и подсказка"""
+    lines = []
+    if index:
+        lines.append(f"✅ Выполнено упражнений: {index} из {len(exercises)}")
+    if index >= len(exercises):
+        lines.append("✅ Тренировка завершена!")
+        return "\n".join(lines)
     
-    if current_index >= len(exercises):
+    exercise_id, day, exercise_name, sets, position = exercises[index]
+    if lines:
+        lines.append("")
+    lines.append(format_exercise_header(day, exercise_name))
+    lines.append(f"📊 Подходов: {sets}")
+    for set_number, weight in enumerate(weights, start=1):
+        lines.append(f"   {set_number}. {weight} кг ✅")
+    lines.append("")
+    lines.append(f"Введите вес для подхода {len(weights) + 1}/{sets} (в кг):")
+    return "\n".join(lines)
+
+
+async def process_next_exercise(message: Message, state: FSMContext, program_id: int, index: int, exercises):
+    """Переход к упражнению с номером index.
+    В состоянии хранятся только ID программы и номера упражнения и подхода."""
+    if index >= len(exercises):
         # Все упражнения выполнены
         await message.answer(
             "✅ Тренировка завершена!",
@@ -610,35 +1114,15 @@ async def process_next_exercise(message: Message, state: FSMContext):
         await state.clear()
         return
     
-    exercise = exercises[current_index]
-    exercise_id, day, exercise_name, sets, position = exercise
+    exercise_id, day, exercise_name, sets, position = exercises[index]
+    await state.set_data({'program_id': program_id, 'exercise_index': index, 'set': 1})
     
-    await state.update_data(
-        current_exercise_id=exercise_id,
-        current_exercise_name=exercise_name,
-        current_day=day,
-        total_sets=sets,
-        current_set=1
+    await message.answer(
+        f"{format_exercise_header(day, exercise_name)}\n"
+        f"📊 Подходов: {sets}\n\n"
+        f"Введите вес для подхода 1 (в кг):",
+        reply_markup=ReplyKeyboardRemove()
     )
-    
-    # Формируем сообщение с учётом дня
-    if day and day != "Общий":
-        message_text = (
-            f"📅 День: {day}\n"
-            f"🏋️ Упражнение: {exercise_name}\n"
-            f"📊 Подходов: {sets}\n\n"
-            f"Введите вес для подхода 1 (в кг):"
-        )
-    else:
-        message_text = (
-            f"🏋️ Упражнение: {exercise_name}\n"
-            f"📊 Подходов: {sets}\n\n"
-            f"Введите вес для подхода 1 (в кг):"
-        )
-    
-    await message.answer(message_text, reply_markup=ReplyKeyboardRemove())
-    
-    await state.set_state(WorkoutStates.waiting_for_weight)
 
 
 @dp.message(WorkoutStates.waiting_for_weight)
@@ -648,67 +1132,49 @@ async def process_weight(message: Message, state: FSMContext):
     data = await state.get_data()
     
     # Проверяем наличие необходимых данных
-    if 'current_set' not in data or 'total_sets' not in data:
+    if not {'program_id', 'exercise_index', 'set'} <= data.keys():
         await message.answer("❌ Ошибка состояния. Начните тренировку заново командой /startworkout")
         await state.clear()
         return
     
-    current_set = data['current_set']
-    total_sets = data['total_sets']
-    exercise_name = data.get('current_exercise_name', 'упражнение')
-    day = data.get('current_day', '')
+    program_id = data['program_id']
+    index = data['exercise_index']
+    current_set = data['set']
     
-    # Проверяем наличие текста
-    if not message.text:
-        if day and day != "Общий":
-            error_text = (
-                f"❌ Пожалуйста, введите вес числом:\n\n"
-                f"📅 День: {day}\n"
-                f"🏋️ Упражнение: {exercise_name}\n"
-                f"📊 Подход {current_set}/{total_sets}"
-            )
-        else:
-            error_text = (
-                f"❌ Пожалуйста, введите вес числом:\n\n"
-                f"🏋️ Упражнение: {exercise_name}\n"
-                f"📊 Подход {current_set}/{total_sets}"
-            )
-        await message.answer(error_text)
+    # План тренировки восстанавливается по ID программы
+    exercises = await get_program_exercises(program_id)
+    if index >= len(exercises):
+        await message.answer("❌ Программа изменилась. Начните тренировку заново командой /startworkout")
+        await state.clear()
         return
     
-    # Проверяем формат введённого веса
+    exercise_id, day, exercise_name, total_sets, position = exercises[index]
+    
+    # Проверяем наличие текста и формат введённого веса
     try:
         weight = float(message.text.replace(',', '.'))
+        # float() принимает "nan" и "inf"; такие и отрицательные значения весом не являются
+        valid_weight = math.isfinite(weight) and weight >= 0
     except (ValueError, AttributeError, TypeError):
-        # При ошибке формата продолжаем запрашивать вес для того же подхода
-        if day and day != "Общий":
-            error_text = (
-                f"❌ Неверный формат. Введите число (например: 80 или 80.5):\n\n"
-                f"📅 День: {day}\n"
-                f"🏋️ Упражнение: {exercise_name}\n"
-                f"📊 Подход {current_set}/{total_sets}"
-            )
+        valid_weight = None
+    if not valid_weight:
+        # При ошибке продолжаем запрашивать вес для того же подхода
+        if valid_weight is False:
+            error_text = "❌ Вес должен быть неотрицательным числом (например: 80 или 80.5):"
+        elif message.text:
+            error_text = "❌ Неверный формат. Введите число (например: 80 или 80.5):"
         else:
-            error_text = (
-                f"❌ Неверный формат. Введите число (например: 80 или 80.5):\n\n"
-                f"🏋️ Упражнение: {exercise_name}\n"
-                f"📊 Подход {current_set}/{total_sets}"
-            )
-        await message.answer(error_text)
+            error_text = "❌ Пожалуйста, введите вес числом:"
+        await message.answer(
+            f"{error_text}\n\n"
+            f"{format_exercise_header(day, exercise_name)}\n"
+            f"📊 Подход {current_set}/{total_sets}"
+        )
         return  # Возвращаемся, но состояние остаётся waiting_for_weight, поэтому запрос продолжится
     
-    # Если формат правильный, сохраняем запись
-    if 'program_id' not in data or 'current_exercise_id' not in data:
-        await message.answer("❌ Ошибка состояния. Начните тренировку заново командой /startworkout")
-        await state.clear()
-        return
-    
-    program_id = data['program_id']
-    exercise_id = data['current_exercise_id']
-    
     # Сохраняем запись
     try:
-        await save_record(program_id, exercise_id, current_set, weight)
+        improvement, best_volume = await save_record(program_id, exercise_id, current_set, weight)
         # Логируем операцию сохранения записи
         await log_operation(message.from_user.id, "save_record")
     except Exception as e:
@@ -716,26 +1182,87 @@ async def process_weight(message: Message, state: FSMContext):
         await message.answer("❌ Ошибка при сохранении записи. Попробуйте снова.")
         return
     
+    # Новый личный рекорд объявляется сразу, по результату сохранения (без дополнительных запросов)
+    record_text = format_personal_record(exercise_name, improvement, weight, best_volume) if improvement else None
+    
+    # Режим карточки: вместо подтверждения и подсказки обновляется одно сообщение
+    if 'card' in data:
+        weights = data.get('weights', []) + [weight]
+        if current_set < total_sets:
+            next_data = {**data, 'set': current_set + 1, 'weights': weights}
+        else:
+            next_data = {**data, 'exercise_index': index + 1, 'set': 1, 'weights': []}
+        if next_data['exercise_index'] >= len(exercises):
+            await state.clear()
+        else:
+            await state.set_data(next_data)
+        card_editor.schedule(
+            message.chat.id, data['card'],
+            render_workout_card(exercises, next_data['exercise_index'], next_data['weights'])
+        )
+        if record_text:
+            await message.answer(record_text)
+        return
+    
     await message.answer(
         f"✅ {exercise_name}\n"
         f"Подход {current_set}/{total_sets}: {weight} кг записан"
     )
+    if record_text:
+        await message.answer(record_text)
     
     # Переходим к следующему подходу или упражнению
     if current_set < total_sets:
-        await state.update_data(current_set=current_set + 1)
+        await state.set_data({'program_id': program_id, 'exercise_index': index, 'set': current_set + 1})
         await message.answer(
             f"🏋️ {exercise_name}\n"
             f"Введите вес для подхода {current_set + 1}/{total_sets} (в кг):"
         )
     else:
-        # Переходим к следующему упражнению
-        await state.update_data(current_exercise_index=data['current_exercise_index'] + 1)
-        await process_next_exercise(message, state)
+        await process_next_exercise(message, state, program_id, index + 1, exercises)
+
+
+def format_personal_record(exercise_name: str, improvement: int, weight: float, best_volume: float) -> str:
+    """Сообщение о новом личном рекорде"""
+    lines = [f"🏆 Новый личный рекорд: {exercise_name}!"]
+    if improvement & PR_WEIGHT:
+        lines.append(f"Максимальный вес: {weight} кг")
+    if improvement & PR_VOLUME:
+        lines.append(f"Объём за день: {best_volume:g} кг")
+    return "\n".join(lines)
+
+
+async def get_personal_records():
+    """Личные рекорды по всем упражнениям каталога"""
+    async with db_pool.acquire() as db:
+        return await queries.fetchall(db, 'personal_records', '''
+            SELECT c.name, r.max_weight, r.max_weight_set, r.max_weight_date, r.best_volume, r.best_volume_date
+            FROM personal_records r
+            JOIN exercise_catalog c ON c.id = r.canonical_exercise_id
+            ORDER BY c.name
+        ''')
+
+
+@dp.message(Command("records"), flags={"operation": "records"})
+async def cmd_records(message: Message):
+    """Обработчик команды /records - список личных рекордов"""
+    records = await get_personal_records()
+    if not records:
+        await message.answer("📭 Рекордов пока нет. Начните тренировку командой /startworkout")
+        return
+    
+    lines = ["🏆 Личные рекорды:\n"]
+    for exercise, max_weight, max_weight_set, max_weight_date, best_volume, best_volume_date in records:
+        lines.append(
+            f"• {exercise}: {max_weight} кг (подход {max_weight_set}, {max_weight_date}); "
+            f"объём {best_volume:g} кг ({best_volume_date})"
+        )
+    with bulk_sends():
+        for chunk in pack_report_lines(lines):
+            await message.answer(chunk)
 
 
-@dp.message(Command("programs"))
-@track_operation("programs")
+@dp.message(Command("programs"), flags={"operation": "programs"})
 async def cmd_programs(message: Message):
     """Обработчик команды /programs - показать список всех программ"""
     programs = await get_all_programs()
@@ -764,8 +1291,7 @@ async def cmd_programs(message: Message):
     await message.answer(programs_text)
 
 
-@dp.message(Command("deleteall"))
-@track_operation("deleteall")
+@dp.message(Command("deleteall"), flags={"operation": "deleteall"})
 async def cmd_deleteall(message: Message, state: FSMContext):
     """Обработчик команды /deleteall - удаление всех программ"""
     # Создаём инлайн-клавиатуру с подтверждением
@@ -783,7 +1309,7 @@ async def cmd_deleteall(message: Message, state: FSMContext):
     )
 
 
-@dp.callback_query(F.data == "confirm_delete_all")
+@dp.callback_query(F.data == "confirm_delete_all", flags={"operation": "delete_all"})
 async def confirm_delete_all(callback: CallbackQuery):
     """Подтверждение удаления всех программ"""
     await callback.answer()
@@ -812,8 +1338,7 @@ async def cancel_delete_all(callback: CallbackQuery):
     )
 
 
-@dp.message(Command("report"))
-@track_operation("report")
+@dp.message(Command("report"), flags={"operation": "report"})
 async def cmd_report(message: Message):
     """Обработчик команды /report"""
     keyboard = ReplyKeyboardMarkup(
@@ -829,7 +1354,94 @@ async def cmd_report(message: Message):
     await message.answer("Выберите период для отчёта:", reply_markup=keyboard)
 
 
-@dp.message(lambda m: m.text in ["За день", "За неделю", "За всё время"])
+def format_report_line(date_str: str, program_name: str, exercise: str, weights: list) -> str:
+    """Строка отчёта для одного упражнения за день"""
+    weights_str = ", ".join([f"{w} кг" for w in weights])
+    return f"{date_str} | {program_name} | {exercise} ({len(weights)} подхода) | {weights_str}"
+
+
+def pack_report_lines(lines: list, max_length: int = REPORT_MAX_LENGTH) -> list:
+    """Разбить строки отчёта на сообщения не длиннее max_length по границам строк"""
+    chunks = []
+    current = ""
+    for line in lines:
+        while len(line) > max_length:
+            # Строка длиннее лимита режется отдельно
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:max_length])
+            line = line[max_length:]
+        if current and len(current) + 1 + len(line) > max_length:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def build_all_records_page(anchor_id: int = None, backward: bool = False, page: int = 1):
+    """Сформировать страницу отчёта за всё время: текст и инлайн-клавиатуру навигации.
+    Возвращает None, если отчёт устарел (записи удалены)."""
+    # Лишняя строка показывает, есть ли данные за пределами выборки
+    rows = await get_records_page(anchor_id, backward, limit=REPORT_PAGE_ROWS + 1)
+    if rows is None:
+        return None
+    if not rows and backward:
+        # Перед этой страницей ничего нет - показываем начало отчёта
+        return await build_all_records_page()
+    if not rows:
+        return "📊 Отчёт за всё время:\n\nНет записей.", None
+
+    has_more = len(rows) > REPORT_PAGE_ROWS
+    extra_row = None
+    if has_more:
+        extra_row = rows.pop(0) if backward else rows.pop()
+
+    # Набираем строки, пока они помещаются в одно сообщение
+    header_length = len(f"📊 Отчёт за всё время (стр. {page}):\n\n")
+    budget = REPORT_MAX_LENGTH - header_length
+    lines = []
+    length = 0
+    for row_id, *line_data in (reversed(rows) if backward else rows):
+        line = format_report_line(*line_data)[:budget]
+        if lines and length + 1 + len(line) > budget:
+            break
+        lines.append((row_id, line))
+        length += len(line) + 1
+    if backward:
+        lines.reverse()
+
+    if backward:
+        has_previous = has_more or len(lines) < len(rows)
+        next_anchor = anchor_id
+    else:
+        has_previous = anchor_id is not None
+        if len(lines) < len(rows):
+            next_anchor = rows[len(lines)][0]
+        else:
+            # Следующая страница начинается с лишней строки выборки
+            next_anchor = extra_row[0] if extra_row else None
+    if not has_previous:
+        page = 1
+
+    buttons = []
+    if has_previous:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=f"report_all:{lines[0][0]}:{page - 1}:p"
+        ))
+    if next_anchor is not None:
+        buttons.append(InlineKeyboardButton(
+            text="Далее ➡️", callback_data=f"report_all:{next_anchor}:{page + 1}:n"
+        ))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+    report_text = f"📊 Отчёт за всё время (стр. {page}):\n\n" + "\n".join(line for _, line in lines)
+    return report_text, keyboard
+
+
+@dp.message(lambda m: m.text in ["За день", "За неделю", "За всё время"], flags={"operation": "report_view"})
 async def process_report_selection(message: Message):
     """Обработка выбора периода отчёта"""
     if not message.text:
@@ -837,15 +1449,24 @@ async def process_report_selection(message: Message):
     
     period = message.text
     
+    if period == "За всё время":
+        # Отчёт за всё время выводится постранично, остальные страницы - по кнопкам
+        label_request("report_all")
+        report_text, keyboard = await build_all_records_page()
+        if keyboard is not None:
+            # Сообщение с инлайн-кнопками не может убрать клавиатуру выбора периода - убираем отдельно
+            await message.answer("📊 Отчёт за всё время", reply_markup=ReplyKeyboardRemove())
+        await message.answer(report_text, reply_markup=keyboard or ReplyKeyboardRemove())
+        return
+    
     if period == "За день":
-        records = await get_records_day()
+        label_request("report_day")
         period_text = "за сегодня"
-    elif period == "За неделю":
-        records = await get_records_week()
-        period_text = "за неделю"
+        records = await get_records_day()
     else:
-        records = await get_records_all()
-        period_text = "за всё время"
+        label_request("report_week")
+        period_text = "за неделю"
+        records = await get_records_week()
     
     if not records:
         await message.answer(
@@ -854,39 +1475,42 @@ async def process_report_selection(message: Message):
         )
         return
     
-    # Группируем записи по дате, программе и упражнению
-    grouped_records = {}
-    for record in records:
-        date_str, program_name, exercise, set_number, weight = record
-        key = (date_str, program_name, exercise)
-        
-        if key not in grouped_records:
-            grouped_records[key] = []
-        
-        grouped_records[key].append(weight)
-    
-    # Формируем отчёт
+    # Строки уже сгруппированы по дате, программе и упражнению в daily_exercise_stats,
+    # веса хранятся в порядке подходов
     report_lines = [f"📊 Отчёт {period_text}:\n"]
+    for date_str, program_name, exercise, weights in records:
+        report_lines.append(format_report_line(date_str, program_name, exercise, weights))
     
-    for (date_str, program_name, exercise), weights in grouped_records.items():
-        # Сортируем веса по порядку (если нужно сохранить порядок подходов)
-        # weights уже в порядке создания благодаря ORDER BY в SQL
-        weights_str = ", ".join([f"{w} кг" for w in weights])
-        sets_count = len(weights)
-        report_lines.append(
-            f"{date_str} | {program_name} | {exercise} ({sets_count} подхода) | {weights_str}"
-        )
+    # Разбиваем на части по границам строк, если сообщение слишком длинное
+    # Части отчёта отправляются после интерактивных ответов другим пользователям
+    with bulk_sends():
+        for chunk in pack_report_lines(report_lines):
+            await message.answer(chunk, reply_markup=ReplyKeyboardRemove())
+
+
+@dp.callback_query(F.data.startswith("report_all:"))
+async def process_report_page(callback: CallbackQuery):
+    """Переход по страницам отчёта за всё время"""
+    await callback.answer()
     
-    report_text = "\n".join(report_lines)
+    try:
+        _, anchor_id, page, direction = callback.data.split(":")
+        anchor_id, page = int(anchor_id), int(page)
+    except ValueError:
+        await callback.message.answer("❌ Ошибка при переходе по отчёту. Запросите его заново командой /report")
+        return
     
-    # Разбиваем на части, если сообщение слишком длинное
-    max_length = 4000
-    if len(report_text) > max_length:
-        chunks = [report_text[i:i+max_length] for i in range(0, len(report_text), max_length)]
-        for chunk in chunks:
-            await message.answer(chunk, reply_markup=ReplyKeyboardRemove())
-    else:
-        await message.answer(report_text, reply_markup=ReplyKeyboardRemove())
+    label_request("report_all")
+    result = await build_all_records_page(anchor_id, backward=direction == "p", page=max(page, 1))
+    if result is None:
+        await callback.message.edit_text(
+            "❌ Отчёт устарел: записи были изменены. Запросите его заново командой /report",
+            reply_markup=None
+        )
+        return
+    
+    report_text, keyboard = result
+    await callback.message.edit_text(report_text, reply_markup=keyboard)
 
 
 @dp.message(F.text & ~F.text.startswith('/'))
@@ -902,33 +1526,14 @@ async def handle_unknown_command(message: Message, state: FSMContext):
         if any(state in state_name for state in [
             'waiting_for_program_name',
             'waiting_for_program_text',
-            'waiting_for_weight'
+            'waiting_for_weight',
+            'waiting_for_import_file'
         ]):
             return  # Пропускаем, пусть обрабатывают специализированные обработчики
     
     # Если это не специальные тексты (выбор периода отчёта), показываем меню
     if message.text not in ["За день", "За неделю", "За всё время"]:
-        welcome_text = """
-🏋️ Добро пожаловать в бот для записи силовых упражнений!
-
-Доступные команды:
-/start - Начать работу
-/newprogram - Создать новую программу тренировок
-/programs - Список всех программ
-/startworkout - Начать тренировку
-/report - Просмотреть отчёты
-/deleteall - Удалить все программы
-
-Для создания программы:
-1. Введите название программы
-2. Введите упражнения в формате: упражнение\\подходы
-
-Пример:
-Приседания\\3
-Жим лёжа\\3
-Тяга\\3
-        """
-        await message.answer(welcome_text)
+        await message.answer(WELCOME_TEXT)
 
 
 async def periodic_metrics_update():
@@ -941,39 +1546,170 @@ async def periodic_metrics_update():
             logger.error(f"Ошибка при обновлении метрик: {e}")
 
 
-async def main():
-    """Основная функция запуска бота"""
+async def periodic_stats_reconcile():
+    """Периодическая сверка сводных счётчиков с исходными таблицами"""
+    while True:
+        try:
+            await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+            await stats.reconcile()
+        except Exception as e:
+            logger.error(f"Ошибка при сверке счётчиков метрик: {e}")
+
+
+async def periodic_retention():
+    """Периодическая свёртка журнала операций и возврат свободных страниц БД (первый проход - при запуске)"""
+    while True:
+        try:
+            await retention.run()
+        except Exception as e:
+            logger.error(f"Ошибка при обслуживании журнала операций: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+
+async def periodic_user_touch():
+    """Периодическая запись активности пользователей"""
+    while True:
+        try:
+            await asyncio.sleep(USER_TOUCH_INTERVAL)
+            await flush_user_touches()
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении активности пользователей: {e}")
+
+
+async def run_webhook():
+    """Приём обновлений через вебхук до сигнала остановки"""
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не установлен в переменных окружения!")
+    
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=min(WEBHOOK_MAX_CONCURRENT, 100)
+    )
+    logger.info(f"Вебхук установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
     try:
-        # Инициализация БД
-        await init_db()
-        
-        # Запуск HTTP сервера для метрик
+        await stop_event.wait()
+    finally:
+        # Вебхук не удаляется: Telegram накопит обновления до следующего запуска
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+
+
+# Фоновые задачи, HTTP-сервер и поток системных метрик, запущенные в startup()
+background_tasks = []
+http_runners = []
+system_sampler = None
+
+
+async def startup(app=None, reconcile: bool = True):
+    """Подготовка ресурсов бота: БД, очередь записи, фоновые задачи и HTTP сервер метрик.
+    reconcile - выполнять сверку счётчиков и обновлять метрики всей БД
+    (в группе процессов это делает один процесс, иначе значения дублируются)"""
+    # Инициализация БД
+    await init_db()
+    
+    # Открытие пула соединений с БД
+    await db_pool.open()
+    
+    # Запуск очереди отложенной записи
+    await write_queue.start()
+    
+    # Запуск HTTP сервера для метрик (в режиме вебхука он же принимает обновления)
+    if app is not None:
         from metrics_server import run_metrics_server
         metrics_port = int(os.getenv('METRICS_PORT', '8000'))
-        metrics_runner = await run_metrics_server(metrics_port)
+        http_runners.append(await run_metrics_server(metrics_port, app))
         logger.info(f"HTTP сервер метрик запущен на порту {metrics_port}")
-        
-        # Запуск периодического обновления метрик
-        metrics_task = asyncio.create_task(periodic_metrics_update())
-        
-        # Первоначальное обновление метрик
+    
+    # Системные метрики и метрики процесса обновляются в отдельном потоке
+    global system_sampler
+    system_sampler = SystemMetricsSampler(SYSTEM_METRICS_INTERVAL, asyncio.get_running_loop())
+    system_sampler.start()
+    
+    # Задержка цикла событий и блокирующие шаги обработчиков
+    loop_monitor.register_handlers(dp)
+    loop_monitor.start(asyncio.get_running_loop())
+    
+    # Процессы отрисовки графиков
+    if CHARTS_AVAILABLE:
+        chart_renderer.start()
+    
+    # Запуск периодической записи активности пользователей
+    background_tasks.append(asyncio.create_task(periodic_user_touch()))
+    
+    # Полный пересчёт счётчиков при запуске и первоначальное обновление метрик
+    if reconcile:
+        try:
+            await stats.reconcile()
+        except Exception as e:
+            logger.error(f"Ошибка при пересчёте счётчиков метрик: {e}")
+        background_tasks.append(asyncio.create_task(periodic_stats_reconcile()))
+        background_tasks.append(asyncio.create_task(periodic_retention()))
+        # Метрики из сводных таблиц: первоначальное и периодическое обновление
         await update_metrics()
+        background_tasks.append(asyncio.create_task(periodic_metrics_update()))
+
+
+async def shutdown():
+    """Остановка фоновых задач и освобождение ресурсов, запущенных в startup()"""
+    # Остановка сервера метрик
+    for runner in http_runners:
+        await runner.cleanup()
+    http_runners.clear()
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    if system_sampler is not None:
+        system_sampler.stop()
+    loop_monitor.stop()
+    chart_renderer.stop()
+    await card_editor.flush()
+    # Сброс состояний FSM и очереди отложенной записи, закрытие пула соединений с БД
+    await storage.close()
+    await flush_user_touches()
+    await write_queue.stop()
+    await db_pool.close()
+
+
+async def reset_caches():
+    """Сбросить кэши процесса (при перераспределении пользователей между процессами)"""
+    if isinstance(storage, SQLiteStorage):
+        await storage.flush()
+        storage.clear_cache()
+    user_cache.clear()
+    program_cache.invalidate()
+
+
+async def main():
+    """Основная функция запуска бота"""
+    try:
+        from metrics_server import create_app
+        app = create_app()
+        if BOT_MODE == 'webhook':
+            from webhook import setup_webhook
+            setup_webhook(app, dp, bot, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENT)
+        await startup(app)
         
         logger.info("Бот запущен...")
         
-        # Запуск polling
-        await dp.start_polling(bot)
+        if BOT_MODE == 'webhook':
+            await run_webhook()
+        else:
+            # Запуск polling
+            await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}", exc_info=True)
         raise
     finally:
-        # Остановка сервера метрик
-        if 'metrics_runner' in locals():
-            await metrics_runner.cleanup()
-        if 'metrics_task' in locals():
-            metrics_task.cancel()
+        await shutdown()
 
 
 if __name__ == '__main__':
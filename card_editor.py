@@ -0,0 +1,62 @@
+"""
+Отложенное редактирование сообщений (карточка тренировки)
+Изменения одного сообщения за короткий интервал объединяются: отправляется только последний текст
+"""
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from metrics import card_edits, card_edits_coalesced
+
+logger = logging.getLogger(__name__)
+
+
+class DebouncedEditor:
+    """Редактирование сообщений с задержкой и объединением правок"""
+
+    def __init__(self, bot: Bot, delay_ms: int = 300):
+        self.bot = bot
+        self.delay = delay_ms / 1000
+        # (chat_id, message_id) -> текст
+        self._pending = {}
+        self._tasks = {}
+
+    def schedule(self, chat_id: int, message_id: int, text: str):
+        """Запланировать замену текста сообщения; более поздняя правка заменяет ожидающую"""
+        key = (chat_id, message_id)
+        if key in self._pending:
+            card_edits_coalesced.inc()
+        self._pending[key] = text
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._delayed_edit(key))
+
+    async def _delayed_edit(self, key):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._tasks.pop(key, None)
+        await self._edit(key)
+
+    async def _edit(self, key):
+        text = self._pending.pop(key, None)
+        if text is None:
+            return
+        chat_id, message_id = key
+        try:
+            await self.bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id)
+            card_edits.inc()
+        except TelegramBadRequest as e:
+            # В том числе "message is not modified" и удалённые пользователем сообщения
+            logger.warning(f"Не удалось обновить сообщение {message_id} в чате {chat_id}: {e}")
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении сообщения {message_id} в чате {chat_id}: {e}")
+
+    async def flush(self):
+        """Отправить все ожидающие правки сразу"""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._tasks.clear()
+        for key in list(self._pending):
+            await self._edit(key)
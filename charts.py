@@ -0,0 +1,181 @@
+"""
+Графики прогресса по упражнениям
+PNG рисуется в отдельных процессах (ProcessPoolExecutor), чтобы не блокировать цикл событий.
+Готовые изображения хранятся в LRU-кэше с ключом (упражнение, период, версия): файлы лежат на диске,
+а индекс - в памяти процесса, поэтому кэш живёт, пока работает процесс, и пуст после перезапуска.
+Версию вычисляет вызывающий код по БД и дате начала периода, поэтому новый подход, сохранённый
+любым процессом, или сдвиг окна периода делают устаревшими только графики этого упражнения.
+"""
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import (
+    chart_render_duration, chart_cache_hits, chart_cache_misses, chart_queue_depth, chart_rejected
+)
+
+logger = logging.getLogger(__name__)
+
+# matplotlib нужен только процессам отрисовки, в основном процессе он не импортируется
+CHARTS_AVAILABLE = importlib.util.find_spec('matplotlib') is not None
+
+# Возраст каталога кэша, после которого он считается оставшимся от упавшего процесса (сек)
+STALE_DIR_AGE = 24 * 3600
+
+
+class ChartQueueFull(Exception):
+    """Очередь отрисовки заполнена"""
+
+
+def render_progress_chart(path: str, title: str, dates: list, weights: list) -> float:
+    """Нарисовать график максимального веса по дням в файл PNG (выполняется в процессе пула).
+    Возвращает время отрисовки в секундах."""
+    started = time.perf_counter()
+    import matplotlib
+    matplotlib.use('Agg')
+    from datetime import date
+    from matplotlib import pyplot
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+
+    figure, axes = pyplot.subplots(figsize=(8, 4.5), dpi=100)
+    try:
+        axes.plot([date.fromisoformat(d) for d in dates], weights, marker='o', markersize=3, linewidth=1.5)
+        locator = AutoDateLocator()
+        axes.xaxis.set_major_locator(locator)
+        axes.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+        axes.set_title(title)
+        axes.set_ylabel('кг')
+        axes.grid(True, alpha=0.3)
+        figure.tight_layout()
+        # Запись во временный файл и переименование: кэш не увидит недописанный PNG
+        temporary = f"{path}.{os.getpid()}.tmp"
+        figure.savefig(temporary, format='png')
+        os.replace(temporary, path)
+    finally:
+        pyplot.close(figure)
+    return time.perf_counter() - started
+
+
+class ChartRenderer:
+    """Пул процессов отрисовки с ограниченной очередью и LRU-кэшем на время работы процесса"""
+
+    def __init__(self, cache_dir: str, max_entries: int = 500, workers: int = 2, max_pending: int = 8):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.workers = workers
+        self.max_pending = max_pending
+        # Ключ кэша -> путь к файлу, в порядке последнего использования
+        self._entries = OrderedDict()
+        # Ключ кэша -> задача отрисовки (одинаковые запросы ждут одну отрисовку)
+        self._rendering = {}
+        self._pending = 0
+        self._executor = None
+        self._dir = None
+
+    def start(self):
+        # Каталоги кэша создаются только здесь (из startup() бота), а не при импорте
+        # У каждого процесса свой подкаталог: процессы супервизора не удаляют файлы друг друга
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._remove_stale_dirs()
+        self._dir = os.path.join(self.cache_dir, str(os.getpid()))
+        os.makedirs(self._dir, exist_ok=True)
+        # spawn: дочерние процессы не наследуют потоки и соединения основного процесса
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._entries.clear()
+
+    def _remove_stale_dirs(self):
+        """Удалить каталоги процессов, завершившихся без stop() (не обновлялись STALE_DIR_AGE)"""
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.is_dir() and now - entry.stat().st_mtime > STALE_DIR_AGE:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def cached(self, exercise_key, period: int, version):
+        """Путь к готовому графику для версии данных version или None"""
+        key = (exercise_key, period, version)
+        path = self._entries.get(key)
+        if path is None or not os.path.exists(path):
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        chart_cache_hits.inc()
+        return path
+
+    async def chart(self, exercise_key, period: int, version, title: str, load_points) -> str:
+        """Путь к PNG графика; load_points() -> [(дата, вес)] вызывается только при промахе кэша.
+        version - версия данных упражнения и окна периода: при её изменении график рисуется заново.
+        Возвращает None, если данных нет; ChartQueueFull - если очередь отрисовки заполнена."""
+        path = self.cached(exercise_key, period, version)
+        if path is not None:
+            return path
+        key = (exercise_key, period, version)
+        task = self._rendering.get(key)
+        if task is None:
+            if self._pending >= self.max_pending:
+                chart_rejected.inc()
+                raise ChartQueueFull()
+            chart_cache_misses.inc()
+            # Место в очереди занимается до первого await: параллельные запросы не превысят max_pending
+            self._pending += 1
+            chart_queue_depth.set(self._pending)
+            task = asyncio.ensure_future(self._render(key, title, load_points))
+            self._rendering[key] = task
+            task.add_done_callback(lambda _: self._rendering.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _render(self, key, title: str, load_points) -> str:
+        """Отрисовка в пуле процессов; место в очереди уже занято вызывающим chart()"""
+        try:
+            points = await load_points()
+            if not points:
+                return None
+            dates = [point[0] for point in points]
+            weights = [point[1] for point in points]
+            name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            # Каталог мог быть удалён как устаревший другим процессом после долгого простоя
+            os.makedirs(self._dir, exist_ok=True)
+            path = os.path.join(self._dir, f"{name}.png")
+            loop = asyncio.get_running_loop()
+            seconds = await loop.run_in_executor(
+                self._executor, render_progress_chart, path, title, dates, weights
+            )
+            chart_render_duration.observe(seconds)
+        finally:
+            self._pending -= 1
+            chart_queue_depth.set(self._pending)
+        self._entries[key] = path
+        self._evict(key)
+        return path
+
+    def _evict(self, latest):
+        # Прежние версии того же графика больше не запрашиваются: данные и окно периода только сдвигаются вперёд
+        for key in [key for key in self._entries if key[:2] == latest[:2] and key != latest]:
+            self._remove(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        path = self._entries.pop(key)
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить файл графика {path}: {e}")
@@ -0,0 +1,332 @@
+"""
+Бенчмарк запросов к БД на больших наборах данных
+Генератор создаёт базу с пользователями, программами, упражнениями и записями тренировок
+(масштаб 1.0: 10 тыс. пользователей, 100 тыс. программ, 10 млн записей). Запросы бота выполняются
+через те же функции, что и в обработчиках, с холодным и прогретым кэшем; время по именованным
+запросам берётся из метрик слоя queries. Результаты сохраняются в JSON и сравниваются с базовым прогоном.
+
+Пример:
+    python db_bench.py --scale 0.1
+    python db_bench.py --scale 0.1 --baseline data/bench/before.json --threshold 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Размер набора данных при масштабе 1.0
+USERS = 10_000
+PROGRAMS = 100_000
+RECORDS = 10_000_000
+OPERATIONS_PER_USER = 20
+EXERCISES_PER_PROGRAM = 5
+SETS_PER_EXERCISE = 3
+# Период, за который распределены записи, и доля активных программ
+HISTORY_DAYS = 730
+ACTIVE_SHARE = 0.05
+
+EXERCISE_NAMES = ['Приседания', 'Жим лёжа', 'Становая тяга', 'Жим стоя', 'Тяга в наклоне', 'Подтягивания']
+OPERATION_TYPES = ['start', 'startworkout', 'select_program', 'save_record', 'report', 'report_view']
+
+
+def generate_fixture(path: str, scale: float, seed: int = 42):
+    """Создать базу через db_init.py и заполнить её синтетическими данными"""
+    os.environ['DATABASE'] = path
+    import db_init
+    db_init.DATABASE_PATH = path
+    db_init.init_database()
+
+    rng = random.Random(seed)
+    users = max(int(USERS * scale), 1)
+    programs = max(int(PROGRAMS * scale), 1)
+    records = max(int(RECORDS * scale), 1)
+    today = date.today()
+    first_day = today - timedelta(days=HISTORY_DAYS - 1)
+    started = time.perf_counter()
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA cache_size=-262144')
+        # Триггеры сводных счётчиков на время загрузки отключаются, счётчики пересчитываются в конце
+        triggers = [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_stats_%'"
+        )]
+        for name in triggers:
+            conn.execute(f'DROP TRIGGER {name}')
+
+        def timestamp(day: date, seconds: int) -> str:
+            return f"{day.isoformat()} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+        def random_day() -> date:
+            return first_day + timedelta(days=rng.randrange(HISTORY_DAYS))
+
+        conn.executemany(
+            'INSERT INTO users (user_id, first_name, registered_at, last_activity) VALUES (?, ?, ?, ?)',
+            ((user_id, f"user{user_id}", timestamp(random_day(), rng.randrange(86400)),
+              timestamp(today, rng.randrange(86400))) for user_id in range(1, users + 1))
+        )
+        conn.executemany(
+            'INSERT INTO operations (user_id, operation_type, created_at) VALUES (?, ?, ?)',
+            ((rng.randint(1, users), rng.choice(OPERATION_TYPES), timestamp(random_day(), rng.randrange(86400)))
+             for _ in range(users * OPERATIONS_PER_USER))
+        )
+        # Программы создаются по порядку: старые архивные, последние ACTIVE_SHARE - активные
+        active_from = programs - max(int(programs * ACTIVE_SHARE), 1)
+        conn.executemany(
+            'INSERT INTO programs (id, name, created_at, active) VALUES (?, ?, ?, ?)',
+            ((program_id, f"Программа {program_id}",
+              timestamp(first_day + timedelta(days=(program_id - 1) * HISTORY_DAYS // programs), 0),
+              int(program_id > active_from)) for program_id in range(1, programs + 1))
+        )
+        conn.executemany(
+            'INSERT INTO exercises (id, program_id, day, exercise, sets, position) VALUES (?, ?, ?, ?, ?, ?)',
+            (((program_id - 1) * EXERCISES_PER_PROGRAM + position + 1, program_id,
+              'Общий' if program_id % 2 else f"День {position % 2 + 1}",
+              EXERCISE_NAMES[(program_id + position) % len(EXERCISE_NAMES)], SETS_PER_EXERCISE, position)
+             for program_id in range(1, programs + 1) for position in range(EXERCISES_PER_PROGRAM))
+        )
+        db_init.assign_canonical_exercises(conn.cursor())
+
+        def workout_records():
+            # Тренировка - все подходы всех упражнений одной программы; записи идут в порядке времени
+            per_workout = EXERCISES_PER_PROGRAM * SETS_PER_EXERCISE
+            per_day = max(records // HISTORY_DAYS, per_workout)
+            produced = 0
+            for day_index in range(HISTORY_DAYS):
+                day = first_day + timedelta(days=day_index)
+                seconds = 6 * 3600
+                for _ in range(per_day // per_workout):
+                    if produced >= records:
+                        return
+                    program_id = rng.randint(1, programs)
+                    base_weight = rng.randrange(20, 120)
+                    for position in range(EXERCISES_PER_PROGRAM):
+                        exercise_id = (program_id - 1) * EXERCISES_PER_PROGRAM + position + 1
+                        for set_number in range(1, SETS_PER_EXERCISE + 1):
+                            seconds = min(seconds + rng.randrange(1, 4), 86399)
+                            created_at = timestamp(day, seconds)
+                            yield (program_id, exercise_id, day.isoformat(), set_number,
+                                   base_weight + 2.5 * rng.randrange(5), created_at)
+                            produced += 1
+
+        conn.executemany(
+            'INSERT INTO records (program_id, exercise_id, date, set_number, weight, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            workout_records()
+        )
+
+        db_init.create_stats_schema(conn.cursor())
+        conn.execute('DELETE FROM stats_totals')
+        conn.execute('''
+            INSERT INTO stats_totals (name, value)
+            SELECT 'users', COUNT(*) FROM users
+            UNION ALL SELECT 'programs', COUNT(*) FROM programs
+            UNION ALL SELECT 'programs_active', COUNT(*) FROM programs WHERE active = 1
+            UNION ALL SELECT 'records', COUNT(*) FROM records
+        ''')
+        conn.execute('DELETE FROM stats_daily_records')
+        conn.execute('INSERT INTO stats_daily_records (day, count) SELECT date, COUNT(*) FROM records GROUP BY date')
+        aggregates = db_init.rebuild_daily_exercise_stats(conn.cursor(), batch_size=10_000)
+        db_init.rebuild_catalog_personal_records(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+    counts = fixture_counts(path)
+    print(f"[OK] Набор данных создан за {time.perf_counter() - started:.0f} с: пользователей {counts['users']}, "
+          f"программ {counts['programs']}, записей {counts['records']}, агрегатов {aggregates}")
+
+
+def fixture_counts(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            for table in ('users', 'operations', 'programs', 'exercises', 'records', 'daily_exercise_stats')
+        }
+    finally:
+        conn.close()
+
+
+def evict_os_cache(path: str):
+    """Убрать файлы БД из страничного кэша ОС (где это поддерживается)"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            fd = os.open(path + suffix, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def query_samples() -> dict:
+    """Текущие суммы и количества гистограммы длительности именованных запросов"""
+    from metrics import db_query_duration
+
+    samples = {}
+    for metric in db_query_duration.collect():
+        for sample in metric.samples:
+            if sample.name.endswith(('_sum', '_count')):
+                name = sample.labels['query']
+                kind = 'sum' if sample.name.endswith('_sum') else 'count'
+                samples.setdefault(name, {'sum': 0.0, 'count': 0.0})[kind] = sample.value
+    return samples
+
+
+def query_breakdown(before: dict, after: dict) -> dict:
+    breakdown = {}
+    for name, values in after.items():
+        calls = values['count'] - before.get(name, {}).get('count', 0.0)
+        if calls:
+            total = values['sum'] - before.get(name, {}).get('sum', 0.0)
+            breakdown[name] = {'calls': int(calls), 'mean_ms': round(total / calls * 1000, 3)}
+    return breakdown
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def bench_cases(bot, counts: dict) -> dict:
+    """Сценарии бенчмарка: функции бота, выполняющие именованные запросы"""
+    rng = random.Random(7)
+    programs = max(counts['programs'], 1)
+    middle_anchor = max(counts['daily_exercise_stats'] // 2, 1)
+    return {
+        'records_day': bot.get_records_day,
+        'records_week': bot.get_records_week,
+        'records_all_first_page': bot.get_records_page,
+        'records_all_middle_page': lambda: bot.get_records_page(anchor_id=middle_anchor),
+        'records_all_middle_page_back': lambda: bot.get_records_page(anchor_id=middle_anchor, backward=True),
+        'active_programs': bot.load_active_programs,
+        'all_programs': bot.get_all_programs,
+        'program_exercises': lambda: bot.load_program_exercises(rng.randint(1, programs)),
+        'metrics_refresh': bot.stats.refresh,
+        'metrics_reconcile': bot.stats.reconcile,
+    }
+
+
+async def run_benchmark(path: str, iterations: int, only: list = None) -> dict:
+    import bot
+
+    counts = fixture_counts(path)
+    cases = bench_cases(bot, counts)
+    if only:
+        cases = {name: case for name, case in cases.items() if name in only}
+    results = {}
+    for name, case in cases.items():
+        # Холодный прогон: новые соединения (пустой кэш страниц SQLite) и вытеснение файла из кэша ОС
+        await bot.db_pool.close()
+        evict_os_cache(path)
+        await bot.db_pool.open()
+        before = query_samples()
+        start = time.perf_counter()
+        await case()
+        cold = time.perf_counter() - start
+        cold_queries = query_breakdown(before, query_samples())
+
+        warm = []
+        before = query_samples()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await case()
+            warm.append(time.perf_counter() - start)
+        results[name] = {
+            'cold_ms': round(cold * 1000, 3),
+            'warm_p50_ms': round(percentile(warm, 0.50) * 1000, 3),
+            'warm_p95_ms': round(percentile(warm, 0.95) * 1000, 3),
+            'queries_cold': cold_queries,
+            'queries_warm': query_breakdown(before, query_samples()),
+        }
+        print(f"{name:<30}{results[name]['cold_ms']:>12}{results[name]['warm_p50_ms']:>12}"
+              f"{results[name]['warm_p95_ms']:>12}")
+    await bot.db_pool.close()
+    return {'counts': counts, 'results': results}
+
+
+def compare(current: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    """Регрессии относительно базового прогона: рост времени больше чем на threshold
+    и не меньше min_delta_ms (быстрые запросы колеблются на доли миллисекунды)"""
+    regressions = []
+    for name, values in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        for key in ('cold_ms', 'warm_p50_ms', 'warm_p95_ms'):
+            if base[key] > 0 and values[key] > base[key] * (1 + threshold) \
+                    and values[key] - base[key] >= min_delta_ms:
+                regressions.append((name, key, base[key], values[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов к БД бота тренировок")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="масштаб набора данных (1.0: 10 тыс. пользователей, 100 тыс. программ, 10 млн записей)")
+    parser.add_argument('--database', help="путь к базе набора данных (по умолчанию data/bench-<масштаб>.db)")
+    parser.add_argument('--regenerate', action='store_true', help="пересоздать набор данных")
+    parser.add_argument('--iterations', type=int, default=20, help="прогонов с прогретым кэшем")
+    parser.add_argument('--only', nargs='*', help="запустить только указанные сценарии")
+    parser.add_argument('--output', help="файл результатов JSON (по умолчанию data/bench/<дата>.json)")
+    parser.add_argument('--baseline', help="файл результатов для сравнения")
+    parser.add_argument('--threshold', type=float, default=0.2, help="допустимый рост времени (0.2 = 20%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help="минимальный рост времени (мс), который считается регрессией")
+    args = parser.parse_args()
+
+    path = args.database or f"./data/bench-{args.scale:g}.db"
+    if args.regenerate and os.path.exists(path):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    if not os.path.exists(path):
+        generate_fixture(path, args.scale)
+
+    # Модуль бота читает настройки окружения при импорте; запросы в Telegram не отправляются
+    os.environ['DATABASE'] = path
+    os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+    logging.disable(logging.WARNING)
+
+    print(f"{'сценарий':<30}{'холодный, мс':>12}{'p50, мс':>12}{'p95, мс':>12}")
+    result = asyncio.run(run_benchmark(path, args.iterations, args.only))
+    result.update({
+        'scale': args.scale,
+        'iterations': args.iterations,
+        'sqlite_version': sqlite3.sqlite_version,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    })
+
+    output = Path(args.output or f"./data/bench/{datetime.now():%Y%m%d-%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"\n[OK] Результаты сохранены: {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        if baseline.get('counts') != result['counts']:
+            print("[WARN] Наборы данных базового и текущего прогона различаются")
+        regressions = compare(result, baseline, args.threshold, args.min_delta_ms)
+        for name, key, before, after in regressions:
+            print(f"[REGRESSION] {name} {key}: {before} -> {after} мс (+{(after / before - 1) * 100:.0f}%)")
+        if regressions:
+            return 1
+        print(f"[OK] Регрессий больше {args.threshold * 100:.0f}% нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,10 +3,16 @@
 Создаёт структуру БД для хранения программ тренировок и записей
 """
 import os
+import json
+import argparse
 import sqlite3
 from pathlib import Path
 from dotenv import load_dotenv
 
+from exercise_catalog import (
+    DEFAULT_MATCH_THRESHOLD, normalize_exercise_name, fuzzy_match_allowed, resolve_exercise_sync
+)
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -26,6 +32,574 @@ def create_data_directory():
         print(f"[INFO] Папка уже существует: {data_dir}")
 
 
+def create_stats_schema(cursor):
+    """Создание сводных таблиц счётчиков и триггеров, поддерживающих их"""
+    # Итоговые счётчики (users, programs, programs_active, records)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    
+    # Счётчики по дням для метрик "за сегодня"
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_daily_operations (
+            day TEXT NOT NULL,
+            operation_type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, operation_type)
+        ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_daily_users (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_daily_records (
+            day TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    
+    # Триггеры пользователей
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO stats_totals (name, value) VALUES ('users', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE stats_totals SET value = value - 1 WHERE name = 'users';
+        END
+    ''')
+    
+    # Триггеры программ
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_programs_insert AFTER INSERT ON programs
+        BEGIN
+            INSERT INTO stats_totals (name, value) VALUES ('programs', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            INSERT INTO stats_totals (name, value) VALUES ('programs_active', NEW.active = 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + (NEW.active = 1);
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_programs_delete AFTER DELETE ON programs
+        BEGIN
+            UPDATE stats_totals SET value = value - 1 WHERE name = 'programs';
+            UPDATE stats_totals SET value = value - (OLD.active = 1) WHERE name = 'programs_active';
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_programs_active AFTER UPDATE OF active ON programs
+        WHEN (NEW.active = 1) != (OLD.active = 1)
+        BEGIN
+            UPDATE stats_totals SET value = value + (NEW.active = 1) - (OLD.active = 1)
+            WHERE name = 'programs_active';
+        END
+    ''')
+    
+    # Триггеры записей тренировок
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_records_insert AFTER INSERT ON records
+        BEGIN
+            INSERT INTO stats_totals (name, value) VALUES ('records', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            INSERT INTO stats_daily_records (day, count) VALUES (NEW.date, 1)
+            ON CONFLICT(day) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_records_delete AFTER DELETE ON records
+        BEGIN
+            UPDATE stats_totals SET value = value - 1 WHERE name = 'records';
+            UPDATE stats_daily_records SET count = count - 1 WHERE day = OLD.date;
+        END
+    ''')
+    
+    # Триггер операций (удаление старых операций счётчики не меняет)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_operations_insert AFTER INSERT ON operations
+        BEGIN
+            INSERT INTO stats_daily_operations (day, operation_type, count)
+            VALUES (date(NEW.created_at), NEW.operation_type, 1)
+            ON CONFLICT(day, operation_type) DO UPDATE SET count = count + 1;
+            INSERT OR IGNORE INTO stats_daily_users (day, user_id)
+            VALUES (date(NEW.created_at), NEW.user_id);
+        END
+    ''')
+
+
+def create_base_indexes(cursor):
+    """Создание исходных индексов"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_exercises_program_id 
+        ON exercises(program_id)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_records_program_id 
+        ON records(program_id)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_records_exercise_id 
+        ON records(exercise_id)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_records_date 
+        ON records(date)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_programs_active 
+        ON programs(active)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_user_id 
+        ON users(user_id)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_operations_user_id 
+        ON operations(user_id)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_operations_created_at 
+        ON operations(created_at)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_operations_type 
+        ON operations(operation_type)
+    ''')
+
+
+def create_composite_indexes(cursor):
+    """Составные и покрывающие индексы для запросов по диапазонам дат"""
+    # Операции за день: диапазон по created_at, группировка по типу, уникальные пользователи
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_operations_created_type_user
+        ON operations(created_at, operation_type, user_id)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_operations_created_at')
+    
+    # Отчёты: диапазон по дате с сортировкой по времени создания
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_records_date_created
+        ON records(date, created_at)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_records_date')
+    
+    # Список активных программ в порядке создания
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_programs_active_created
+        ON programs(active, created_at)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_programs_active')
+    
+    # Упражнения программы в порядке position
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_exercises_program_position
+        ON exercises(program_id, position)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_exercises_program_id')
+    
+    # Дублирует автоматический индекс ограничения UNIQUE(user_id)
+    cursor.execute('DROP INDEX IF EXISTS idx_users_user_id')
+
+
+def create_daily_exercise_stats(cursor):
+    """Материализованные агрегаты подходов по дням, программам и упражнениям"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_exercise_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date DATE NOT NULL,
+            program_id INTEGER NOT NULL,
+            exercise_id INTEGER NOT NULL,
+            set_count INTEGER NOT NULL DEFAULT 0,
+            weights TEXT NOT NULL DEFAULT '[]',
+            total_volume REAL NOT NULL DEFAULT 0,
+            max_weight REAL,
+            first_created_at TIMESTAMP,
+            UNIQUE (date, program_id, exercise_id),
+            FOREIGN KEY (program_id) REFERENCES programs(id) ON DELETE CASCADE,
+            FOREIGN KEY (exercise_id) REFERENCES exercises(id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Отчёты: диапазон по дате в порядке первого подхода
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_daily_exercise_stats_date_created
+        ON daily_exercise_stats(date, first_created_at)
+    ''')
+    
+    rebuild_daily_exercise_stats(cursor)
+
+
+def rebuild_daily_exercise_stats(cursor, batch_size: int = 1000) -> int:
+    """Пересобрать daily_exercise_stats из таблицы records.
+    Записи читаются потоково в порядке подходов, агрегаты пишутся пакетами."""
+    cursor.execute('DELETE FROM daily_exercise_stats')
+    
+    insert_sql = '''
+        INSERT INTO daily_exercise_stats
+            (date, program_id, exercise_id, set_count, weights, total_volume, max_weight, first_created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    # Отдельный курсор для чтения, чтобы запись не сбрасывала выборку
+    reader = cursor.connection.cursor()
+    reader.execute('''
+        SELECT date, program_id, exercise_id, weight, created_at
+        FROM records
+        ORDER BY date, program_id, exercise_id, created_at, id
+    ''')
+    
+    batch = []
+    total = 0
+    key, weights, first_created_at = None, [], None
+    
+    def flush_group():
+        non_empty = [w for w in weights if w is not None]
+        batch.append((
+            *key, len(weights), json.dumps(weights, separators=(',', ':')),
+            sum(non_empty), max(non_empty) if non_empty else None, first_created_at
+        ))
+    
+    for date_str, program_id, exercise_id, weight, created_at in reader:
+        row_key = (date_str, program_id, exercise_id)
+        if row_key != key:
+            if key is not None:
+                flush_group()
+                if len(batch) >= batch_size:
+                    cursor.executemany(insert_sql, batch)
+                    total += len(batch)
+                    batch = []
+            key, weights, first_created_at = row_key, [], created_at
+        weights.append(weight)
+    if key is not None:
+        flush_group()
+    if batch:
+        cursor.executemany(insert_sql, batch)
+        total += len(batch)
+    return total
+
+
+def create_fsm_storage(cursor):
+    """Таблица состояний FSM (компактная JSON-запись на ключ)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+
+
+def create_operations_daily(cursor):
+    """Дневные сводки журнала операций (сырые строки старше окна хранения удаляются, см. retention.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS operations_daily (
+            date TEXT NOT NULL,
+            operation_type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            distinct_users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, operation_type)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Отметки фоновых процессов обслуживания (например, последний свёрнутый день)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_state (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def enable_incremental_vacuum(conn):
+    """Перевести БД в режим auto_vacuum=INCREMENTAL.
+    Режим меняется только через VACUUM вне транзакции, поэтому это не миграция в общем списке;
+    VACUUM выполняется один раз, дальше свободные страницы возвращаются через incremental_vacuum."""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    try:
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+    except sqlite3.OperationalError as e:
+        # БД занята другим процессом: режим будет включён при следующем запуске
+        print(f"[WARN] Не удалось включить auto_vacuum=INCREMENTAL: {e}")
+        return False
+    print("[OK] Включён режим auto_vacuum=INCREMENTAL")
+    return True
+
+
+# Схема версии 7: ключ - название упражнения. Миграция 8 пересоздаёт таблицу с ключом
+# по каталогу упражнений (rebuild_catalog_personal_records)
+def create_personal_records(cursor):
+    """Личные рекорды по упражнениям: максимальный вес в подходе и лучший объём за день.
+    Таблица обновляется при каждом сохранении подхода (см. save_record в bot.py)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS personal_records (
+            exercise TEXT PRIMARY KEY,
+            max_weight REAL NOT NULL,
+            max_weight_set INTEGER,
+            max_weight_date DATE,
+            best_volume REAL NOT NULL DEFAULT 0,
+            best_volume_date DATE,
+            last_improvement INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+    
+    rebuild_personal_records(cursor)
+
+
+def rebuild_personal_records(cursor) -> int:
+    """Пересобрать personal_records из records и daily_exercise_stats"""
+    cursor.execute('DELETE FROM personal_records')
+    # Для MAX() SQLite берёт остальные столбцы из строки с максимумом
+    cursor.execute('''
+        INSERT INTO personal_records (exercise, max_weight, max_weight_set, max_weight_date)
+        SELECT e.exercise, MAX(r.weight), r.set_number, r.date
+        FROM records r
+        JOIN exercises e ON r.exercise_id = e.id
+        WHERE r.weight IS NOT NULL
+        GROUP BY e.exercise
+    ''')
+    cursor.execute('''
+        UPDATE personal_records
+        SET best_volume = best.volume, best_volume_date = best.date
+        FROM (
+            SELECT e.exercise, MAX(s.total_volume) AS volume, s.date
+            FROM daily_exercise_stats s
+            JOIN exercises e ON s.exercise_id = e.id
+            GROUP BY e.exercise
+        ) AS best
+        WHERE personal_records.exercise = best.exercise
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM personal_records')
+    return cursor.fetchone()[0]
+
+
+def create_exercise_catalog(cursor):
+    """Каталог упражнений с индексом триграмм и ссылка на него из exercises.
+    Личные рекорды переводятся с названия упражнения на ключ каталога."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exercise_catalog (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            word_count INTEGER NOT NULL,
+            trigram_count INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Все встречавшиеся нормальные формы названий (варианты написания) -> запись каталога
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exercise_names (
+            normalized TEXT PRIMARY KEY,
+            catalog_id INTEGER NOT NULL,
+            FOREIGN KEY (catalog_id) REFERENCES exercise_catalog(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    # Индекс для нечёткого поиска: триграмма -> записи каталога
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exercise_trigrams (
+            trigram TEXT NOT NULL,
+            catalog_id INTEGER NOT NULL,
+            PRIMARY KEY (trigram, catalog_id),
+            FOREIGN KEY (catalog_id) REFERENCES exercise_catalog(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute('ALTER TABLE exercises ADD COLUMN canonical_exercise_id INTEGER REFERENCES exercise_catalog(id)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_exercises_canonical
+        ON exercises(canonical_exercise_id)
+    ''')
+    # Графики и рекорды: дни подходов упражнения
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_daily_exercise_stats_exercise_date
+        ON daily_exercise_stats(exercise_id, date)
+    ''')
+    assign_canonical_exercises(cursor)
+    
+    cursor.execute('DROP TABLE IF EXISTS personal_records')
+    cursor.execute('''
+        CREATE TABLE personal_records (
+            canonical_exercise_id INTEGER PRIMARY KEY,
+            max_weight REAL NOT NULL,
+            max_weight_set INTEGER,
+            max_weight_date DATE,
+            best_volume REAL NOT NULL DEFAULT 0,
+            best_volume_date DATE,
+            last_improvement INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (canonical_exercise_id) REFERENCES exercise_catalog(id) ON DELETE CASCADE
+        )
+    ''')
+    rebuild_catalog_personal_records(cursor)
+
+
+def assign_canonical_exercises(cursor, threshold: float = DEFAULT_MATCH_THRESHOLD) -> int:
+    """Связать упражнения без canonical_exercise_id с каталогом.
+    Названия обрабатываются в порядке появления: первое написание становится названием в каталоге."""
+    cursor.execute('''
+        SELECT exercise FROM exercises
+        WHERE canonical_exercise_id IS NULL
+        GROUP BY exercise
+        ORDER BY MIN(id)
+    ''')
+    catalog_ids = {
+        name: resolve_exercise_sync(cursor, name, threshold)[0] for name, in cursor.fetchall()
+    }
+    cursor.execute('SELECT id, exercise FROM exercises WHERE canonical_exercise_id IS NULL')
+    updates = [(catalog_ids[name], exercise_id) for exercise_id, name in cursor.fetchall()]
+    cursor.executemany('UPDATE exercises SET canonical_exercise_id = ? WHERE id = ?', updates)
+    return len(updates)
+
+
+def split_mismatched_exercises(cursor):
+    """Разделить записи каталога, объединившие разные упражнения («Отжимания 1» и «Отжимания 2»,
+    «Жим гантелей лёжа на скамье» и «Жим гантелей сидя на скамье»): написания, которые по правилам
+    exercise_catalog.fuzzy_match_allowed не являются опечатками названия в каталоге,
+    сопоставляются заново, личные рекорды пересобираются"""
+    cursor.execute('''
+        SELECT n.normalized, c.name
+        FROM exercise_names n
+        JOIN exercise_catalog c ON c.id = n.catalog_id
+    ''')
+    mismatched = {normalized for normalized, name in cursor.fetchall() if not fuzzy_match_allowed(normalized, name)}
+    if not mismatched:
+        return
+    cursor.executemany('DELETE FROM exercise_names WHERE normalized = ?', [(name,) for name in mismatched])
+    cursor.execute('SELECT id, exercise FROM exercises')
+    cursor.executemany(
+        'UPDATE exercises SET canonical_exercise_id = NULL WHERE id = ?',
+        [(exercise_id,) for exercise_id, name in cursor.fetchall() if normalize_exercise_name(name) in mismatched]
+    )
+    assign_canonical_exercises(cursor)
+    rebuild_catalog_personal_records(cursor)
+
+
+def rebuild_catalog_personal_records(cursor) -> int:
+    """Пересобрать personal_records (ключ - запись каталога упражнений) из records и daily_exercise_stats"""
+    cursor.execute('DELETE FROM personal_records')
+    # Для MAX() SQLite берёт остальные столбцы из строки с максимумом
+    cursor.execute('''
+        INSERT INTO personal_records (canonical_exercise_id, max_weight, max_weight_set, max_weight_date)
+        SELECT e.canonical_exercise_id, MAX(r.weight), r.set_number, r.date
+        FROM records r
+        JOIN exercises e ON r.exercise_id = e.id
+        WHERE r.weight IS NOT NULL AND e.canonical_exercise_id IS NOT NULL
+        GROUP BY e.canonical_exercise_id
+    ''')
+    cursor.execute('''
+        UPDATE personal_records
+        SET best_volume = best.volume, best_volume_date = best.date
+        FROM (
+            -- Объём дня - сумма по всем программам с этим упражнением каталога
+            SELECT canonical_exercise_id, MAX(volume) AS volume, date
+            FROM (
+                SELECT e.canonical_exercise_id, s.date, SUM(s.total_volume) AS volume
+                FROM daily_exercise_stats s
+                JOIN exercises e ON s.exercise_id = e.id
+                WHERE e.canonical_exercise_id IS NOT NULL
+                GROUP BY e.canonical_exercise_id, s.date
+            )
+            GROUP BY canonical_exercise_id
+        ) AS best
+        WHERE personal_records.canonical_exercise_id = best.canonical_exercise_id
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM personal_records')
+    return cursor.fetchone()[0]
+
+
+# Миграции схемы: (версия, описание, функция(cursor))
+# Новые миграции добавляются только в конец списка
+MIGRATIONS = [
+    (1, 'Исходные индексы', create_base_indexes),
+    (2, 'Сводные таблицы и триггеры метрик', create_stats_schema),
+    (3, 'Составные и покрывающие индексы', create_composite_indexes),
+    (4, 'Агрегаты подходов по дням и упражнениям', create_daily_exercise_stats),
+    (5, 'Хранилище состояний FSM', create_fsm_storage),
+    (6, 'Дневные сводки журнала операций', create_operations_daily),
+    (7, 'Личные рекорды по упражнениям', create_personal_records),
+    (8, 'Каталог упражнений и индекс триграмм', create_exercise_catalog),
+    (9, 'Разделение упражнений каталога с разными числами в названии', split_mismatched_exercises),
+    (10, 'Рекорд объёма за день по всем программам', rebuild_catalog_personal_records),
+    (11, 'Разделение упражнений каталога, отличающихся не опечаткой', split_mismatched_exercises),
+]
+
+
+def get_schema_version(cursor) -> int:
+    """Текущая версия схемы БД"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def run_migrations(conn) -> list:
+    """Применить недостающие миграции, каждую в отдельной транзакции"""
+    cursor = conn.cursor()
+    current_version = get_schema_version(cursor)
+    conn.commit()
+    
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        try:
+            cursor.execute('BEGIN')
+            migrate(cursor)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            print(f"[ERROR] Ошибка миграции {version}: {description}")
+            raise
+        print(f"[OK] Миграция {version}: {description}")
+        applied.append(version)
+    
+    enable_incremental_vacuum(conn)
+    return applied
+
+
+def migrate_database(database_path: str = DATABASE_PATH) -> list:
+    """Применить миграции к существующей базе данных"""
+    conn = sqlite3.connect(database_path)
+    try:
+        return run_migrations(conn)
+    finally:
+        conn.close()
+
+
 def init_database():
     """Инициализация базы данных и создание всех таблиц"""
     print(f"Инициализация базы данных: {DATABASE_PATH}")
@@ -105,57 +679,16 @@ def init_database():
         ''')
         print("[OK] Таблица 'records' создана")
         
-        # Создание индексов для оптимизации запросов
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_exercises_program_id 
-            ON exercises(program_id)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_records_program_id 
-            ON records(program_id)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_records_exercise_id 
-            ON records(exercise_id)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_records_date 
-            ON records(date)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_programs_active 
-            ON programs(active)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_users_user_id 
-            ON users(user_id)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_operations_user_id 
-            ON operations(user_id)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_operations_created_at 
-            ON operations(created_at)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_operations_type 
-            ON operations(operation_type)
-        ''')
-        
-        print("[OK] Индексы созданы")
-        
         # Сохранение изменений
         conn.commit()
         
+        # Применение миграций схемы (индексы, сводные таблицы и т.д.)
+        applied = run_migrations(conn)
+        if applied:
+            print(f"[OK] Применены миграции: {', '.join(map(str, applied))}")
+        else:
+            print("[INFO] Схема БД актуальна, новых миграций нет")
+        
         # Проверка существующих данных
         cursor.execute('SELECT COUNT(*) FROM users')
         users_count = cursor.fetchone()[0]
@@ -185,8 +718,44 @@ def init_database():
         conn.close()
 
 
+def rebuild_aggregates():
+    """Пересборка материализованных агрегатов для существующей базы"""
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        run_migrations(conn)
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        assigned = assign_canonical_exercises(cursor)
+        if assigned:
+            print(f"[OK] Упражнений связано с каталогом: {assigned}")
+        total = rebuild_daily_exercise_stats(cursor)
+        records = rebuild_catalog_personal_records(cursor)
+        conn.commit()
+        print(f"[OK] Агрегаты пересобраны: {total} строк в daily_exercise_stats, {records} в personal_records")
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
 def main():
     """Основная функция"""
+    parser = argparse.ArgumentParser(description="Инициализация базы данных для бота тренировок")
+    parser.add_argument(
+        '--rebuild-aggregates', action='store_true',
+        help="пересобрать таблицы daily_exercise_stats и personal_records из записей тренировок"
+    )
+    args = parser.parse_args()
+    
+    if args.rebuild_aggregates:
+        try:
+            rebuild_aggregates()
+        except Exception as e:
+            print(f"\n[ERROR] Ошибка: {e}")
+            return 1
+        return 0
+    
     print("=" * 50)
     print("Инициализация базы данных для бота тренировок")
     print("=" * 50)
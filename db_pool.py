@@ -0,0 +1,100 @@
+"""
+Пул долгоживущих соединений с SQLite
+Открывается один раз при запуске бота и закрывается при остановке
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from metrics import db_pool_size, db_pool_in_use, db_pool_wait
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Фиксированный набор соединений aiosqlite с общими настройками PRAGMA"""
+
+    def __init__(self, database: str, size: int = 4, busy_timeout_ms: int = 5000,
+                 cached_statements: int = 256):
+        self.database = database
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        # Размер кэша подготовленных выражений sqlite3 на каждое соединение:
+        # соединения живут долго, поэтому повторные запросы не компилируются заново
+        self.cached_statements = cached_statements
+        self._connections = []
+        self._idle = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._idle is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Открыть одно соединение и применить настройки"""
+        db = await aiosqlite.connect(self.database, cached_statements=self.cached_statements)
+        await db.execute('PRAGMA journal_mode=WAL')
+        await db.execute('PRAGMA synchronous=NORMAL')
+        await db.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        return db
+
+    async def open(self):
+        """Открыть все соединения пула"""
+        if self.is_open:
+            return
+        idle = asyncio.Queue()
+        try:
+            for _ in range(self.size):
+                db = await self._connect()
+                self._connections.append(db)
+                idle.put_nowait(db)
+        except Exception:
+            await self._close_connections()
+            raise
+        self._idle = idle
+        db_pool_size.set(self.size)
+        db_pool_in_use.set(0)
+        logger.info(f"Пул соединений с БД открыт: {self.database} (соединений: {self.size})")
+
+    async def _close_connections(self):
+        for db in self._connections:
+            try:
+                await db.close()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии соединения с БД: {e}")
+        self._connections = []
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        if not self.is_open:
+            return
+        self._idle = None
+        await self._close_connections()
+        db_pool_size.set(0)
+        db_pool_in_use.set(0)
+        logger.info("Пул соединений с БД закрыт")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Взять соединение из пула на время блока async with"""
+        if not self.is_open:
+            raise RuntimeError("Пул соединений с БД не открыт")
+
+        idle = self._idle
+        start_time = time.perf_counter()
+        db = await idle.get()
+        db_pool_wait.observe(time.perf_counter() - start_time)
+        db_pool_in_use.inc()
+        try:
+            yield db
+        finally:
+            # Незавершённая транзакция не должна достаться следующему владельцу
+            try:
+                if db.in_transaction:
+                    await db.rollback()
+            except Exception as e:
+                logger.error(f"Ошибка при откате транзакции: {e}")
+            db_pool_in_use.dec()
+            idle.put_nowait(db)
@@ -0,0 +1,151 @@
+"""
+Каталог упражнений
+Название упражнения в программе - свободный текст, поэтому «Жим лёжа», «жим лежа» и «Жим лёжа »
+ссылаются на одну запись каталога (exercises.canonical_exercise_id). Названия приводятся к
+нормальной форме (регистр, ё/е, пробелы); для новой формы ищется похожая запись каталога
+с тем же числом слов по индексу триграмм, и только если её нет, создаётся новая.
+Похожая запись принимается только как опечатка: слова сравниваются попарно по порядку, и каждое
+отличается не больше чем на одну букву (короткие слова и числа - только точно). «Жим гантелей
+лёжа на скамье», «Становая тяга сумо» и «Отжимания 2» - другие упражнения, а не варианты написания
+«Жим гантелей сидя на скамье», «Становая тяга» и «Отжимания 1». Короткие названия сопоставляются
+только точно.
+"""
+import json
+import re
+
+# Минимальное сходство триграмм (коэффициент Жаккара), при котором название считается
+# вариантом существующего упражнения
+DEFAULT_MATCH_THRESHOLD = 0.7
+# Названия короче (без пробелов) сравниваются только по нормальной форме
+FUZZY_MIN_LENGTH = 6
+# Сколько самых похожих записей проверяется пословно
+MATCH_CANDIDATES = 10
+# Слова короче сравниваются только точно, более длинные могут отличаться одной опечаткой
+TYPO_MIN_WORD_LENGTH = 4
+# Опечатка: замена, вставка, удаление буквы или перестановка соседних букв
+MAX_WORD_TYPOS = 1
+
+_WHITESPACE = re.compile(r'\s+')
+_DIGITS = re.compile(r'\d+')
+
+# Нормальная форма названия -> запись каталога
+NAME_LOOKUP_SQL = '''
+    SELECT n.catalog_id, c.name
+    FROM exercise_names n
+    JOIN exercise_catalog c ON c.id = n.catalog_id
+    WHERE n.normalized = ?
+'''
+NAME_INSERT_SQL = 'INSERT INTO exercise_names (normalized, catalog_id) VALUES (?, ?)'
+CATALOG_INSERT_SQL = 'INSERT INTO exercise_catalog (name, word_count, trigram_count) VALUES (?, ?, ?) RETURNING id'
+# Триграммы новой записи одним запросом: список передаётся как JSON-массив
+TRIGRAMS_INSERT_SQL = 'INSERT INTO exercise_trigrams (trigram, catalog_id) SELECT value, ? FROM json_each(?)'
+
+
+def normalize_exercise_name(name: str) -> str:
+    """Нормальная форма названия: нижний регистр, ё -> е, одиночные пробелы без краевых"""
+    return _WHITESPACE.sub(' ', name.lower().replace('ё', 'е')).strip()
+
+
+def exercise_trigrams(normalized: str) -> set:
+    """Триграммы слов названия; слово дополняется двумя пробелами слева и одним справа"""
+    trigrams = set()
+    for word in normalized.split(' '):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def exercise_numbers(name: str) -> list:
+    """Числа в названии: «Отжимания 1» и «Отжимания 2» - разные упражнения"""
+    return [int(token) for token in _DIGITS.findall(name)]
+
+
+def match_statement(trigrams: list, word_count: int, threshold: float) -> tuple:
+    """Запрос и параметры: самые похожие записи каталога с тем же числом слов
+    и сходством не ниже порога"""
+    placeholders = ', '.join('?' * len(trigrams))
+    sql = f'''
+        SELECT t.catalog_id, c.name, COUNT(*) * 1.0 / (? + c.trigram_count - COUNT(*)) AS similarity
+        FROM exercise_trigrams t
+        JOIN exercise_catalog c ON c.id = t.catalog_id
+        WHERE t.trigram IN ({placeholders}) AND c.word_count = ?
+        GROUP BY t.catalog_id
+        HAVING similarity >= ?
+        ORDER BY similarity DESC, t.catalog_id
+        LIMIT {MATCH_CANDIDATES}
+    '''
+    return sql, (len(trigrams), *trigrams, word_count, threshold)
+
+
+def word_distance(first: str, second: str) -> int:
+    """Число опечаток между словами (расстояние Дамерау-Левенштейна без повторных правок подстрок)"""
+    previous, current = None, list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (first[i - 1] != second[j - 1]),
+            )
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+def word_typo_allowed(word: str, catalog_word: str) -> bool:
+    """Слово названия - то же слово каталога или его написание с опечаткой"""
+    if word == catalog_word:
+        return True
+    if min(len(word), len(catalog_word)) < TYPO_MIN_WORD_LENGTH:
+        return False
+    return word_distance(word, catalog_word) <= MAX_WORD_TYPOS
+
+
+def fuzzy_match_allowed(normalized: str, catalog_name: str) -> bool:
+    """Похожая запись каталога принимается, только если названия отличаются опечатками:
+    слова попарно по порядку совпадают с точностью до опечатки, числа - точно"""
+    words = normalized.split(' ')
+    catalog_words = normalize_exercise_name(catalog_name).split(' ')
+    if len(words) != len(catalog_words) or exercise_numbers(normalized) != exercise_numbers(catalog_name):
+        return False
+    return all(word_typo_allowed(word, catalog_word) for word, catalog_word in zip(words, catalog_words))
+
+
+def resolve_exercise(name: str, threshold: float = DEFAULT_MATCH_THRESHOLD):
+    """Сопоставление названия с каталогом без привязки к драйверу БД.
+    Генератор отдаёт запросы (имя запроса, SQL, параметры) и получает в ответ строки результата;
+    возвращает (ID в каталоге, название в каталоге).
+    Сначала ищется нормальная форма названия, затем похожая запись по триграммам;
+    если подходящей нет, создаётся новая запись каталога."""
+    normalized = normalize_exercise_name(name)
+    rows = yield 'exercise_name_lookup', NAME_LOOKUP_SQL, (normalized,)
+    if rows:
+        return rows[0][0], rows[0][1]
+    trigrams = sorted(exercise_trigrams(normalized))
+    word_count = len(normalized.split(' '))
+    row = None
+    if len(normalized.replace(' ', '')) >= FUZZY_MIN_LENGTH:
+        candidates = yield ('exercise_catalog_match', *match_statement(trigrams, word_count, threshold))
+        row = next((candidate for candidate in candidates if fuzzy_match_allowed(normalized, candidate[1])), None)
+    if row is None:
+        display_name = ' '.join(name.split())
+        (catalog_id,), = yield 'exercise_catalog_insert', CATALOG_INSERT_SQL, (display_name, word_count, len(trigrams))
+        yield 'exercise_trigrams_insert', TRIGRAMS_INSERT_SQL, (catalog_id, json.dumps(trigrams, ensure_ascii=False))
+        row = (catalog_id, display_name)
+    # Вариант написания запоминается: в следующий раз он найдётся без нечёткого поиска
+    yield 'exercise_name_insert', NAME_INSERT_SQL, (normalized, row[0])
+    return row[0], row[1]
+
+
+def resolve_exercise_sync(cursor, name: str, threshold: float = DEFAULT_MATCH_THRESHOLD) -> tuple:
+    """resolve_exercise для синхронного курсора sqlite3 (миграции db_init.py)"""
+    steps = resolve_exercise(name, threshold)
+    rows = None
+    while True:
+        try:
+            _, sql, params = steps.send(rows)
+        except StopIteration as result:
+            return result.value
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
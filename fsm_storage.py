@@ -0,0 +1,148 @@
+"""
+Хранилище состояний FSM в SQLite
+Состояния переживают перезапуск бота; чтения обслуживаются из кэша в памяти,
+а несколько изменений одного ключа за короткое время записываются одним запросом
+"""
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_storage с LRU-кэшем и отложенной записью изменений"""
+
+    def __init__(self, pool, cache_size: int = 10000, flush_delay_ms: int = 50):
+        self.pool = pool
+        self.cache_size = cache_size
+        self.flush_delay = flush_delay_ms / 1000
+        # key -> [state, data]
+        self._records = OrderedDict()
+        self._dirty = set()
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    @staticmethod
+    def _make_key(key: StorageKey) -> str:
+        thread_id = '' if key.thread_id is None else key.thread_id
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{key.destiny}"
+
+    async def _load(self, key: StorageKey) -> list:
+        """Получить запись из кэша или из БД"""
+        storage_key = self._make_key(key)
+        record = self._records.get(storage_key)
+        if record is not None:
+            self._records.move_to_end(storage_key)
+            return record
+
+        async with self.pool.acquire() as db:
+            row = await queries.fetchone(
+                db, 'fsm_load', 'SELECT state, data FROM fsm_storage WHERE key = ?', (storage_key,)
+            )
+        # Запись могла появиться в кэше, пока шло чтение
+        record = self._records.get(storage_key)
+        if record is None:
+            record = [row[0], json.loads(row[1])] if row else [None, {}]
+            self._records[storage_key] = record
+            self._evict()
+        return record
+
+    def _evict(self):
+        """Вытеснить давно не использованные записи, кроме ещё не записанных в БД"""
+        excess = len(self._records) - self.cache_size
+        if excess <= 0:
+            return
+        for storage_key in list(self._records):
+            if excess <= 0:
+                break
+            if storage_key not in self._dirty:
+                del self._records[storage_key]
+                excess -= 1
+
+    def _mark_dirty(self, key: StorageKey):
+        self._dirty.add(self._make_key(key))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        try:
+            await asyncio.sleep(self.flush_delay)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Записать все изменённые записи одной транзакцией"""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        keys = list(self._dirty)
+        self._dirty.clear()
+
+        upserts, deletes = [], []
+        for storage_key in keys:
+            state, data = self._records[storage_key]
+            if state is None and not data:
+                deletes.append((storage_key,))
+            else:
+                upserts.append((storage_key, state, json.dumps(data, ensure_ascii=False, separators=(',', ':'))))
+
+        try:
+            async with self.pool.acquire() as db:
+                if upserts:
+                    await queries.executemany(db, 'fsm_upsert', '''
+                        INSERT INTO fsm_storage (key, state, data, updated_at)
+                        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(key) DO UPDATE SET
+                            state = excluded.state,
+                            data = excluded.data,
+                            updated_at = CURRENT_TIMESTAMP
+                    ''', upserts)
+                if deletes:
+                    await queries.executemany(db, 'fsm_delete', 'DELETE FROM fsm_storage WHERE key = ?', deletes)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояний FSM: {e}")
+            # Повторим запись при следующем изменении или при закрытии
+            self._dirty.update(keys)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._load(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._load(key)
+        return record[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._load(key)
+        record[1] = data.copy()
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._load(key)
+        return record[1].copy()
+
+    def clear_cache(self):
+        """Сбросить кэш чтения (несохранённые записи остаются)"""
+        for storage_key in list(self._records):
+            if storage_key not in self._dirty:
+                del self._records[storage_key]
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
@@ -0,0 +1,270 @@
+"""
+Нагрузочное тестирование бота без сети
+Виртуальные пользователи проходят реальные сценарии (/newprogram, /startworkout, ввод весов, /report):
+обновления подаются в dp.feed_update, исходящие запросы к Bot API записываются заглушкой сессии.
+База данных создаётся во временном каталоге через db_init.py.
+
+Пример: python loadtest.py --users 200 --concurrency 50 --rounds 2
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Программа виртуального пользователя: упражнение\подходы
+PROGRAM_TEXT = "Приседания\\3\nЖим лёжа\\3\nТяга\\3"
+PROGRAM_SETS = 9
+# Первый ID виртуального пользователя (не пересекается с реальными ID в тестовой БД)
+USER_ID_BASE = 10_000_000
+
+
+class LockErrorCounter(logging.Handler):
+    """Счётчик ошибок блокировки SQLite в журнале бота (обработчики перехватывают исключения сами)"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        if 'database is locked' in record.getMessage():
+            self.count += 1
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class LoadTest:
+    """Генератор обновлений и сбор статистики прогона"""
+
+    def __init__(self, bot_module, users: int, concurrency: int, rounds: int):
+        from aiogram.client.session.base import BaseSession
+        from aiogram.types import Chat, Message
+
+        self.bot_module = bot_module
+        self.users = users
+        self.rounds = rounds
+        self.slots = asyncio.Semaphore(concurrency)
+        self.update_id = 0
+        # Шаг сценария -> длительности обработки обновлений (сек)
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.outbound = Counter()
+        # Последняя инлайн-клавиатура в чате: по ней виртуальный пользователь выбирает программу
+        self.keyboards = {}
+        test = self
+
+        class RecordingSession(BaseSession):
+            """Сессия Bot API, которая ничего не отправляет и отвечает правдоподобными объектами"""
+
+            async def make_request(self, bot, method, timeout=None):
+                test.outbound[type(method).__name__] += 1
+                chat_id = getattr(method, 'chat_id', None)
+                markup = getattr(method, 'reply_markup', None)
+                if chat_id is not None and getattr(markup, 'inline_keyboard', None):
+                    test.keyboards[chat_id] = markup.inline_keyboard
+                if method.__returning__ is Message:
+                    return Message(
+                        message_id=sum(test.outbound.values()), date=datetime.now(),
+                        chat=Chat(id=chat_id, type='private'), text=getattr(method, 'text', None)
+                    )
+                return True
+
+            async def stream_content(self, *args, **kwargs):
+                raise NotImplementedError("Скачивание файлов в нагрузочном тесте не поддерживается")
+
+            async def close(self):
+                pass
+
+        self.session = RecordingSession()
+
+    def _next_update_id(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def _sender(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Нагрузка {user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        update_id = self._next_update_id()
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": self._sender(user_id), "text": text
+        }}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        update_id = self._next_update_id()
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "chat_instance": str(user_id), "from": self._sender(user_id), "data": data,
+            "message": {
+                "message_id": update_id, "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"}, "text": "🏋️"
+            }
+        }}
+
+    async def feed(self, step: str, raw: dict):
+        from aiogram.types import Update
+
+        bot = self.bot_module.bot
+        update = Update.model_validate(raw, context={"bot": bot})
+        async with self.slots:
+            start = time.perf_counter()
+            try:
+                await self.bot_module.dp.feed_update(bot, update)
+            except sqlite3.OperationalError as e:
+                self.errors['database is locked' if 'locked' in str(e) else type(e).__name__] += 1
+            except Exception as e:
+                self.errors[type(e).__name__] += 1
+            finally:
+                self.latencies[step].append(time.perf_counter() - start)
+
+    def _program_button(self, user_id: int, program_name: str):
+        for row in self.keyboards.get(user_id, ()):
+            for button in row:
+                if button.text == program_name:
+                    return button.callback_data
+        return None
+
+    async def virtual_user(self, index: int):
+        user_id = USER_ID_BASE + index
+        program_name = f"Нагрузка {user_id}"
+        await self.feed('start', self.message(user_id, '/start'))
+        await self.feed('newprogram', self.message(user_id, '/newprogram'))
+        await self.feed('program_name', self.message(user_id, program_name))
+        await self.feed('program_text', self.message(user_id, PROGRAM_TEXT))
+        for round_number in range(self.rounds):
+            await self.feed('startworkout', self.message(user_id, '/startworkout'))
+            callback_data = self._program_button(user_id, program_name)
+            if callback_data is None:
+                self.errors['program_not_listed'] += 1
+                return
+            await self.feed('select_program', self.callback(user_id, callback_data))
+            for set_index in range(PROGRAM_SETS):
+                weight = 40 + 2.5 * ((index + round_number + set_index) % 20)
+                await self.feed('weight', self.message(user_id, f"{weight:g}"))
+            await self.feed('report', self.message(user_id, '/report'))
+            await self.feed('report_view', self.message(user_id, 'За день'))
+
+    async def run(self) -> dict:
+        started = time.perf_counter()
+        await asyncio.gather(*(self.virtual_user(i) for i in range(self.users)))
+        # Отложенные правки карточек входят в прогон
+        await self.bot_module.card_editor.flush()
+        elapsed = time.perf_counter() - started
+        return self.summary(elapsed)
+
+    def summary(self, elapsed: float) -> dict:
+        def stats(values):
+            return {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            }
+
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        return {
+            'users': self.users,
+            'rounds': self.rounds,
+            'updates': len(all_latencies),
+            'elapsed_s': round(elapsed, 3),
+            'updates_per_s': round(len(all_latencies) / elapsed, 1) if elapsed else 0.0,
+            'latency': stats(all_latencies),
+            'steps': {step: stats(values) for step, values in self.latencies.items()},
+            'errors': dict(self.errors),
+            'outbound': dict(self.outbound),
+        }
+
+
+def print_summary(result: dict):
+    latency = result['latency']
+    print(f"Пользователей: {result['users']}, тренировок на пользователя: {result['rounds']}")
+    print(f"Обновлений: {result['updates']} за {result['elapsed_s']} с ({result['updates_per_s']} обновлений/с)")
+    print(f"Задержка обработки: p50 {latency['p50_ms']} мс, p95 {latency['p95_ms']} мс, p99 {latency['p99_ms']} мс")
+    print(f"Ошибки блокировки БД: {result['lock_errors']}")
+    print()
+    print(f"{'шаг':<16}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for step, values in result['steps'].items():
+        print(f"{step:<16}{values['count']:>8}{values['p50_ms']:>10}{values['p95_ms']:>10}{values['p99_ms']:>10}")
+    if result['errors']:
+        print(f"\nОшибки: {result['errors']}")
+    print(f"Исходящие запросы: {result['outbound']}")
+
+
+async def run_load_test(args) -> dict:
+    # Модуль бота читает настройки окружения при импорте
+    import bot as bot_module
+
+    lock_errors = LockErrorCounter()
+    logging.getLogger().addHandler(lock_errors)
+    test = LoadTest(bot_module, args.users, args.concurrency, args.rounds)
+    await bot_module.startup()
+    # Подменяем сессию после startup(): сеть не используется
+    default_session = bot_module.bot.session
+    bot_module.bot.session = test.session
+    if args.outbound_limits:
+        test.session.middleware(bot_module.outbound_scheduler)
+    try:
+        result = await test.run()
+    finally:
+        await bot_module.shutdown()
+        await default_session.close()
+        logging.getLogger().removeHandler(lock_errors)
+    result['lock_errors'] = lock_errors.count + test.errors.get('database is locked', 0)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование бота тренировок без сети")
+    parser.add_argument('--users', type=int, default=100, help="количество виртуальных пользователей")
+    parser.add_argument('--concurrency', type=int, default=32, help="обновлений в обработке одновременно")
+    parser.add_argument('--rounds', type=int, default=1, help="тренировок на пользователя")
+    parser.add_argument(
+        '--outbound-limits', action='store_true',
+        help="применять лимиты исходящих запросов Telegram (OUTBOUND_*) к заглушке сессии"
+    )
+    parser.add_argument('--database', help="путь к БД (по умолчанию - временный файл)")
+    parser.add_argument('--json', action='store_true', help="вывести результат в формате JSON")
+    parser.add_argument('--verbose', action='store_true', help="показывать журнал бота")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='gym-loadtest-') as tmp:
+        os.environ['DATABASE'] = args.database or os.path.join(tmp, 'gym.db')
+        # Кэш графиков тоже во временном каталоге: прогон не оставляет файлов в ./data
+        os.environ['CHART_CACHE_DIR'] = os.path.join(tmp, 'charts')
+        # Токен нужен только для создания объекта Bot: запросы в Telegram не отправляются
+        os.environ.setdefault('BOT_TOKEN', '123456:loadtest')
+        # Сервер метрик не запускается, обновления не принимаются из Telegram
+        os.environ['BOT_MODE'] = 'polling'
+
+        import db_init
+        with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+            db_init.init_database()
+
+        if not args.verbose:
+            logging.disable(logging.WARNING)
+        result = asyncio.run(run_load_test(args))
+        logging.disable(logging.NOTSET)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_summary(result)
+    return 1 if result['errors'] or result['lock_errors'] else 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,112 @@
+"""
+Мониторинг цикла событий
+Измеряет задержку пробуждения цикла (loop lag) и находит шаги, блокирующие цикл дольше порога:
+сторожевой поток снимает стек потока цикла и относит блокировку к обработчику бота
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from metrics import event_loop_lag, event_loop_blocked
+
+logger = logging.getLogger(__name__)
+
+# Количество кадров стека в журнале
+STACK_LIMIT = 12
+# Интервал отметок цикла и проверок сторожевого потока - доля порога:
+# блокировка, превысившая порог меньше чем на две такие доли, может остаться незамеченной
+BEAT_FRACTION = 0.1
+
+
+class LoopMonitor:
+    """Проба задержки цикла событий и детектор медленных шагов"""
+
+    def __init__(self, interval_ms: int = 500, slow_threshold_ms: int = 200):
+        self.interval = interval_ms / 1000
+        self.threshold = slow_threshold_ms / 1000
+        self.loop = None
+        self._loop_thread_id = None
+        self._probe_task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+        # Когда цикл событий должен выполнить следующую отметку
+        self._next_beat = time.monotonic()
+        self._heartbeat_handle = None
+        # Объект кода функции-обработчика -> имя для атрибуции блокировок
+        self._handler_codes = {}
+
+    def register_handlers(self, dispatcher):
+        """Запомнить функции-обработчики роутера и вложенных роутеров"""
+        routers = [dispatcher]
+        while routers:
+            router = routers.pop()
+            routers.extend(router.sub_routers)
+            for observer in router.observers.values():
+                for handler in observer.handlers:
+                    code = getattr(handler.callback, '__code__', None)
+                    if code is not None:
+                        self._handler_codes[code] = handler.callback.__name__
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._beat()
+        self._probe_task = loop.create_task(self._probe())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+            self._heartbeat_handle = None
+
+    async def _probe(self):
+        """Разница между запланированным и фактическим пробуждением"""
+        while True:
+            expected = self.loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            event_loop_lag.observe(max(self.loop.time() - expected, 0.0))
+
+    def _beat(self):
+        # Отметка цикла событий много чаще порога, чтобы сторожевой поток видел блокировку вовремя
+        interval = self.threshold * BEAT_FRACTION
+        self._next_beat = time.monotonic() + interval
+        self._heartbeat_handle = self.loop.call_later(interval, self._beat)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold * BEAT_FRACTION):
+            # Блокировка отсчитывается от запланированной отметки, а не от предыдущей:
+            # между отметками цикл и так может не выполнять их до интервала отметок
+            next_beat = self._next_beat
+            if time.monotonic() - next_beat < self.threshold or next_beat == reported:
+                continue
+            # О каждой блокировке сообщаем один раз
+            reported = next_beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            handler = self._attribute(frame)
+            event_loop_blocked.labels(handler=handler).inc()
+            stack = ''.join(traceback.format_list(traceback.extract_stack(frame)[-STACK_LIMIT:]))
+            logger.warning(
+                f"Цикл событий заблокирован дольше {self.threshold * 1000:.0f} мс "
+                f"(обработчик: {handler}):\n{stack}"
+            )
+
+    def _attribute(self, frame) -> str:
+        """Имя ближайшего к вершине стека обработчика бота"""
+        while frame is not None:
+            name = self._handler_codes.get(frame.f_code)
+            if name is not None:
+                return name
+            frame = frame.f_back
+        return 'unknown'
@@ -3,6 +3,9 @@
 Отслеживает состояние бота, пользователей и операции
 """
 from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import asyncio
+import gc
+import threading
 import time
 try:
     import psutil
@@ -26,9 +29,116 @@ programs_active = Gauge('bot_programs_active', 'Количество актив
 records_total = Gauge('bot_records_total', 'Общее количество записей тренировок')
 records_today = Gauge('bot_records_today', 'Количество записей за сегодня')
 
+# Метрики состояния всей БД: в группе процессов их обновляет и отдаёт один обработчик
+DB_WIDE_METRICS = frozenset({
+    'bot_users_total', 'bot_users_active_today', 'bot_operations_today', 'bot_programs_total',
+    'bot_programs_active', 'bot_records_total', 'bot_records_today', 'bot_db_freelist_pages',
+})
+
 # Метрики производительности
-request_duration = Histogram('bot_request_duration_seconds', 'Длительность обработки запросов', ['handler'])
-request_errors = Counter('bot_request_errors_total', 'Количество ошибок при обработке запросов', ['error_type'])
+request_duration = Histogram(
+    'bot_request_duration_seconds', 'Длительность обработки запросов', ['handler', 'state']
+)
+request_errors = Counter(
+    'bot_request_errors_total', 'Количество ошибок при обработке запросов', ['handler', 'error_type']
+)
+request_time_split = Histogram(
+    'bot_request_time_split_seconds', 'Длительность обработки запросов: время в БД и остальное время',
+    ['handler', 'part'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+# Метрики запросов к БД
+db_query_duration = Histogram(
+    'bot_db_query_duration_seconds', 'Длительность запросов к БД', ['query'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+db_query_rows = Counter('bot_db_query_rows_total', 'Строки, возвращённые или изменённые запросами к БД', ['query'])
+db_slow_queries = Counter('bot_db_slow_queries_total', 'Запросы к БД дольше порога SLOW_QUERY_MS', ['query'])
+
+# Метрики пула соединений с БД
+db_pool_size = Gauge('bot_db_pool_size', 'Количество соединений в пуле БД')
+db_pool_in_use = Gauge('bot_db_pool_in_use', 'Количество занятых соединений пула БД')
+db_pool_wait = Histogram(
+    'bot_db_pool_wait_seconds', 'Время ожидания свободного соединения пула БД',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+# Метрики отложенной записи в БД
+write_behind_queue_depth = Gauge('bot_write_behind_queue_depth', 'Количество запросов в очереди отложенной записи')
+write_behind_batch_size = Histogram(
+    'bot_write_behind_batch_size', 'Количество запросов в одном пакете отложенной записи',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 200, 500, 1000)
+)
+write_behind_flush_duration = Histogram(
+    'bot_write_behind_flush_seconds', 'Длительность записи пакета отложенной записи',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+write_behind_retries = Counter('bot_write_behind_retries_total', 'Повторные попытки записи пакета из-за занятой БД')
+write_behind_dropped = Counter(
+    'bot_write_behind_dropped_total', 'Запросы отложенной записи, отброшенные после неустранимой ошибки'
+)
+
+# Метрики хранения журнала операций
+operations_rolled_up_days = Counter('bot_operations_rolled_up_days_total', 'Дни журнала операций, свёрнутые в operations_daily')
+operations_pruned = Counter('bot_operations_pruned_total', 'Удалённые строки журнала операций после свёртки')
+operations_pruned_last_run = Gauge('bot_operations_pruned_last_run', 'Строки журнала операций, удалённые за последний проход')
+db_pages_reclaimed = Counter('bot_db_pages_reclaimed_total', 'Страницы БД, возвращённые файловой системе incremental_vacuum')
+db_freelist_pages = Gauge('bot_db_freelist_pages', 'Свободные страницы в файле БД')
+retention_duration = Gauge('bot_retention_duration_seconds', 'Длительность последнего прохода хранения журнала операций')
+
+# Метрики кэша профилей пользователей
+user_cache_hits = Counter('bot_user_cache_hits_total', 'Попадания в кэш профилей пользователей')
+user_cache_misses = Counter('bot_user_cache_misses_total', 'Промахи кэша профилей пользователей')
+user_cache_size = Gauge('bot_user_cache_size', 'Количество профилей в кэше пользователей')
+
+# Метрики кэша программ
+program_cache_hits = Counter('bot_program_cache_hits_total', 'Попадания в кэш программ', ['cache'])
+program_cache_misses = Counter('bot_program_cache_misses_total', 'Промахи кэша программ', ['cache'])
+
+# Метрики приёма обновлений
+update_ingestion_latency = Histogram(
+    'bot_update_ingestion_latency_seconds', 'Задержка от отправки обновления до начала его обработки',
+    ['update_type'],
+    buckets=(0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0)
+)
+webhook_updates_in_flight = Gauge('bot_webhook_updates_in_flight', 'Количество обновлений из вебхука в обработке')
+webhook_unauthorized = Counter('bot_webhook_unauthorized_total', 'Запросы к вебхуку с неверным секретным токеном')
+
+# Метрики исходящих запросов к Telegram
+outbound_queue_depth = Gauge(
+    'bot_outbound_queue_depth', 'Количество исходящих запросов, ожидающих лимита отправки', ['lane']
+)
+outbound_send_duration = Histogram(
+    'bot_outbound_send_seconds', 'Время отправки запроса к Telegram с учётом ожидания лимита', ['lane'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+outbound_retry_after = Counter('bot_outbound_retry_after_total', 'Ответы Telegram 429 (RetryAfter)')
+
+# Метрики карточки тренировки
+card_edits = Counter('bot_card_edits_total', 'Отправленные правки карточек тренировки')
+card_edits_coalesced = Counter(
+    'bot_card_edits_coalesced_total', 'Правки карточек, объединённые с более поздними до отправки'
+)
+
+# Метрики графиков прогресса
+chart_render_duration = Histogram(
+    'bot_chart_render_seconds', 'Время отрисовки графика в процессе пула',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+chart_cache_hits = Counter('bot_chart_cache_hits_total', 'Попадания в дисковый кэш графиков')
+chart_cache_misses = Counter('bot_chart_cache_misses_total', 'Промахи дискового кэша графиков')
+chart_queue_depth = Gauge('bot_chart_queue_depth', 'Графики в очереди отрисовки')
+chart_rejected = Counter('bot_chart_rejected_total', 'Запросы графиков, отклонённые из-за заполненной очереди')
+
+# Метрики цикла событий
+event_loop_lag = Histogram(
+    'bot_event_loop_lag_seconds', 'Задержка пробуждения цикла событий относительно запланированного времени',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+event_loop_blocked = Counter(
+    'bot_event_loop_blocked_total', 'Блокировки цикла событий дольше порога', ['handler']
+)
 
 # Метрики системы
 bot_health = Gauge('bot_health', 'Состояние бота (1 = работает, 0 = не работает)')
@@ -37,30 +147,62 @@ system_cpu_percent = Gauge('bot_system_cpu_percent', 'Загрузка CPU в п
 system_memory_percent = Gauge('bot_system_memory_percent', 'Использование памяти в процентах')
 system_memory_bytes = Gauge('bot_system_memory_bytes', 'Использование памяти в байтах')
 
+# Метрики процесса бота
+process_memory_rss = Gauge('bot_process_memory_rss_bytes', 'Резидентная память процесса бота в байтах')
+process_cpu_seconds = Gauge('bot_process_cpu_seconds', 'Процессорное время процесса бота в секундах', ['mode'])
+process_cpu_percent = Gauge('bot_process_cpu_percent', 'Загрузка CPU процессом бота в процентах')
+process_open_fds = Gauge('bot_process_open_fds', 'Количество открытых файловых дескрипторов процесса')
+process_threads = Gauge('bot_process_threads', 'Количество потоков процесса')
+gc_objects = Gauge('bot_gc_objects', 'Количество отслеживаемых объектов по поколениям GC', ['generation'])
+gc_collections = Gauge('bot_gc_collections', 'Количество сборок мусора по поколениям GC', ['generation'])
+asyncio_tasks = Gauge('bot_asyncio_tasks', 'Количество задач asyncio в цикле событий бота')
+
 # Время запуска бота
 start_time = time.time()
 
+# Процесс бота для psutil (создаётся при первом замере)
+_process = None
+
+
 def update_system_metrics():
-    """Обновление системных метрик"""
+    """Обновление системных метрик и метрик процесса (без ожидания: CPU считается между замерами)"""
+    global _process
     try:
         if PSUTIL_AVAILABLE:
+            if _process is None:
+                _process = psutil.Process()
             # CPU
-            cpu_percent = psutil.cpu_percent(interval=0.1)
-            system_cpu_percent.set(cpu_percent)
+            system_cpu_percent.set(psutil.cpu_percent(interval=None))
             
             # Memory
             memory = psutil.virtual_memory()
             system_memory_percent.set(memory.percent)
             system_memory_bytes.set(memory.used)
+            
+            # Процесс бота
+            with _process.oneshot():
+                process_memory_rss.set(_process.memory_info().rss)
+                cpu_times = _process.cpu_times()
+                process_cpu_seconds.labels(mode='user').set(cpu_times.user)
+                process_cpu_seconds.labels(mode='system').set(cpu_times.system)
+                process_cpu_percent.set(_process.cpu_percent(interval=None))
+                process_threads.set(_process.num_threads())
+                if hasattr(_process, 'num_fds'):
+                    process_open_fds.set(_process.num_fds())
         else:
             # Базовые метрики без psutil
             system_cpu_percent.set(0)
             system_memory_percent.set(0)
             system_memory_bytes.set(0)
         
+        # Сборщик мусора
+        for generation, count in enumerate(gc.get_count()):
+            gc_objects.labels(generation=str(generation)).set(count)
+        for generation, stats in enumerate(gc.get_stats()):
+            gc_collections.labels(generation=str(generation)).set(stats['collections'])
+        
         # Uptime
-        uptime = time.time() - start_time
-        bot_uptime.set(uptime)
+        bot_uptime.set(time.time() - start_time)
         
         # Health check
         bot_health.set(1)
@@ -68,8 +210,37 @@ def update_system_metrics():
         bot_health.set(0)
         print(f"Ошибка обновления системных метрик: {e}")
 
+
+class SystemMetricsSampler(threading.Thread):
+    """Фоновый поток, периодически обновляющий системные метрики.
+    Запрос /metrics только читает уже посчитанные значения."""
+
+    def __init__(self, interval: float = 15, loop: asyncio.AbstractEventLoop = None):
+        super().__init__(name='system-metrics-sampler', daemon=True)
+        self.interval = interval
+        self.loop = loop
+        self._stop_event = threading.Event()
+
+    def _count_tasks(self):
+        asyncio_tasks.set(len(asyncio.all_tasks(self.loop)))
+
+    def run(self):
+        while not self._stop_event.is_set():
+            update_system_metrics()
+            # Задачи считаются в потоке цикла событий
+            if self.loop is not None and not self.loop.is_closed():
+                try:
+                    self.loop.call_soon_threadsafe(self._count_tasks)
+                except RuntimeError:
+                    pass
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
 def get_metrics():
     """Возвращает метрики в формате Prometheus"""
-    update_system_metrics()
+    bot_uptime.set(time.time() - start_time)
     return generate_latest()
 
@@ -45,9 +45,10 @@ def create_app():
     return app
 
 
-async def run_metrics_server(port=8000):
-    """Запуск HTTP сервера для метрик"""
-    app = create_app()
+async def run_metrics_server(port=8000, app=None):
+    """Запуск HTTP сервера для метрик (и вебхука, если он зарегистрирован в app)"""
+    if app is None:
+        app = create_app()
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, '0.0.0.0', port)
@@ -0,0 +1,103 @@
+"""
+Middleware диспетчера: учёт пользователей, операций и метрик обработчиков
+Внешние middleware работают для каждого обновления, внутренние - для найденного обработчика.
+Регистрация пользователя и журнал операций только ставят запрос в очередь отложенной записи:
+ожидание ограничено её размером (WRITE_BEHIND_MAX_QUEUE), а не числом фоновых задач.
+"""
+import logging
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Update
+
+from metrics import (
+    operations_total, request_duration, request_errors, request_time_split, update_ingestion_latency
+)
+from queries import db_time
+
+logger = logging.getLogger(__name__)
+
+# Метка обработчика в метриках; обработчик может уточнить её через label_request()
+handler_label = ContextVar('handler_label', default='unknown')
+
+
+def label_request(name: str):
+    """Уточнить метку текущего обработчика (например, тип отчёта)"""
+    handler_label.set(name)
+
+
+async def ingestion_latency_middleware(handler, event: Update, data):
+    """Задержка от отправки обновления пользователем до начала обработки"""
+    sent_at = getattr(event.event, 'date', None)
+    if isinstance(sent_at, datetime):
+        latency = (datetime.now(timezone.utc) - sent_at).total_seconds()
+        update_ingestion_latency.labels(update_type=event.event_type).observe(max(latency, 0.0))
+    return await handler(event, data)
+
+
+class UserMiddleware(BaseMiddleware):
+    """Внешний middleware сообщений и нажатий кнопок: регистрация пользователя"""
+
+    def __init__(self, register_user):
+        self.register_user = register_user
+
+    async def __call__(self, handler, event, data):
+        # Пользователь уже определён UserContextMiddleware диспетчера
+        user = data.get('event_from_user')
+        if user is not None and not user.is_bot:
+            await self.register_user(
+                user_id=user.id,
+                username=user.username,
+                first_name=user.first_name,
+                last_name=user.last_name
+            )
+        return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: журнал операций, длительность (в том числе время в БД)
+    и ошибки по обработчику и состоянию FSM.
+    Тип операции задаётся флагом обработчика: flags={"operation": "..."}"""
+
+    def __init__(self, log_operation):
+        self.log_operation = log_operation
+
+    async def __call__(self, handler, event, data):
+        operation = get_flag(data, 'operation')
+        user = data.get('event_from_user')
+        if operation and user is not None:
+            operations_total.labels(operation_type=operation).inc()
+            await self.log_operation(user.id, operation)
+
+        handler_object = data.get('handler')
+        name = operation or (handler_object.callback.__name__ if handler_object else 'unknown')
+        state = data.get('raw_state') or 'none'
+        token = handler_label.set(name)
+        # Время запросов к БД накапливается слоем queries
+        spent_in_db = [0.0]
+        db_token = db_time.set(spent_in_db)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            request_errors.labels(handler=handler_label.get(), error_type=type(e).__name__).inc()
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            label = handler_label.get()
+            request_duration.labels(handler=label, state=state).observe(duration)
+            request_time_split.labels(handler=label, part='db').observe(spent_in_db[0])
+            request_time_split.labels(handler=label, part='other').observe(max(duration - spent_in_db[0], 0.0))
+            db_time.reset(db_token)
+            handler_label.reset(token)
+
+
+def setup_middlewares(dp: Dispatcher, register_user, log_operation):
+    """Подключить middleware к диспетчеру"""
+    dp.update.outer_middleware(ingestion_latency_middleware)
+    for observer in (dp.message, dp.callback_query):
+        observer.outer_middleware(UserMiddleware(register_user))
+        observer.middleware(HandlerMetricsMiddleware(log_operation))
@@ -0,0 +1,164 @@
+"""
+Планировщик исходящих запросов к Telegram Bot API
+Ограничивает частоту отправки в каждый чат и в целом по боту (token bucket),
+пропускает интерактивные ответы раньше массовых отправок и повторяет запрос после RetryAfter
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import outbound_queue_depth, outbound_send_duration, outbound_retry_after
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньше - раньше
+LANE_INTERACTIVE = 0
+LANE_BULK = 1
+LANE_NAMES = {LANE_INTERACTIVE: 'interactive', LANE_BULK: 'bulk'}
+
+current_lane = ContextVar('outbound_lane', default=LANE_INTERACTIVE)
+
+
+@contextmanager
+def bulk_sends():
+    """Отправки внутри блока идут в полосе массовых сообщений"""
+    token = current_lane.set(LANE_BULK)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+
+class TokenBucket:
+    """Token bucket с резервированием: токены можно занять вперёд, ожидание возвращается вызывающему"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> bool:
+        self._refill()
+        return self.tokens >= 1
+
+    def reserve(self) -> float:
+        """Занять токен; вернуть, сколько секунд ждать до его появления"""
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        """Не выдавать токены ближайшие seconds секунд"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Middleware сессии бота: лимиты на чат и на бота, приоритет полос, обработка RetryAfter"""
+
+    def __init__(self, chat_rate: float = 1.0, chat_burst: float = 3, global_rate: float = 30.0,
+                 max_retries: int = 3, max_chats: int = 10000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chats = OrderedDict()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._grant_task = None
+
+    def set_global_rate(self, rate: float):
+        """Изменить общий лимит (например, поделить его между процессами)"""
+        self.global_bucket = TokenBucket(rate, max(rate, 1))
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            # Вытесняются только полные корзины: у них нет истории, которую нужно помнить
+            if len(self._chats) > self.max_chats:
+                for key in list(self._chats)[:len(self._chats) - self.max_chats]:
+                    if self._chats[key].full:
+                        del self._chats[key]
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _global_slot(self, lane: int):
+        """Дождаться общего токена; при очереди первыми обслуживаются полосы с меньшим номером"""
+        if not self._waiters and self.global_bucket.available():
+            self.global_bucket.reserve()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._sequence), future))
+        if self._grant_task is None:
+            self._grant_task = asyncio.create_task(self._grant())
+        await future
+
+    async def _grant(self):
+        try:
+            while self._waiters:
+                delay = self.global_bucket.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    self.global_bucket.refund()
+                else:
+                    future.set_result(None)
+        finally:
+            self._grant_task = None
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        lane = current_lane.get()
+        lane_name = LANE_NAMES[lane]
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            outbound_queue_depth.labels(lane=lane_name).inc()
+            try:
+                delay = self._chat_bucket(chat_id).reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                await self._global_slot(lane)
+            finally:
+                outbound_queue_depth.labels(lane=lane_name).dec()
+            try:
+                response = await make_request(bot, method)
+                break
+            except TelegramRetryAfter as e:
+                outbound_retry_after.inc()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(f"Превышен лимит Telegram для чата {chat_id}, повтор через {e.retry_after} с")
+                self._chat_bucket(chat_id).pause(e.retry_after)
+        outbound_send_duration.labels(lane=lane_name).observe(time.perf_counter() - start)
+        return response
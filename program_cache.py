@@ -0,0 +1,61 @@
+"""
+Кэш программ тренировок в памяти процесса
+Список активных программ и планы упражнений меняются только при создании, архивировании
+и удалении программ; эти операции увеличивают номер поколения, что сбрасывает кэш
+"""
+import time
+from collections import OrderedDict
+
+from metrics import program_cache_hits, program_cache_misses
+
+
+class ProgramCache:
+    """Активные программы и LRU-кэш планов упражнений с поколением и TTL"""
+
+    def __init__(self, max_plans: int = 1000, ttl: float = 60):
+        self.max_plans = max_plans
+        # TTL ограничивает устаревание, если программы изменил другой процесс
+        self.ttl = ttl
+        self.generation = 0
+        self._active = None
+        self._plans = OrderedDict()
+
+    def invalidate(self):
+        """Новое поколение: все ранее загруженные данные устарели"""
+        self.generation += 1
+        self._active = None
+        self._plans.clear()
+
+    def _fresh(self, entry) -> bool:
+        generation, stored_at, _ = entry
+        return generation == self.generation and time.monotonic() - stored_at < self.ttl
+
+    async def active_programs(self, loader) -> dict:
+        """Активные программы {id: название} в порядке создания"""
+        if self._active is not None and self._fresh(self._active):
+            program_cache_hits.labels(cache='active').inc()
+            return self._active[2]
+        program_cache_misses.labels(cache='active').inc()
+        generation = self.generation
+        programs = dict(await loader())
+        # Если во время загрузки программы изменились, результат не кэшируется
+        if generation == self.generation:
+            self._active = (generation, time.monotonic(), programs)
+        return programs
+
+    async def plan(self, program_id: int, loader) -> tuple:
+        """План упражнений программы: кортеж (id, день, упражнение, подходы, позиция)"""
+        entry = self._plans.get(program_id)
+        if entry is not None and self._fresh(entry):
+            self._plans.move_to_end(program_id)
+            program_cache_hits.labels(cache='plan').inc()
+            return entry[2]
+        program_cache_misses.labels(cache='plan').inc()
+        generation = self.generation
+        exercises = tuple(tuple(row) for row in await loader(program_id))
+        if generation == self.generation:
+            self._plans[program_id] = (generation, time.monotonic(), exercises)
+            self._plans.move_to_end(program_id)
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return exercises
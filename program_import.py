@@ -0,0 +1,157 @@
+"""
+Разбор программ тренировок из текста и из загруженных файлов CSV/JSON
+Файлы читаются потоково: строки отдаются по одной, без загрузки всего файла в память
+"""
+import csv
+import io
+import json
+
+# Значение дня по умолчанию (формат без дней недели)
+DEFAULT_DAY = "Общий"
+
+# Размер блока чтения JSON-файла
+JSON_READ_CHUNK = 64 * 1024
+
+
+def parse_exercise_line(line: str):
+    """Разобрать строку формата упражнение\\подходы.
+    Возвращает (упражнение, подходы) или None, если строка некорректна."""
+    parts = line.split('\\')
+    if len(parts) != 2:
+        return None
+
+    exercise = parts[0].strip()
+    try:
+        sets = int(parts[1].strip())
+    except ValueError:
+        return None
+    if not exercise:
+        return None
+    return exercise, sets
+
+
+def parse_program_text(text: str) -> list:
+    """Разобрать текст программы: список (день, упражнение, подходы, позиция)"""
+    exercises = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        parsed = parse_exercise_line(line)
+        if parsed is None:
+            continue
+        exercise, sets = parsed
+        exercises.append((DEFAULT_DAY, exercise, sets, len(exercises)))
+    return exercises
+
+
+def _validate_row(program_name, exercise, sets, day):
+    """Проверить и нормализовать строку импорта. Возвращает (строка, ошибка)"""
+    program_name = str(program_name or '').strip()
+    exercise = str(exercise or '').strip()
+    day = str(day or '').strip() or DEFAULT_DAY
+    if not program_name:
+        return None, "не указано название программы"
+    if not exercise:
+        return None, "не указано упражнение"
+    try:
+        sets = int(str(sets).strip())
+    except (TypeError, ValueError):
+        return None, f"неверное число подходов: {sets!r}"
+    if sets <= 0:
+        return None, f"число подходов должно быть положительным: {sets}"
+    return (program_name, day, exercise, sets), None
+
+
+def iter_csv_rows(stream):
+    """Строки CSV: программа, упражнение, подходы[, день].
+    Отдаёт (номер строки, (программа, день, упражнение, подходы) или None, ошибка или None)."""
+    reader = csv.reader(stream)
+    for row in reader:
+        line_no = reader.line_num
+        if not row or all(not cell.strip() for cell in row):
+            continue
+        if len(row) < 3:
+            yield line_no, None, "ожидается: программа, упражнение, подходы[, день]"
+            continue
+        program_name, exercise, sets = row[0], row[1], row[2]
+        day = row[3] if len(row) > 3 else None
+        # Строка заголовка пропускается
+        if line_no == 1 and not sets.strip().lstrip('-').isdigit():
+            continue
+        yield (line_no, *_validate_row(program_name, exercise, sets, day))
+
+
+def _iter_json_values(stream):
+    """Потоково читать JSON-значения: массив верхнего уровня или JSON Lines"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    in_array = None
+    while True:
+        # Пропускаем пробелы и разделители между значениями
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if in_array is None:
+                in_array = char == '['
+                if in_array:
+                    position += 1
+                    continue
+            if in_array and char == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield value
+                position = end
+                continue
+        elif eof:
+            return
+
+        # Нужно больше данных: дочитываем следующий блок
+        buffer = buffer[position:]
+        position = 0
+        chunk = stream.read(JSON_READ_CHUNK)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+
+def iter_json_rows(stream):
+    """Программы JSON: [{"name": ..., "exercises": [{"exercise": ..., "sets": ..., "day": ...}]}]
+    или по одной программе на строку (JSON Lines).
+    Отдаёт (номер программы, (программа, день, упражнение, подходы) или None, ошибка или None)."""
+    try:
+        for number, program in enumerate(_iter_json_values(stream), start=1):
+            if not isinstance(program, dict) or not isinstance(program.get('exercises'), list):
+                yield number, None, "ожидается объект с полями name и exercises"
+                continue
+            for item in program['exercises']:
+                if isinstance(item, str):
+                    parsed = parse_exercise_line(item)
+                    if parsed is None:
+                        yield number, None, f"неверная строка упражнения: {item!r}"
+                        continue
+                    item = {'exercise': parsed[0], 'sets': parsed[1]}
+                if not isinstance(item, dict):
+                    yield number, None, "упражнение должно быть объектом или строкой"
+                    continue
+                yield (number, *_validate_row(
+                    program.get('name'), item.get('exercise'), item.get('sets'), item.get('day')
+                ))
+    except json.JSONDecodeError as e:
+        yield 0, None, f"ошибка разбора JSON: {e.msg} (позиция {e.pos})"
+
+
+def iter_import_rows(binary_file, filename: str):
+    """Выбрать разборщик по расширению файла"""
+    stream = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    if filename.lower().endswith(('.json', '.jsonl', '.ndjson')):
+        return iter_json_rows(stream)
+    return iter_csv_rows(stream)
@@ -0,0 +1,88 @@
+"""
+Инструментированный доступ к БД: именованные запросы с метриками
+Каждый запрос учитывается в гистограмме длительности и счётчике строк по имени;
+медленные запросы пишутся в журнал вместе с планом EXPLAIN QUERY PLAN.
+Время в БД накапливается для текущего обработчика (см. middlewares.py).
+"""
+import logging
+import time
+from contextvars import ContextVar
+
+from metrics import db_query_duration, db_query_rows, db_slow_queries
+
+logger = logging.getLogger(__name__)
+
+# Порог медленного запроса (сек) и минимальный интервал между планами одного запроса в журнале
+slow_query_threshold = 0.1
+SLOW_QUERY_EXPLAIN_INTERVAL = 300
+
+# Накопитель времени в БД для текущего обработчика: [секунды] или None вне обработчика
+db_time = ContextVar('db_time', default=None)
+
+_explained_at = {}
+
+
+def set_slow_query_threshold(ms: int):
+    global slow_query_threshold
+    slow_query_threshold = ms / 1000
+
+
+async def _explain(db, sql: str, params) -> str:
+    try:
+        async with db.execute(f'EXPLAIN QUERY PLAN {sql}', params) as cursor:
+            plan = await cursor.fetchall()
+    except Exception as e:
+        return f"план недоступен: {e}"
+    return '\n'.join(f"  {detail}" for _, _, _, detail in plan)
+
+
+async def _record(db, name: str, sql: str, params, started: float, rows: int):
+    duration = time.perf_counter() - started
+    db_query_duration.labels(query=name).observe(duration)
+    if rows > 0:
+        db_query_rows.labels(query=name).inc(rows)
+    accumulated = db_time.get()
+    if accumulated is not None:
+        accumulated[0] += duration
+    if duration >= slow_query_threshold:
+        db_slow_queries.labels(query=name).inc()
+        now = time.monotonic()
+        if now - _explained_at.get(name, -SLOW_QUERY_EXPLAIN_INTERVAL) >= SLOW_QUERY_EXPLAIN_INTERVAL:
+            _explained_at[name] = now
+            plan = await _explain(db, sql, params)
+            logger.warning(f"Медленный запрос {name}: {duration * 1000:.1f} мс, строк: {rows}\n{plan}")
+        else:
+            logger.warning(f"Медленный запрос {name}: {duration * 1000:.1f} мс, строк: {rows}")
+
+
+async def execute(db, name: str, sql: str, params=()):
+    """Выполнить запрос без чтения результата; возвращает курсор (lastrowid, rowcount)"""
+    started = time.perf_counter()
+    cursor = await db.execute(sql, params)
+    await _record(db, name, sql, params, started, max(cursor.rowcount, 0))
+    return cursor
+
+
+async def executemany(db, name: str, sql: str, rows):
+    """Выполнить запрос для набора параметров"""
+    rows = list(rows)
+    started = time.perf_counter()
+    await db.executemany(sql, rows)
+    await _record(db, name, sql, rows[0] if rows else (), started, len(rows))
+
+
+async def fetchall(db, name: str, sql: str, params=()) -> list:
+    started = time.perf_counter()
+    async with db.execute(sql, params) as cursor:
+        rows = await cursor.fetchall()
+    await _record(db, name, sql, params, started, len(rows))
+    return rows
+
+
+async def fetchone(db, name: str, sql: str, params=()):
+    started = time.perf_counter()
+    async with db.execute(sql, params) as cursor:
+        row = await cursor.fetchone()
+    await _record(db, name, sql, params, started, 1 if row is not None else 0)
+    return row
+
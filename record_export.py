@@ -0,0 +1,65 @@
+"""
+Экспорт записей тренировок в сжатые файлы CSV и NDJSON
+Строки читаются страницами по ключу records.id и пишутся в gzip-поток временного файла,
+поэтому память не зависит от объёма истории, а соединение с БД занято только на время чтения страницы
+"""
+import csv
+import gzip
+import io
+import json
+
+# Поддерживаемые форматы: формат -> расширение файла
+EXPORT_FORMATS = {
+    'csv': 'csv',
+    'ndjson': 'ndjson',
+}
+
+# Столбцы экспорта в порядке выборки
+EXPORT_COLUMNS = ('date', 'created_at', 'program', 'day', 'exercise', 'set_number', 'weight')
+
+# Страница записей вместе с названиями программы и упражнения в порядке сохранения:
+# параметры - последний выгруженный records.id и размер страницы; первый столбец (id) в файл не пишется
+EXPORT_PAGE_QUERY = '''
+    SELECT r.id, r.date, r.created_at, p.name, e.day, e.exercise, r.set_number, r.weight
+    FROM records r
+    JOIN programs p ON r.program_id = p.id
+    JOIN exercises e ON r.exercise_id = e.id
+    WHERE r.id > ?
+    ORDER BY r.id
+    LIMIT ?
+'''
+
+
+def export_filename(export_format: str, day: str) -> str:
+    """Имя файла экспорта, например workouts-2024-01-31.csv.gz"""
+    return f"workouts-{day}.{EXPORT_FORMATS[export_format]}.gz"
+
+
+class RecordsExportWriter:
+    """Потоковая запись строк экспорта в gzip-файл"""
+
+    def __init__(self, file, export_format: str, compresslevel: int = 6):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат экспорта: {export_format}")
+        self.export_format = export_format
+        self.rows = 0
+        # GzipFile не закрывает переданный файл: он остаётся открытым для отправки
+        self._gzip = gzip.GzipFile(fileobj=file, mode='wb', compresslevel=compresslevel)
+        self._text = io.TextIOWrapper(self._gzip, encoding='utf-8', newline='')
+        if export_format == 'csv':
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows):
+        """Записать порцию строк в порядке EXPORT_COLUMNS"""
+        if self.export_format == 'csv':
+            self._csv.writerows(rows)
+        else:
+            self._text.writelines(
+                json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows
+            )
+        self.rows += len(rows)
+
+    def close(self):
+        """Дописать буферы и завершить gzip-поток"""
+        self._text.close()
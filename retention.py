@@ -0,0 +1,158 @@
+"""
+Хранение журнала операций
+Сырые строки operations старше окна хранения сворачиваются по дням в operations_daily
+(количество и число разных пользователей по типу операции), затем удаляются небольшими
+транзакциями, чтобы не держать блокировку записи долго. Освободившиеся страницы файла БД
+возвращаются шагами incremental_vacuum (БД в режиме auto_vacuum=INCREMENTAL, см. db_init.py).
+"""
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+
+import queries
+
+from metrics import (
+    operations_rolled_up_days, operations_pruned, operations_pruned_last_run,
+    db_pages_reclaimed, db_freelist_pages, retention_duration
+)
+
+logger = logging.getLogger(__name__)
+
+# Последний день, сводка которого в operations_daily завершена
+WATERMARK = 'operations_rolled_up_through'
+
+
+class OperationsRetention:
+    """Свёртка, удаление старых строк журнала операций и возврат свободных страниц"""
+
+    def __init__(self, pool, retention_days: int = 90, chunk_size: int = 1000,
+                 vacuum_pages: int = 256, pause_ms: int = 10):
+        self.pool = pool
+        self.retention_days = retention_days
+        self.chunk_size = chunk_size
+        self.vacuum_pages = vacuum_pages
+        # Пауза между транзакциями: даёт очереди записи и обработчикам захватить блокировку
+        self.pause = pause_ms / 1000
+
+    async def run(self) -> dict:
+        """Один проход хранения; возвращает количество свёрнутых дней, удалённых строк и страниц"""
+        started = time.perf_counter()
+        cutoff = (date.today() - timedelta(days=self.retention_days)).isoformat()
+        rolled_up = await self.roll_up(cutoff)
+        pruned = await self.prune()
+        reclaimed = await self.vacuum()
+        retention_duration.set(time.perf_counter() - started)
+        if rolled_up or pruned or reclaimed:
+            logger.info(
+                f"Хранение журнала операций: свёрнуто дней {rolled_up}, удалено строк {pruned}, "
+                f"возвращено страниц {reclaimed}"
+            )
+        return {'rolled_up_days': rolled_up, 'pruned': pruned, 'reclaimed_pages': reclaimed}
+
+    async def _watermark(self, db):
+        row = await queries.fetchone(
+            db, 'maintenance_state', 'SELECT value FROM maintenance_state WHERE name = ?', (WATERMARK,)
+        )
+        return row[0] if row else None
+
+    async def roll_up(self, cutoff: str) -> int:
+        """Свернуть полные дни до cutoff (не включая), каждый день - отдельная транзакция"""
+        async with self.pool.acquire() as db:
+            watermark = await self._watermark(db)
+            row = await queries.fetchone(
+                db, 'operations_oldest_day',
+                'SELECT date(MIN(created_at)) FROM operations WHERE created_at >= ?',
+                (self._next_day(watermark) if watermark else '',)
+            )
+        if row[0] is None:
+            return 0
+        day = row[0]
+        days = 0
+        while day < cutoff:
+            next_day = self._next_day(day)
+            async with self.pool.acquire() as db:
+                await db.execute('BEGIN IMMEDIATE')
+                await queries.execute(db, 'operations_rollup', '''
+                    INSERT INTO operations_daily (date, operation_type, count, distinct_users)
+                    SELECT ?, operation_type, COUNT(*), COUNT(DISTINCT user_id)
+                    FROM operations
+                    WHERE created_at >= ? AND created_at < ?
+                    GROUP BY operation_type
+                    ON CONFLICT(date, operation_type) DO UPDATE SET
+                        count = excluded.count,
+                        distinct_users = excluded.distinct_users
+                ''', (day, day, next_day))
+                # Отметка сдвигается в той же транзакции, что и сводка
+                await queries.execute(db, 'maintenance_state_update', '''
+                    INSERT INTO maintenance_state (name, value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                ''', (WATERMARK, day))
+                await db.commit()
+            operations_rolled_up_days.inc()
+            days += 1
+            day = next_day
+            await asyncio.sleep(self.pause)
+        return days
+
+    async def prune(self) -> int:
+        """Удалить свёрнутые строки порциями по chunk_size"""
+        async with self.pool.acquire() as db:
+            watermark = await self._watermark(db)
+        if watermark is None:
+            operations_pruned_last_run.set(0)
+            return 0
+        # Удаляются только дни, сводка которых уже записана
+        boundary = self._next_day(watermark)
+        total = 0
+        while True:
+            async with self.pool.acquire() as db:
+                cursor = await queries.execute(db, 'operations_prune', '''
+                    DELETE FROM operations WHERE id IN (
+                        SELECT id FROM operations WHERE created_at < ? ORDER BY created_at LIMIT ?
+                    )
+                ''', (boundary, self.chunk_size))
+                await db.commit()
+            deleted = max(cursor.rowcount, 0)
+            total += deleted
+            operations_pruned.inc(deleted)
+            if deleted < self.chunk_size:
+                break
+            await asyncio.sleep(self.pause)
+        operations_pruned_last_run.set(total)
+        return total
+
+    async def vacuum(self) -> int:
+        """Вернуть свободные страницы файловой системе шагами по vacuum_pages"""
+        reclaimed = 0
+        while True:
+            async with self.pool.acquire() as db:
+                free_before = await self._freelist(db)
+                if free_before == 0 or not await self._incremental(db):
+                    db_freelist_pages.set(free_before)
+                    return reclaimed
+                # Через execute() модуль sqlite3 выполняет только один шаг прагмы (одна страница),
+                # executescript() доводит её до конца
+                await db.executescript(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)});')
+                free_after = await self._freelist(db)
+            db_freelist_pages.set(free_after)
+            step = free_before - free_after
+            db_pages_reclaimed.inc(max(step, 0))
+            reclaimed += max(step, 0)
+            if step <= 0:
+                return reclaimed
+            await asyncio.sleep(self.pause)
+
+    @staticmethod
+    async def _freelist(db) -> int:
+        async with db.execute('PRAGMA freelist_count') as cursor:
+            return (await cursor.fetchone())[0]
+
+    @staticmethod
+    async def _incremental(db) -> bool:
+        async with db.execute('PRAGMA auto_vacuum') as cursor:
+            return (await cursor.fetchone())[0] == 2
+
+    @staticmethod
+    def _next_day(day: str) -> str:
+        return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
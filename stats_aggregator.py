@@ -0,0 +1,109 @@
+"""
+Инкрементальные счётчики для метрик базы данных
+Счётчики поддерживаются триггерами SQLite в сводных таблицах (см. db_init.py),
+полный пересчёт выполняется только при запуске и при периодической сверке
+"""
+import logging
+from datetime import date, timedelta
+
+import queries
+
+from metrics import (
+    users_total, users_active_today, operations_today,
+    programs_total, programs_active, records_total, records_today
+)
+
+logger = logging.getLogger(__name__)
+
+
+class StatsAggregator:
+    """Чтение сводных таблиц в метрики и сверка их с исходными таблицами"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._day = None
+        self._operation_types = set()
+
+    async def reconcile(self):
+        """Полный пересчёт итоговых счётчиков и счётчиков за сегодня"""
+        today = date.today().isoformat()
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        async with self.pool.acquire() as db:
+            # Блокировка на запись: триггеры не изменят счётчики во время пересчёта
+            await db.execute('BEGIN IMMEDIATE')
+            await db.execute('DELETE FROM stats_totals')
+            await queries.execute(db, 'stats_reconcile_totals', '''
+                INSERT INTO stats_totals (name, value)
+                SELECT 'users', COUNT(*) FROM users
+                UNION ALL SELECT 'programs', COUNT(*) FROM programs
+                UNION ALL SELECT 'programs_active', COUNT(*) FROM programs WHERE active = 1
+                UNION ALL SELECT 'records', COUNT(*) FROM records
+            ''')
+
+            await db.execute('DELETE FROM stats_daily_records WHERE day = ?', (today,))
+            await queries.execute(db, 'stats_reconcile_records', '''
+                INSERT INTO stats_daily_records (day, count)
+                SELECT ?, COUNT(*) FROM records WHERE date = ?
+            ''', (today, today))
+
+            await db.execute('DELETE FROM stats_daily_operations WHERE day = ?', (today,))
+            await queries.execute(db, 'stats_reconcile_operations', '''
+                INSERT INTO stats_daily_operations (day, operation_type, count)
+                SELECT ?, operation_type, COUNT(*)
+                FROM operations
+                WHERE created_at >= ? AND created_at < ?
+                GROUP BY operation_type
+            ''', (today, today, tomorrow))
+
+            await db.execute('DELETE FROM stats_daily_users WHERE day = ?', (today,))
+            await queries.execute(db, 'stats_reconcile_users', '''
+                INSERT INTO stats_daily_users (day, user_id)
+                SELECT DISTINCT ?, user_id FROM operations
+                WHERE created_at >= ? AND created_at < ?
+            ''', (today, today, tomorrow))
+            await db.commit()
+        logger.info("Сводные счётчики метрик пересчитаны")
+
+    async def _rollover(self, today: str):
+        """Смена суток: удалить списки активных пользователей за прошлые дни"""
+        async with self.pool.acquire() as db:
+            await db.execute('DELETE FROM stats_daily_users WHERE day < ?', (today,))
+            await db.commit()
+
+    async def refresh(self):
+        """Обновить метрики из сводных таблиц"""
+        today = date.today().isoformat()
+        if self._day is not None and self._day != today:
+            await self._rollover(today)
+        self._day = today
+
+        async with self.pool.acquire() as db:
+            totals = dict(await queries.fetchall(db, 'stats_totals', 'SELECT name, value FROM stats_totals'))
+
+            active_today = (await queries.fetchone(
+                db, 'stats_active_users', 'SELECT COUNT(*) FROM stats_daily_users WHERE day = ?', (today,)
+            ))[0]
+
+            row = await queries.fetchone(
+                db, 'stats_records_today', 'SELECT count FROM stats_daily_records WHERE day = ?', (today,)
+            )
+            records_today_count = row[0] if row else 0
+
+            operations = dict(await queries.fetchall(
+                db, 'stats_operations_today',
+                'SELECT operation_type, count FROM stats_daily_operations WHERE day = ?', (today,)
+            ))
+
+        users_total.set(totals.get('users', 0))
+        users_active_today.set(active_today)
+        programs_total.set(totals.get('programs', 0))
+        programs_active.set(totals.get('programs_active', 0))
+        records_total.set(totals.get('records', 0))
+        records_today.set(records_today_count)
+
+        # Типы операций, которых сегодня ещё не было, обнуляются
+        for op_type in self._operation_types - operations.keys():
+            operations_today.labels(operation_type=op_type).set(0)
+        for op_type, count in operations.items():
+            operations_today.labels(operation_type=op_type).set(count)
+        self._operation_types |= operations.keys()
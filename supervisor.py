@@ -0,0 +1,467 @@
+"""
+Запуск бота в нескольких процессах
+Супервизор получает обновления (polling или вебхук) и распределяет их по процессам-обработчикам
+по ID пользователя: все обновления одного пользователя обрабатывает один процесс, поэтому его
+состояние FSM и записи в БД не требуют межпроцессных блокировок.
+Перезапущенный обработчик получает своих пользователей обратно только после того, как остальные
+обработчики завершили начатые обновления и записали состояния FSM в БД (передача пользователей).
+Метрики процессов собираются супервизором и отдаются на общем /metrics с меткой worker.
+"""
+import os
+import asyncio
+import logging
+import multiprocessing
+import queue
+import secrets
+import signal
+import time
+
+from aiohttp import web
+from prometheus_client import CollectorRegistry, Counter, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import Metric
+from prometheus_client.parser import text_string_to_metric_families
+
+from metrics import DB_WIDE_METRICS
+
+logger = logging.getLogger(__name__)
+
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', str(os.cpu_count() or 1)))
+WORKER_MAX_CONCURRENT = int(os.getenv('WORKER_MAX_CONCURRENT', '64'))
+WORKER_METRICS_INTERVAL = int(os.getenv('WORKER_METRICS_INTERVAL', '15'))
+WORKER_RESTART_DELAY = 1.0
+WORKER_RESTART_DELAY_MAX = 30.0
+# Сколько ждать подтверждений передачи пользователей перезапущенному обработчику (сек)
+HANDOFF_TIMEOUT = 10.0
+# Обработчик, который ведёт сверку счётчиков, хранение журнала и метрики всей БД
+DB_METRICS_WORKER = 0
+POLLING_TIMEOUT = 10
+
+# Метрики супервизора (отдельный реестр: метрики бота приходят от процессов-обработчиков)
+registry = CollectorRegistry()
+workers_alive = Gauge('bot_workers_alive', 'Количество работающих процессов-обработчиков', registry=registry)
+worker_restarts = Counter(
+    'bot_worker_restarts_total', 'Перезапуски процессов-обработчиков', ['worker'], registry=registry
+)
+routed_updates = Counter(
+    'bot_routed_updates_total', 'Обновления, переданные процессам-обработчикам', ['worker'], registry=registry
+)
+
+
+# Процесс-обработчик
+
+def worker_main(index: int, workers: int, updates, metrics_out, acks, reconcile: bool):
+    """Точка входа процесса-обработчика"""
+    # Ctrl+C получает вся группа процессов; останавливает обработчики супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        format=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(run_worker(index, workers, updates, metrics_out, acks, reconcile))
+
+
+async def run_worker(index: int, workers: int, updates, metrics_out, acks, reconcile: bool):
+    """Обработка обновлений из очереди супервизора"""
+    import bot as bot_module
+
+    # Общий лимит отправки Telegram делится между процессами
+    bot_module.outbound_scheduler.set_global_rate(bot_module.OUTBOUND_GLOBAL_RATE / workers)
+
+    # Метрики отправляются без гарантии доставки: выход процесса не ждёт, пока супервизор их прочитает
+    metrics_out.cancel_join_thread()
+
+    def push_metrics():
+        try:
+            metrics_out.put_nowait((index, generate_latest().decode('utf-8')))
+        except queue.Full:
+            pass
+
+    async def metrics_loop():
+        while True:
+            await asyncio.sleep(WORKER_METRICS_INTERVAL)
+            push_metrics()
+
+    async def feed(update):
+        try:
+            await bot_module.dp.feed_raw_update(bot_module.bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления: {e}", exc_info=True)
+        finally:
+            semaphore.release()
+
+    def next_update():
+        # Без супервизора очередь больше не пополнится
+        parent = multiprocessing.parent_process()
+        while True:
+            try:
+                return updates.get(timeout=1)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    return None
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(WORKER_MAX_CONCURRENT)
+    tasks = set()
+    await bot_module.startup(reconcile=reconcile)
+    metrics_task = asyncio.create_task(metrics_loop())
+    push_metrics()
+    logger.info(f"Обработчик {index} запущен (PID {os.getpid()})")
+    try:
+        while True:
+            update = await loop.run_in_executor(None, next_update)
+            if update is None:
+                break
+            if update.get('control') == 'reset_caches':
+                await bot_module.reset_caches()
+                continue
+            if update.get('control') == 'handoff':
+                # Пользователи возвращаются перезапущенному обработчику: начатые обновления
+                # завершаются, состояния FSM записываются в БД, затем супервизор получает подтверждение
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                await bot_module.reset_caches()
+                acks.put((index, update['token']))
+                continue
+            await semaphore.acquire()
+            task = asyncio.create_task(feed(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        metrics_task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await bot_module.shutdown()
+        await bot_module.bot.session.close()
+        push_metrics()
+        logger.info(f"Обработчик {index} остановлен")
+
+
+# Супервизор
+
+def update_user_key(update: dict) -> int:
+    """Ключ распределения: ID пользователя, иначе ID чата, иначе номер обновления"""
+    for field, event in update.items():
+        if field == 'update_id' or not isinstance(event, dict):
+            continue
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return update.get('update_id', 0)
+
+
+class WorkerMetricsCollector:
+    """Последние метрики каждого обработчика с добавленной меткой worker.
+    Метрики всей БД берутся только у DB_METRICS_WORKER и отдаются без метки worker."""
+
+    def __init__(self):
+        self.latest = {}
+
+    def collect(self):
+        families = {}
+        for index, text in sorted(self.latest.items()):
+            for family in text_string_to_metric_families(text):
+                db_wide = family.name in DB_WIDE_METRICS
+                if db_wide and index != DB_METRICS_WORKER:
+                    continue
+                merged = families.get(family.name)
+                if merged is None:
+                    merged = families[family.name] = Metric(family.name, family.documentation, family.type)
+                for sample in family.samples:
+                    # Время создания счётчиков и гистограмм (сэмплы *_created внутри семейства)
+                    # у каждого процесса своё и не объединяется
+                    if sample.name.endswith('_created'):
+                        continue
+                    labels = sample.labels if db_wide else {**sample.labels, 'worker': str(index)}
+                    merged.add_sample(sample.name, labels, sample.value)
+        return list(families.values())
+
+
+class Supervisor:
+    """Запуск и перезапуск обработчиков, распределение обновлений по ID пользователя"""
+
+    def __init__(self, workers: int):
+        self.size = workers
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = [None] * workers
+        self.queues = [None] * workers
+        self.restart_delays = [WORKER_RESTART_DELAY] * workers
+        self.restart_at = [0.0] * workers
+        self.metrics_in = self.context.Queue(maxsize=workers * 4)
+        # Подтверждения передачи пользователей: (номер обработчика, номер передачи)
+        self.acks = self.context.Queue()
+        # Перезапущенный обработчик -> передача: номер, ожидаемые подтверждения, срок, отложенные обновления
+        self.handoffs = {}
+        self.handoff_token = 0
+        self.collector = WorkerMetricsCollector()
+        registry.register(self.collector)
+
+    def live_workers(self) -> list:
+        return [i for i, process in enumerate(self.processes) if process is not None and process.is_alive()]
+
+    def start_worker(self, index: int):
+        self.queues[index] = self.context.Queue()
+        process = self.context.Process(
+            target=worker_main,
+            args=(index, self.size, self.queues[index], self.metrics_in, self.acks, index == DB_METRICS_WORKER),
+            name=f'bot-worker-{index}',
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Запущен обработчик {index} (PID {process.pid})")
+
+    def route(self, update: dict, live: list = None):
+        """Передать обновление обработчику пользователя.
+        Пока обработчик перезапускается, его пользователей обслуживают остальные."""
+        live = live if live is not None else self.live_workers()
+        if not live:
+            logger.error("Нет работающих обработчиков, обновление отброшено")
+            return
+        key = update_user_key(update)
+        index = key % self.size
+        handoff = self.handoffs.get(index)
+        if handoff is not None:
+            # Обработчик ещё не принял своих пользователей: обновление ждёт завершения передачи
+            handoff['buffer'].append(update)
+            return
+        if index not in live:
+            index = live[key % len(live)]
+        self.queues[index].put(update)
+        routed_updates.labels(worker=str(index)).inc()
+
+    def broadcast(self, message: dict, exclude: int = None):
+        for index in self.live_workers():
+            if index != exclude:
+                self.queues[index].put(message)
+
+    def start_handoff(self, index: int):
+        """Вернуть пользователей перезапущенному обработчику после подтверждения остальных"""
+        waiting = set(self.live_workers()) - {index}
+        if not waiting:
+            return
+        self.handoff_token += 1
+        self.handoffs[index] = {
+            'token': self.handoff_token,
+            'waiting': waiting,
+            'deadline': time.monotonic() + HANDOFF_TIMEOUT,
+            'buffer': [],
+        }
+        self.broadcast({'control': 'handoff', 'token': self.handoff_token}, exclude=index)
+
+    def check_handoffs(self):
+        """Учесть подтверждения передачи и отдать отложенные обновления"""
+        while True:
+            try:
+                worker, token = self.acks.get_nowait()
+            except queue.Empty:
+                break
+            for handoff in self.handoffs.values():
+                if handoff['token'] == token:
+                    handoff['waiting'].discard(worker)
+        live = self.live_workers()
+        now = time.monotonic()
+        for index, handoff in list(self.handoffs.items()):
+            # Упавший обработчик подтверждения не пришлёт: его состояния FSM уже потеряны
+            handoff['waiting'] &= set(live)
+            if handoff['waiting'] and now < handoff['deadline']:
+                continue
+            if handoff['waiting']:
+                logger.warning(
+                    f"Нет подтверждения передачи пользователей обработчику {index} "
+                    f"от обработчиков {sorted(handoff['waiting'])}"
+                )
+            self.release_handoff(index, live)
+
+    def release_handoff(self, index: int, live: list = None):
+        handoff = self.handoffs.pop(index)
+        for update in handoff['buffer']:
+            self.route(update, live)
+
+    def check_workers(self):
+        """Перезапуск упавших обработчиков; их необработанные обновления передаются остальным"""
+        now = time.monotonic()
+        rebalanced = False
+        for index, process in enumerate(self.processes):
+            if process is None or process.is_alive():
+                continue
+            if self.restart_at[index] == 0.0:
+                logger.error(f"Обработчик {index} завершился с кодом {process.exitcode}")
+                self.restart_at[index] = now + self.restart_delays[index]
+                self.restart_delays[index] = min(self.restart_delays[index] * 2, WORKER_RESTART_DELAY_MAX)
+                self.collector.latest.pop(index, None)
+                self.redistribute(index)
+                rebalanced = True
+            elif now >= self.restart_at[index]:
+                self.restart_at[index] = 0.0
+                worker_restarts.labels(worker=str(index)).inc()
+                self.start_worker(index)
+                self.start_handoff(index)
+        if rebalanced:
+            # Пользователи сменили обработчик: кэши состояний в других процессах могли устареть
+            self.broadcast({'control': 'reset_caches'})
+        self.check_handoffs()
+        workers_alive.set(len(self.live_workers()))
+
+    def redistribute(self, index: int):
+        """Забрать обновления из очереди упавшего обработчика"""
+        pending = self.queues[index]
+        pending.cancel_join_thread()
+        live = self.live_workers()
+        # Обработчик упал, не дождавшись передачи: отложенные для него обновления получают остальные
+        if index in self.handoffs:
+            self.release_handoff(index, live)
+        while True:
+            try:
+                update = pending.get_nowait()
+            except (queue.Empty, OSError, EOFError):
+                break
+            if update is not None and 'control' not in update:
+                self.route(update, live)
+
+    def collect_metrics(self):
+        while True:
+            try:
+                index, text = self.metrics_in.get_nowait()
+            except queue.Empty:
+                break
+            if self.processes[index] is not None and self.processes[index].is_alive():
+                self.collector.latest[index] = text
+                # Обработчик успешно запустился - сбрасываем задержку перезапуска
+                self.restart_delays[index] = WORKER_RESTART_DELAY
+
+    def stop(self, timeout: float = 30):
+        for index in list(self.handoffs):
+            self.release_handoff(index)
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                self.queues[index].put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(deadline - time.monotonic(), 0))
+                if process.is_alive():
+                    logger.warning(f"Обработчик {process.name} не остановился, завершаем принудительно")
+                    process.terminate()
+        for updates in self.queues:
+            if updates is not None:
+                updates.cancel_join_thread()
+        self.acks.cancel_join_thread()
+
+
+async def monitor(supervisor: Supervisor):
+    while True:
+        await asyncio.sleep(1)
+        supervisor.collect_metrics()
+        supervisor.check_workers()
+
+
+async def poll_updates(supervisor: Supervisor, bot, allowed_updates):
+    """Long polling в супервизоре"""
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при получении обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            supervisor.route(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+def create_supervisor_app(supervisor: Supervisor, webhook_path: str = None, secret_token: str = None):
+    """HTTP сервер супервизора: /metrics, /health и, в режиме вебхука, приём обновлений"""
+
+    async def metrics_handler(request):
+        supervisor.collect_metrics()
+        return web.Response(
+            body=generate_latest(registry),
+            content_type=CONTENT_TYPE_LATEST.split(';')[0],
+            charset='utf-8'
+        )
+
+    async def health_handler(request):
+        if not supervisor.live_workers():
+            return web.Response(text="NO WORKERS", status=503)
+        return web.Response(text="OK", status=200)
+
+    async def webhook_handler(request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, secret_token):
+            return web.Response(body="Unauthorized", status=401)
+        supervisor.route(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/health', health_handler)
+    if webhook_path:
+        app.router.add_post(webhook_path, webhook_handler)
+    return app
+
+
+async def main():
+    import bot as bot_module
+
+    # Миграции применяются один раз до запуска обработчиков
+    await bot_module.init_db()
+
+    supervisor = Supervisor(BOT_WORKERS)
+    for index in range(BOT_WORKERS):
+        supervisor.start_worker(index)
+    workers_alive.set(BOT_WORKERS)
+
+    webhook_mode = bot_module.BOT_MODE == 'webhook'
+    app = create_supervisor_app(
+        supervisor,
+        bot_module.WEBHOOK_PATH if webhook_mode else None,
+        bot_module.WEBHOOK_SECRET
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    metrics_port = int(os.getenv('METRICS_PORT', '8000'))
+    await web.TCPSite(runner, '0.0.0.0', metrics_port).start()
+    logger.info(f"Супервизор: {BOT_WORKERS} обработчиков, метрики на порту {metrics_port}")
+
+    bot = bot_module.bot
+    allowed_updates = bot_module.dp.resolve_used_update_types()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    tasks = [asyncio.create_task(monitor(supervisor))]
+    try:
+        if webhook_mode:
+            if not bot_module.WEBHOOK_URL:
+                raise ValueError("WEBHOOK_URL не установлен в переменных окружения!")
+            await bot.set_webhook(
+                url=bot_module.WEBHOOK_URL.rstrip('/') + bot_module.WEBHOOK_PATH,
+                secret_token=bot_module.WEBHOOK_SECRET,
+                allowed_updates=allowed_updates,
+                max_connections=min(bot_module.WEBHOOK_MAX_CONCURRENT, 100)
+            )
+        else:
+            tasks.append(asyncio.create_task(poll_updates(supervisor, bot, allowed_updates)))
+        await stop_event.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await runner.cleanup()
+        await asyncio.to_thread(supervisor.stop)
+        await bot.session.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - supervisor - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+"""
+Общие фикстуры тестов: база данных во временном каталоге, созданная db_init.init_database()
+"""
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+import db_init
+
+# bot.py проверяет токен при импорте; запросы к Telegram в тестах не выполняются
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Путь к новой базе данных со всеми таблицами и миграциями"""
+    path = str(tmp_path / 'gym.db')
+    monkeypatch.setattr(db_init, 'DATABASE_PATH', path)
+    db_init.init_database()
+    return path
+
+
+@pytest.fixture
+def connection(database):
+    conn = sqlite3.connect(database)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def run_bot(database, monkeypatch):
+    """Выполнить корутину с пулом соединений бота, открытым на тестовой базе"""
+    import bot
+    monkeypatch.setattr(bot.db_pool, 'database', database)
+    bot.program_cache.invalidate()
+
+    def run(coroutine_function, *args):
+        async def main():
+            await bot.db_pool.open()
+            try:
+                return await coroutine_function(*args)
+            finally:
+                await bot.db_pool.close()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,84 @@
+"""
+Сопоставление названий упражнений с каталогом (exercise_catalog.resolve_exercise)
+"""
+import bot
+import db_init
+from exercise_catalog import fuzzy_match_allowed, normalize_exercise_name, resolve_exercise_sync
+
+
+def resolve(connection, name):
+    return resolve_exercise_sync(connection.cursor(), name)
+
+
+def test_spelling_variants_share_catalog_entry(connection):
+    catalog_id, name = resolve(connection, 'Жим лёжа')
+    assert resolve(connection, '  жим   лежа ') == (catalog_id, name)
+    assert name == 'Жим лёжа'
+
+
+def test_typo_matches_existing_entry(connection):
+    catalog_id, _ = resolve(connection, 'Жим гантелей лёжа на скамье')
+    assert resolve(connection, 'Жим гантелеи лёжа на скамье') == (catalog_id, 'Жим гантелей лёжа на скамье')
+
+
+def test_different_word_is_not_merged(connection):
+    seated_id, _ = resolve(connection, 'Жим гантелей сидя на скамье')
+    lying_id, lying_name = resolve(connection, 'Жим гантелей лёжа на скамье')
+    assert lying_id != seated_id
+    assert lying_name == 'Жим гантелей лёжа на скамье'
+
+
+def test_swapped_words_are_not_merged():
+    assert not fuzzy_match_allowed(normalize_exercise_name('Лёжа жим гантелей'), 'Жим лёжа гантелей')
+
+
+def test_numbered_names_are_not_merged(connection):
+    first_id, _ = resolve(connection, 'Отжимания 1')
+    second_id, _ = resolve(connection, 'Отжимания 2')
+    assert first_id != second_id
+
+
+def test_extra_word_is_not_merged(connection):
+    deadlift_id, _ = resolve(connection, 'Становая тяга')
+    sumo_id, _ = resolve(connection, 'Становая тяга сумо')
+    assert deadlift_id != sumo_id
+
+
+def test_short_names_match_only_exactly(connection):
+    first_id, _ = resolve(connection, 'Шраги')
+    second_id, _ = resolve(connection, 'Шрагм')
+    assert first_id != second_id
+    assert resolve(connection, 'шраги')[0] == first_id
+
+
+def test_migration_splits_false_merge(connection):
+    cursor = connection.cursor()
+    seated_id, _ = resolve(connection, 'Жим гантелей сидя на скамье')
+    # Слияние по прежнему правилу: написание «лёжа» указывает на запись «сидя»
+    cursor.execute(
+        'INSERT INTO exercise_names (normalized, catalog_id) VALUES (?, ?)',
+        (normalize_exercise_name('Жим гантелей лёжа на скамье'), seated_id)
+    )
+    cursor.execute("INSERT INTO programs (name, active) VALUES ('A', 1)")
+    program_id = cursor.lastrowid
+    cursor.executemany(
+        'INSERT INTO exercises (program_id, day, exercise, sets, position, canonical_exercise_id) '
+        'VALUES (?, 1, ?, 3, ?, ?)',
+        [(program_id, 'Жим гантелей сидя на скамье', 0, seated_id),
+         (program_id, 'Жим гантелей лёжа на скамье', 1, seated_id)]
+    )
+    db_init.split_mismatched_exercises(cursor)
+    cursor.execute('SELECT exercise, canonical_exercise_id FROM exercises ORDER BY position')
+    (_, seated), (_, lying) = cursor.fetchall()
+    assert seated == seated_id
+    assert lying not in (None, seated_id)
+
+
+def test_program_reports_only_real_spelling_differences(run_bot):
+    run_bot(bot.create_program, 'A', [(1, 'Жим гантелей лёжа', 3, 0)])
+    _, matched = run_bot(bot.create_program, 'B', [
+        (1, 'жим  гантелей лежа', 3, 0),
+        (1, 'Жим гантелеи лёжа', 3, 1),
+        (1, 'Жим гантелей сидя', 3, 2),
+    ])
+    assert matched == [('Жим гантелеи лёжа', 'Жим гантелей лёжа')]
@@ -0,0 +1,63 @@
+"""
+Личные рекорды при сохранении подхода (bot.save_record): флаги PR_WEIGHT и PR_VOLUME
+"""
+import bot
+import db_init
+
+
+def create_program(run_bot, connection, name, exercise):
+    """Программа с одним упражнением; возвращает (ID программы, ID упражнения)"""
+    program_id, _ = run_bot(bot.create_program, name, [(1, exercise, 3, 0)])
+    exercise_id, = connection.execute('SELECT id FROM exercises WHERE program_id = ?', (program_id,)).fetchone()
+    return program_id, exercise_id
+
+
+def add_yesterday(connection, program_id, exercise_id, weights):
+    """Подходы вчерашней тренировки с пересборкой агрегатов и рекордов"""
+    connection.executemany(
+        "INSERT INTO records (program_id, exercise_id, set_number, weight, date) "
+        "VALUES (?, ?, ?, ?, date('now', '-1 day'))",
+        [(program_id, exercise_id, number, weight) for number, weight in enumerate(weights, 1)]
+    )
+    cursor = connection.cursor()
+    db_init.rebuild_daily_exercise_stats(cursor)
+    db_init.rebuild_catalog_personal_records(cursor)
+    connection.commit()
+
+
+def save(run_bot, program_id, exercise_id, set_number, weight):
+    return run_bot(bot.save_record, program_id, exercise_id, set_number, weight)
+
+
+def test_first_set_is_not_a_record(run_bot, connection):
+    program_id, exercise_id = create_program(run_bot, connection, 'A', 'Жим лёжа')
+    assert save(run_bot, program_id, exercise_id, 1, 80) == (0, 80)
+
+
+def test_weight_record(run_bot, connection):
+    program_id, exercise_id = create_program(run_bot, connection, 'A', 'Жим лёжа')
+    save(run_bot, program_id, exercise_id, 1, 80)
+    improvement, _ = save(run_bot, program_id, exercise_id, 2, 85)
+    assert improvement == bot.PR_WEIGHT
+    improvement, _ = save(run_bot, program_id, exercise_id, 3, 85)
+    assert improvement == 0
+
+
+def test_volume_record_is_flagged_once_per_day(run_bot, connection):
+    program_id, exercise_id = create_program(run_bot, connection, 'A', 'Присед')
+    add_yesterday(connection, program_id, exercise_id, [100, 100])
+    assert save(run_bot, program_id, exercise_id, 1, 50) == (0, 200)
+    assert save(run_bot, program_id, exercise_id, 2, 60) == (0, 200)
+    assert save(run_bot, program_id, exercise_id, 3, 95) == (bot.PR_VOLUME, 205)
+    # Объём дня растёт дальше, но рекорд этого дня уже отмечен
+    assert save(run_bot, program_id, exercise_id, 4, 10) == (0, 215)
+    assert save(run_bot, program_id, exercise_id, 5, 120) == (bot.PR_WEIGHT, 335)
+
+
+def test_volume_record_sums_programs(run_bot, connection):
+    first_program, first_exercise = create_program(run_bot, connection, 'A', 'Присед')
+    second_program, second_exercise = create_program(run_bot, connection, 'B', 'присед')
+    add_yesterday(connection, first_program, first_exercise, [100, 50])
+    assert save(run_bot, first_program, first_exercise, 1, 100) == (0, 150)
+    # Объём дня по упражнению каталога - сумма подходов обеих программ
+    assert save(run_bot, second_program, second_exercise, 1, 60) == (bot.PR_VOLUME, 160)
@@ -0,0 +1,54 @@
+"""
+Кэш профилей пользователей в памяти процесса
+Позволяет не перезаписывать строку users, если профиль не менялся
+"""
+import time
+from collections import OrderedDict
+
+from metrics import user_cache_hits, user_cache_misses, user_cache_size
+
+
+class UserProfileCache:
+    """LRU-кэш последних сохранённых профилей (username, first_name, last_name) с TTL"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._profiles = OrderedDict()
+        self._pending_touches = set()
+
+    def matches(self, user_id: int, profile: tuple) -> bool:
+        """Проверить, что в БД уже сохранён такой же профиль"""
+        entry = self._profiles.get(user_id)
+        if entry is not None:
+            cached_profile, stored_at = entry
+            if cached_profile == profile and time.monotonic() - stored_at < self.ttl:
+                self._profiles.move_to_end(user_id)
+                user_cache_hits.inc()
+                return True
+        user_cache_misses.inc()
+        return False
+
+    def remember(self, user_id: int, profile: tuple):
+        """Запомнить профиль, отправленный на запись в БД"""
+        self._profiles[user_id] = (profile, time.monotonic())
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+        # Запись профиля сама обновляет last_activity
+        self._pending_touches.discard(user_id)
+        user_cache_size.set(len(self._profiles))
+
+    def touch(self, user_id: int):
+        """Отметить активность пользователя для отложенного обновления last_activity"""
+        self._pending_touches.add(user_id)
+
+    def drain_touches(self) -> list:
+        """Забрать накопленные отметки активности"""
+        touches = list(self._pending_touches)
+        self._pending_touches.clear()
+        return touches
+
+    def clear(self):
+        self._profiles.clear()
+        user_cache_size.set(0)
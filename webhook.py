@@ -0,0 +1,67 @@
+"""
+Приём обновлений Telegram через вебхук на HTTP-сервере метрик
+Запрос подтверждается сразу, обновление обрабатывается в фоне;
+число одновременно обрабатываемых обновлений ограничено
+"""
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from metrics import webhook_updates_in_flight, webhook_unauthorized
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука с проверкой секретного токена и ограничением параллельности"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, max_concurrent: int = 64, **data):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True,
+                         secret_token=secret_token, **data)
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tasks = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.bot):
+            webhook_unauthorized.inc()
+            return web.Response(body="Unauthorized", status=401)
+        return await self._handle_request_background(bot=self.bot, request=request)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        # Пока все слоты заняты, ответ Telegram задерживается - это и есть обратное давление
+        await self._semaphore.acquire()
+        webhook_updates_in_flight.inc()
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._tasks.add(task)
+        task.add_done_callback(self._release)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    def _release(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._semaphore.release()
+        webhook_updates_in_flight.dec()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Ошибка при обработке обновления из вебхука: {task.exception()}")
+
+    async def close(self) -> None:
+        """Дождаться обработки принятых обновлений и закрыть сессию бота"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await super().close()
+
+
+def setup_webhook(app: web.Application, dispatcher: Dispatcher, bot: Bot, path: str,
+                  secret_token: str, max_concurrent: int = 64) -> BoundedRequestHandler:
+    """Зарегистрировать обработчик вебхука в приложении aiohttp"""
+    handler = BoundedRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=secret_token,
+        max_concurrent=max_concurrent
+    )
+    handler.register(app, path=path)
+    return handler
@@ -0,0 +1,156 @@
+"""
+Отложенная пакетная запись (write-behind) для служебных INSERT/UPDATE
+Накапливает запросы в ограниченной очереди и записывает их одной транзакцией.
+Пакет, не записанный из-за занятой БД (database is locked), записывается повторно с нарастающей паузой.
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+
+from metrics import (
+    write_behind_queue_depth, write_behind_batch_size, write_behind_flush_duration,
+    write_behind_retries, write_behind_dropped
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Очередь запросов, сбрасываемая раз в flush_interval_ms или по batch_size строк"""
+
+    def __init__(self, pool, flush_interval_ms: int = 200, batch_size: int = 200, max_queue: int = 10000,
+                 max_retries: int = 5, retry_delay_ms: int = 50):
+        self.pool = pool
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay_ms / 1000
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_ready = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        """Запустить фоновую задачу сброса очереди"""
+        if self.is_running:
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Очередь отложенной записи запущена "
+            f"(интервал: {self.flush_interval * 1000:.0f} мс, пакет: {self.batch_size})"
+        )
+
+    async def stop(self):
+        """Остановить очередь, предварительно записав всё накопленное"""
+        if not self.is_running:
+            return
+        self._stopping = True
+        self._batch_ready.set()
+        # Пустой элемент будит задачу, если она ждёт новых запросов
+        await self._queue.put(None)
+        try:
+            await self._task
+        finally:
+            self._task = None
+        logger.info("Очередь отложенной записи остановлена")
+
+    async def put(self, sql: str, params: tuple = ()):
+        """Поставить запрос в очередь (ждёт, если очередь заполнена)"""
+        if not self.is_running or self._stopping:
+            # Очередь не запущена - пишем сразу, чтобы запрос не потерялся
+            await self._flush([(sql, params)])
+            return
+        await self._queue.put((sql, params))
+        depth = self._queue.qsize()
+        write_behind_queue_depth.set(depth)
+        if depth >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _collect(self) -> list:
+        """Собрать пакет: до batch_size запросов или до истечения интервала"""
+        batch = []
+        item = await self._queue.get()
+        if item is not None:
+            batch.append(item)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    batch.append(item)
+            if len(batch) >= self.batch_size or self._stopping:
+                break
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            self._batch_ready.clear()
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        write_behind_queue_depth.set(self._queue.qsize())
+        return batch
+
+    async def _run(self):
+        while not (self._stopping and self._queue.empty()):
+            try:
+                batch = await self._collect()
+                if batch:
+                    await self._flush(batch)
+            except Exception as e:
+                logger.error(f"Ошибка в очереди отложенной записи: {e}")
+
+    async def _flush(self, batch: list):
+        """Записать пакет одной транзакцией, сохраняя порядок запросов.
+        При занятой БД запись повторяется до max_retries раз, затем пакет отбрасывается."""
+        start_time = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self._write(batch)
+                    return
+                except sqlite3.OperationalError as e:
+                    if not self._retryable(e) or attempt == self.max_retries:
+                        raise
+                    write_behind_retries.inc()
+                    delay = self.retry_delay * 2 ** attempt
+                    logger.warning(
+                        f"БД занята при записи пакета ({len(batch)} запросов), повтор через {delay * 1000:.0f} мс"
+                    )
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            write_behind_dropped.inc(len(batch))
+            logger.error(f"Ошибка при записи пакета ({len(batch)} запросов), пакет отброшен: {e}")
+        finally:
+            write_behind_batch_size.observe(len(batch))
+            write_behind_flush_duration.observe(time.perf_counter() - start_time)
+
+    async def _write(self, batch: list):
+        # Незавершённая транзакция откатывается пулом при возврате соединения
+        async with self.pool.acquire() as db:
+            # Подряд идущие одинаковые запросы выполняются через executemany
+            group_sql, group_params = None, []
+            for sql, params in batch:
+                if sql != group_sql and group_params:
+                    await db.executemany(group_sql, group_params)
+                    group_params = []
+                group_sql = sql
+                group_params.append(params)
+            if group_params:
+                await db.executemany(group_sql, group_params)
+            await db.commit()
+
+    @staticmethod
+    def _retryable(error: sqlite3.OperationalError) -> bool:
+        """Временная ошибка: БД заблокирована другим соединением или процессом"""
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message